@@ -0,0 +1,232 @@
+"""
+# Ads Applet Daemon
+
+Long-running mode for the ads applet service, started with
+`service.py --daemon`.
+
+Instead of being started by a shell loop every 15 minutes, the daemon keeps
+its parsed manifests in memory and runs its own scheduler:
+
+- Every `--poll-interval` seconds, clients with changed ad configs are found
+  and only those clients are processed again. Changes are found through
+  filesystem notifications (when `watchdog` is installed and the mount can
+  deliver them; FUSE mounts such as sshfs can not) or by globbing and
+  stat-ing against the in-memory manifests.
+- Every `--full-interval` seconds every client is processed, which picks up
+  anything notifications missed and keeps time-based reports current.
+
+After every cycle, a status file is written which can be checked with
+`service.py --health`.
+"""
+
+import json
+import logging
+import os
+import signal
+import tempfile
+import threading
+import time
+from datetime import datetime
+from os.path import basename, dirname, relpath, sep
+
+import service
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # Only polling is available
+    FileSystemEventHandler = object
+    Observer = None
+
+# Filesystems which do not deliver change notifications for remote changes
+NO_NOTIFY_FILESYSTEMS = ("fuse", "nfs", "cifs", "smb")
+
+
+def mount_supports_notify(path: str):
+    """
+    Find the filesystem type of the mount containing `path` and check whether
+    it delivers change notifications.
+    """
+    path = os.path.realpath(path)
+    fstype = None
+    longest = -1
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                _, mount_point, mount_fstype = line.split()[:3]
+                if ((path == mount_point or
+                        path.startswith(mount_point.rstrip(sep) + sep)) and
+                        len(mount_point) > longest):
+                    fstype = mount_fstype
+                    longest = len(mount_point)
+    except IOError:
+        return False
+    return fstype is not None and not fstype.startswith(NO_NOTIFY_FILESYSTEMS)
+
+
+class ChangeHandler(FileSystemEventHandler):
+    """
+    Collects the IDs of clients for which an ad config file changed.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    def on_any_event(self, event):
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if not path or basename(path) not in service.AD_FILENAMES:
+                continue
+            client_id_str = relpath(path, service.BASE).split(sep)[0]
+            if client_id_str.isnumeric():
+                with self.lock:
+                    self.dirty.add(client_id_str)
+
+    def pop(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+        return dirty
+
+
+class Daemon:
+    def __init__(self, args):
+        self.pool = args.pool
+        self.workers = args.workers
+        self.watch = args.watch
+        self.poll_interval = args.poll_interval
+        self.full_interval = args.full_interval
+        self.status_file = args.status_file
+        self.handler = None
+        self.observer = None
+        self.stopping = threading.Event()
+        self.status = {
+            "pid": os.getpid(),
+            "started": datetime.now().isoformat(),
+            "watch": "poll",
+            "healthy": True,
+            "last_run": None,
+            "last_full_run": None,
+        }
+
+    def start_watching(self):
+        if self.watch == "poll":
+            return
+        if Observer is None:
+            logging.warning("watchdog is not installed, polling for changes")
+            return
+        if self.watch == "auto" and not mount_supports_notify(service.BASE):
+            logging.info("%s does not deliver change notifications, polling "
+                         "for changes", service.BASE)
+            return
+        try:
+            self.handler = ChangeHandler()
+            self.observer = Observer()
+            self.observer.schedule(self.handler, service.BASE, recursive=True)
+            self.observer.start()
+        except OSError as e:
+            logging.error("Could not watch %s, polling for changes: %r",
+                          service.BASE, e)
+            self.handler = self.observer = None
+            return
+        self.status["watch"] = "notify"
+
+    def changed_clients(self):
+        if self.handler is not None:
+            return self.handler.pop()
+        changed = set()
+        for client_id_str in service.list_clients():
+            try:
+                if service.client_changed(client_id_str):
+                    changed.add(client_id_str)
+            except Exception as e:
+                logging.error("Exception checking client %r: %r",
+                              client_id_str, e)
+        return changed
+
+    def write_status(self):
+        directory = dirname(self.status_file) or "."
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.status, f)
+            os.replace(tmp_path, self.status_file)
+        except IOError as e:
+            logging.error("Could not write status file %r: %r",
+                          self.status_file, e)
+
+    def run_cycle(self, full: bool):
+        started = time.monotonic()
+        client_ids = None if full else sorted(self.changed_clients())
+        if client_ids == []:
+            return
+        try:
+            results, errors = service.run(self.pool, self.workers, client_ids)
+        except Exception as e:
+            # Most likely the resources volume being unavailable
+            logging.error("Exception running ads applet: %r", e)
+            results, errors = {}, {"*": repr(e)}
+        finished = datetime.now().isoformat()
+        self.status["last_run"] = {
+            "finished": finished,
+            "full": full,
+            "duration": time.monotonic() - started,
+            "clients": len(results),
+            "errors": errors,
+        }
+        if full:
+            self.status["last_full_run"] = finished
+        self.status["healthy"] = "*" not in errors
+        logging.info("Processed %d clients (%d errors, full: %s)",
+                     len(results), len(errors), full)
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def run_forever(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.start_watching()
+
+        next_full = time.monotonic()
+        while not self.stopping.is_set():
+            full = time.monotonic() >= next_full
+            if full:
+                next_full = time.monotonic() + self.full_interval
+            self.run_cycle(full)
+            self.status["checked"] = datetime.now().isoformat()
+            self.write_status()
+            self.stopping.wait(self.poll_interval)
+
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+        return 0
+
+
+def check_health(status_file: str, max_age: float):
+    """
+    Return 0 if the daemon's last full run finished within `max_age` seconds
+    and was healthy, 1 otherwise.
+    """
+    try:
+        with open(status_file) as f:
+            status = json.load(f)
+    except (IOError, ValueError) as e:
+        print("Unreadable status file %r: %r" % (status_file, e))
+        return 1
+    try:
+        if not status.get("healthy") or status.get("last_full_run") is None:
+            print("Unhealthy: %r" % status.get("last_run"))
+            return 1
+        last_full_run = datetime.fromisoformat(status["last_full_run"])
+        age = (datetime.now() - last_full_run).total_seconds()
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        # Written by a different version, or not a status at all
+        print("Invalid status file %r: %r" % (status_file, e))
+        return 1
+    if age > max_age:
+        print("Last full run was %.0fs ago" % age)
+        return 1
+    return 0
@@ -8,11 +8,32 @@ What It Do:
 This is a service designed for generating an "ads_report.json" in an Applet
 directory, which will be used for generating a report on what ads are coming
 up and what ads are going to go out of date.
+
+Parsed ad configs are kept in a manifest per client, along with the mtime and
+size of every config file; on every run only new or changed files are parsed
+again, and files that no longer exist are dropped from the manifest.
+
+Clients are independent of each other, and can be processed in a thread pool
+or a process pool with `--pool` and `--workers` (or ADS_POOL and ADS_WORKERS).
+
+With `--daemon`, the service keeps running and only rescans clients whose ad
+configs changed; see daemon.py.
+
+Reports are published to the dashboard atomically, see common/reporting.py.
 """
 
+import argparse
+import concurrent.futures
 import glob
+import hashlib
 import itertools
+import json
 import logging
+import os
+import sys
+import tempfile
+import threading
+import time
 from datetime import date, datetime, timedelta
 from os import listdir
 from os.path import join
@@ -22,8 +43,22 @@ from mediapanel.config.ads import (AdsConfig, AdsVerticalConfig,
                                    AdsHorizontalConfig)
 from mediapanel.timedelta import human_readable
 
+try:
+    import reporting
+except ImportError:  # Run from the repository rather than the applet image
+    sys.path.append(join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, os.pardir, "common"))
+    import reporting
+
 logging.basicConfig(level=logging.DEBUG)
 
+# Find files for ad configs
+BASE = "/resources"
+HOMEDIR = "home/mediapanel/themes/displayAD"
+ADS_TYPES = ["adConfig", "adConfig_horizontal", "adConfig_vertical"]
+AD_FILENAMES = {ads_type + ".json" for ads_type in ADS_TYPES}
+MANIFEST_DIR = os.environ.get("ADS_MANIFEST_DIR", "/applets/ads_manifest")
+
 
 def readable_time_until(now: datetime, then: date):
     """
@@ -36,30 +71,10 @@ def readable_time_until(now: datetime, then: date):
     return human_readable(td)
 
 
-# Find files for ad configs
-BASE = "/resources"
-HOMEDIR = "home/mediapanel/themes/displayAD"
-ADS_TYPES = ["adConfig", "adConfig_horizontal", "adConfig_vertical"]
-
-# Loop through files and categorize into upcoming and expired
-upcoming_ads = {}
-expiring_ads = {}
-today = date.today()
-now = datetime.now()
-
-# TODO DOING: rewrite loop to go through all clients, and then go through all
-# globs in THAT directory
-
-ads_mgr = StorageManager("media_scheduler", "index")
-
-for client_id_str in listdir(BASE):
-    if not client_id_str.isnumeric():
-        continue
-    logging.debug("Working for client #%s", client_id_str)
-    client_id = int(client_id_str)
-    upcoming = []
-    expiring = []
-
+def find_ad_files(client_id_str: str):
+    """
+    Find all ad config files for devices and groups of a client.
+    """
     # Setting up where to search for files
     # -- Device files
     # 1/*/home/mediapanel/themes/displayAD/adConfig.json
@@ -74,46 +89,334 @@ for client_id_str in listdir(BASE):
                  for ads_type in ADS_TYPES]
     GROUP_PATH = [join(BASE_PATH, "*", HOMEDIR, ads_type + ".json")
                   for ads_type in ADS_TYPES]
-    logging.debug("%r", USER_PATH)
-    logging.debug("%r", GROUP_PATH)
     matched_files = [glob.iglob(user_path)
                      for user_path in USER_PATH]
     matched_files += [glob.iglob(group_path)
                       for group_path in GROUP_PATH]
-    for filename in itertools.chain(*matched_files):
-        logging.debug("Loading file: %r", filename)
+    return list(itertools.chain(*matched_files))
+
+
+def load_ads(filename: str):
+    """
+    Parse an ad config file into a list of ad summaries, containing only the
+    fields required for building a report.
+    """
+    logging.debug("Loading file: %r", filename)
+    # Load advertisements for specific type
+    if "vertical" in filename:
+        ads_config = AdsVerticalConfig.from_v6_file(filename)
+    elif "horizontal" in filename:
+        ads_config = AdsHorizontalConfig.from_v6_file(filename)
+    else:
+        ads_config = AdsConfig.from_v6_file(filename)
+
+    return [{
+        "name": ad.name,
+        "start": ad.timeframe.start_day.isoformat(),
+        "end": ad.timeframe.end_day.isoformat(),
+    } for ad in ads_config.ads]
+
+
+class Manifest:
+    """
+    Parsed ad summaries of every ad config file of a client, keyed by file
+    path and validated by the mtime and size of the file.
+    """
+
+    def __init__(self, client_id_str: str):
+        self.path = join(MANIFEST_DIR, client_id_str + ".json")
+        self.entries = {}
+        self.report_hash = None
+        self.changed = False
+        self.parsed = 0
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.entries = data["files"]
+            self.report_hash = data.get("report_hash")
+        except FileNotFoundError:
+            pass
+        except (IOError, KeyError, ValueError) as e:
+            # Rebuilding the manifest only costs a full scan
+            logging.error("Discarding unreadable manifest %r: %r",
+                          self.path, e)
+            self.entries = {}
+            self.report_hash = None
+        return self
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=MANIFEST_DIR, suffix=".tmp")
         try:
-            # Load advertisements for specific type
-            if "vertical" in filename:
-                ads_config = AdsVerticalConfig.from_v6_file(filename)
-            elif "horizontal" in filename:
-                ads_config = AdsHorizontalConfig.from_v6_file(filename)
-            else:
-                ads_config = AdsConfig.from_v6_file(filename)
-
-            # Loop through advertisements and find upcoming or expiring
-            for ad in ads_config.ads:
-                start_time = ad.timeframe.start_day
-                start_day = start_time.date()
-                end_time = ad.timeframe.end_day
-                end_day = end_time.date()
-                if timedelta(days=0) > today - start_day > timedelta(days=-4):
-                    upcoming.append({
-                        "name": ad.name,
-                        "link": "#",
-                        "time_left": readable_time_until(now, start_time)})
-                elif timedelta(days=5) > end_day - today > timedelta(days=0):
-                    upcoming.append({
-                        "name": ad.name,
-                        "link": "#",
-                        "time_left": readable_time_until(now, end_time)})
-
-            logging.debug("Saving ads for client: %r", client_id)
-            # Store upcoming and expiring advertisements to file
-            ads_mgr.save({"upcoming": upcoming, "expiring": expiring},
-                         client_id)
-
-        except IOError as e:
-            logging.error("IOError with file %r: %r", filename, e)
-        except Exception as e:
-            logging.error("Generic exception with file %r: %r", filename, e)
+            with os.fdopen(fd, "w") as f:
+                json.dump({"files": self.entries,
+                           "report_hash": self.report_hash}, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.changed = False
+
+    def is_stale(self, filenames):
+        """
+        Check whether any of the given files is new, changed or removed
+        compared to the manifest, without parsing anything.
+        """
+        if set(self.entries) != set(filenames):
+            return True
+        for filename in filenames:
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                return True
+            entry = self.entries[filename]
+            if (entry["mtime"] != stat.st_mtime or
+                    entry["size"] != stat.st_size):
+                return True
+        return False
+
+    def refresh(self, filenames):
+        """
+        Bring the manifest up to date with the given files and return every
+        ad summary; only files that are new or have changed are parsed.
+        """
+        self.parsed = 0
+        for filename in set(self.entries) - set(filenames):
+            logging.debug("Dropping removed file: %r", filename)
+            del self.entries[filename]
+            self.changed = True
+
+        for filename in filenames:
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                # Removed between globbing and now
+                if self.entries.pop(filename, None) is not None:
+                    self.changed = True
+                continue
+            entry = self.entries.get(filename)
+            if (entry is not None and entry["mtime"] == stat.st_mtime and
+                    entry["size"] == stat.st_size):
+                continue
+            try:
+                ads = load_ads(filename)
+                self.parsed += 1
+            except IOError as e:
+                logging.error("IOError with file %r: %r", filename, e)
+                continue
+            except Exception as e:
+                logging.error("Generic exception with file %r: %r",
+                              filename, e)
+                continue
+            self.entries[filename] = {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "ads": ads,
+            }
+            self.changed = True
+
+        return [ad for entry in self.entries.values() for ad in entry["ads"]]
+
+
+def build_report(ads, now: datetime):
+    """
+    Loop through advertisements and find upcoming or expiring.
+    """
+    today = now.date()
+    upcoming = []
+    expiring = []
+    for ad in ads:
+        start_time = datetime.fromisoformat(ad["start"])
+        start_day = start_time.date()
+        end_time = datetime.fromisoformat(ad["end"])
+        end_day = end_time.date()
+        if timedelta(days=0) > today - start_day > timedelta(days=-4):
+            upcoming.append({
+                "name": ad["name"],
+                "link": "#",
+                "time_left": readable_time_until(now, start_time)})
+        elif timedelta(days=5) > end_day - today > timedelta(days=0):
+            expiring.append({
+                "name": ad["name"],
+                "link": "#",
+                "time_left": readable_time_until(now, end_time)})
+    return {"upcoming": upcoming, "expiring": expiring}
+
+
+# Manifests are kept in memory between runs of a long-running process
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(client_id_str: str):
+    with _manifests_lock:
+        manifest = _manifests.get(client_id_str)
+        if manifest is None:
+            manifest = Manifest(client_id_str).load()
+            _manifests[client_id_str] = manifest
+    return manifest
+
+
+def list_clients():
+    return [client_id_str for client_id_str in listdir(BASE)
+            if client_id_str.isnumeric()]
+
+
+def client_changed(client_id_str: str):
+    """
+    Check whether the ad config files of a client changed since the last time
+    it was processed, by globbing and stat-ing only.
+    """
+    return get_manifest(client_id_str).is_stale(find_ad_files(client_id_str))
+
+
+def process_client(client_id_str: str, now: datetime):
+    """
+    Refresh the manifest and save the report of a single client. Clients are
+    independent of each other, so this can run in a thread or process pool.
+    """
+    logging.debug("Working for client #%s", client_id_str)
+    started = time.monotonic()
+    client_id = int(client_id_str)
+    ads_mgr = StorageManager("media_scheduler", "index")
+
+    manifest = get_manifest(client_id_str)
+    ads = manifest.refresh(find_ad_files(client_id_str))
+
+    # The whole report is built before anything is written, and only written
+    # if it differs from the last report saved for this client
+    report = build_report(ads, now)
+    report_hash = hashlib.sha256(
+        json.dumps(report, sort_keys=True).encode("utf8")).hexdigest()
+    saved = report_hash != manifest.report_hash
+    if saved:
+        logging.debug("Saving ads for client: %r", client_id)
+        # Store upcoming and expiring advertisements to file, and publish
+        # them to the dashboard atomically
+        reporting.save_report(ads_mgr, "media_scheduler", "index",
+                              client_id, report)
+        manifest.report_hash = report_hash
+        manifest.changed = True
+
+    manifest.save()
+
+    return {
+        "client_id": client_id,
+        "files": len(manifest.entries),
+        "parsed": manifest.parsed,
+        "saved": saved,
+        "duration": time.monotonic() - started,
+    }
+
+
+def run(pool: str = "serial", workers: int = None, client_ids=None):
+    """
+    Process every client (or only `client_ids`), either one at a time or
+    fanned out over a "thread" or "process" pool. Returns per-client results
+    and per-client errors.
+    """
+    now = datetime.now()
+    if client_ids is None:
+        client_ids = list_clients()
+    results = {}
+    errors = {}
+
+    if pool == "serial":
+        for client_id_str in client_ids:
+            try:
+                results[client_id_str] = process_client(client_id_str, now)
+            except Exception as e:
+                logging.error("Exception with client %r: %r",
+                              client_id_str, e)
+                errors[client_id_str] = repr(e)
+        return results, errors
+
+    executor_class = POOLS[pool]
+    with executor_class(max_workers=workers) as executor:
+        futures = {executor.submit(process_client, client_id_str, now):
+                   client_id_str for client_id_str in client_ids}
+        for future in concurrent.futures.as_completed(futures):
+            client_id_str = futures[future]
+            try:
+                results[client_id_str] = future.result()
+            except Exception as e:
+                logging.error("Exception with client %r: %r",
+                              client_id_str, e)
+                errors[client_id_str] = repr(e)
+    if pool == "process":
+        # Manifests were refreshed in the worker processes, so the copies in
+        # this process are stale and are loaded again when needed
+        with _manifests_lock:
+            for client_id_str in client_ids:
+                _manifests.pop(client_id_str, None)
+    return results, errors
+
+
+POOLS = {
+    "thread": concurrent.futures.ThreadPoolExecutor,
+    "process": concurrent.futures.ProcessPoolExecutor,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="mediaPanel ads applet")
+    parser.add_argument("--pool", choices=["serial"] + list(POOLS),
+                        default=os.environ.get("ADS_POOL", "serial"),
+                        help="how to fan clients out (env: ADS_POOL)")
+    parser.add_argument("--workers", type=int,
+                        default=os.environ.get("ADS_WORKERS"),
+                        help="pool size, defaults to the executor's default "
+                             "(env: ADS_WORKERS)")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and rescan clients as their ad "
+                             "configs change")
+    parser.add_argument("--health", action="store_true",
+                        help="exit with an error if the daemon's status file "
+                             "is missing, stale or unhealthy")
+    parser.add_argument("--watch", choices=["auto", "notify", "poll"],
+                        default=os.environ.get("ADS_WATCH", "auto"),
+                        help="how the daemon finds changes, \"auto\" uses "
+                             "filesystem notifications unless the mount "
+                             "cannot deliver them (env: ADS_WATCH)")
+    parser.add_argument("--poll-interval", type=float,
+                        default=os.environ.get("ADS_POLL_INTERVAL", 60),
+                        help="seconds between checks for changed clients "
+                             "(env: ADS_POLL_INTERVAL)")
+    parser.add_argument("--full-interval", type=float,
+                        default=os.environ.get("ADS_FULL_INTERVAL", 900),
+                        help="seconds between reports for every client, "
+                             "which also keeps time-based reports current "
+                             "(env: ADS_FULL_INTERVAL)")
+    parser.add_argument("--status-file",
+                        default=os.environ.get("ADS_STATUS_FILE",
+                                               "/applets/ads_status.json"),
+                        help="where the daemon writes its health and last "
+                             "run (env: ADS_STATUS_FILE)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.health or args.daemon:
+        import daemon
+        if args.health:
+            return daemon.check_health(args.status_file,
+                                       args.full_interval * 2)
+        return daemon.Daemon(args).run_forever()
+
+    started = time.monotonic()
+    results, errors = run(args.pool, args.workers)
+    slowest = max((result["duration"] for result in results.values()),
+                  default=0)
+    logging.info("Processed %d clients (%d errors) in %.2fs, slowest client "
+                 "took %.2fs", len(results), len(errors),
+                 time.monotonic() - started, slowest)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+Publishing applet reports to the dashboard.
+
+Reports are saved with `StorageManager` as before, and a copy is published at
+`REPORT_VERSION_DIR/<applet>/<report>/<client_id>.json` by writing a
+temporary file in the same directory and renaming it over the previous one,
+so the dashboard never reads a half-written report. The dashboard caches a
+published report until the file is replaced.
+
+Both only apply when the dashboard and the applet share the directories
+(`REPORT_VERSION_DIR` and `SNAPSHOT_CACHE_DIR`).
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from os.path import join
+
+SNAPSHOT_CACHE_DIR = os.environ.get("SNAPSHOT_CACHE_DIR")
+REPORT_VERSION_DIR = os.environ.get("REPORT_VERSION_DIR")
+
+
+def write_atomic(path: str, text: str):
+    # Readers see either the previous file or the whole new one
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def invalidate_snapshots(client_id: int):
+    # The dashboard's cached snapshots of the client, so the new report is
+    # shown on the next page view
+    if SNAPSHOT_CACHE_DIR is not None:
+        shutil.rmtree(join(SNAPSHOT_CACHE_DIR, str(client_id)),
+                      ignore_errors=True)
+
+
+def publish_report(applet: str, report: str, client_id: int, data):
+    if REPORT_VERSION_DIR is not None:
+        write_atomic(join(REPORT_VERSION_DIR, applet, report,
+                          "%i.json" % client_id), json.dumps(data))
+    invalidate_snapshots(client_id)
+
+
+def save_report(manager, applet: str, report: str, client_id: int, data):
+    """
+    Save a report with its `StorageManager`, then publish it.
+    """
+    manager.save(data, client_id)
+    publish_report(applet, report, client_id, data)
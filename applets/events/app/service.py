@@ -0,0 +1,128 @@
+"""
+# Events Applet Service
+
+Based on mediaPanel data format version 6
+
+What It Do:
+
+This is a service designed for generating an "events" report in an Applet
+directory, which will be used by the dashboard for showing what anniversaries
+and events are coming up for every device of a client, without having to parse
+the events configuration of every device on every page view.
+
+Reports are published to the dashboard atomically, see common/reporting.py.
+"""
+
+import logging
+import os
+import sys
+from datetime import date, datetime, timedelta
+from os import listdir
+from os.path import isdir, join
+
+from mediapanel.applets import StorageManager
+from mediapanel.config import EventsConfig
+
+try:
+    import reporting
+except ImportError:  # Run from the repository rather than the applet image
+    sys.path.append(join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, os.pardir, "common"))
+    import reporting
+
+logging.basicConfig(level=logging.DEBUG)
+
+# Find device directories for event configs
+BASE = "/resources"
+UPCOMING_RANGE = timedelta(days=30)
+
+
+def next_occurrence(event_date: date, today: date) -> date:
+    """
+    Next yearly occurrence of a date, today or later. Events on February 29
+    happen on February 28 in other years.
+    """
+    for year in (today.year, today.year + 1):
+        try:
+            occurrence = event_date.replace(year=year)
+        except ValueError:  # February 29 of a year which is not a leap year
+            occurrence = event_date.replace(year=year, day=28)
+        if occurrence >= today:
+            return occurrence
+    return occurrence
+
+
+def upcoming_device_events(client_id: int, device_id: str, now: datetime,
+                           base: str = BASE,
+                           upcoming_range: timedelta = UPCOMING_RANGE):
+    """
+    Find all events for a device happening within `upcoming_range`, as a list
+    of (days until event, [event name, person name, date, device ID]).
+    """
+    try:
+        event_config = EventsConfig.from_v6_id(client_id, device_id,
+                                               base_path=base)
+    except FileNotFoundError:
+        # Expected if a device has no events
+        logging.debug("Could not find events for: %s", device_id)
+        return []
+    except (IOError, KeyError, ValueError) as e:
+        logging.error("Could not load events for %s: %r", device_id, e)
+        return []
+
+    upcoming_events = []
+    for event_name, event in event_config.events.items():
+        for person, event_date in event.events:
+            try:
+                event_range = (next_occurrence(event_date, now.date()) -
+                               now.date())
+                if timedelta(0) < event_range < upcoming_range:
+                    upcoming_events.append((event_range.days, [
+                        event_name, person.name,
+                        event_date.strftime("%B %d"), device_id]))
+            except (AttributeError, TypeError, ValueError) as e:
+                # Only this event is skipped, not every event of the device
+                logging.error("Invalid event %r of %s: %r", event_name,
+                              device_id, e)
+    return upcoming_events
+
+
+def process_client(client_id_str: str, now: datetime, events_mgr,
+                   base: str = BASE):
+    logging.debug("Working for client #%s", client_id_str)
+    client_id = int(client_id_str)
+
+    # -- Device directories
+    # 1/*/
+    device_path = join(base, client_id_str, "1")
+    if not isdir(device_path):
+        return
+
+    upcoming = []
+    for device_id in listdir(device_path):
+        upcoming.extend(upcoming_device_events(client_id, device_id, now,
+                                               base))
+
+    # Soonest events first; every entry keeps its device ID so the dashboard
+    # can limit the report to the devices a user is allowed to see
+    upcoming.sort(key=lambda item: item[0])
+
+    try:
+        logging.debug("Saving events for client: %r", client_id)
+        reporting.save_report(
+            events_mgr, "media_scheduler", "events", client_id,
+            {"upcoming_events": [event for _, event in upcoming]})
+    except IOError as e:
+        logging.error("IOError saving events for client %r: %r", client_id, e)
+
+
+def main():
+    now = datetime.now()
+    events_mgr = StorageManager("media_scheduler", "events")
+    for client_id_str in listdir(BASE):
+        if client_id_str.isnumeric():
+            process_client(client_id_str, now, events_mgr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Cost of encoding response payloads with each JSON backend.
+
+Compares `flask.jsonify` (as the views used to) against every available
+backend of `encoding`, on payloads shaped like the device list, the resource
+list and the dashboard.
+
+Usage: python benchmarks/bench_json.py [rows]
+"""
+
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from flask import Flask, jsonify
+
+from mediapanel_beta import encoding
+
+
+def device_list(count: int) -> dict:
+    now = datetime.now()
+    return {
+        "devices": [{
+            "device_id": "%08x" % i,
+            "nickname": "Lobby display %i" % i,
+            "system_version": "6.7.8",
+            "device_ip": "10.0.%i.%i" % (i // 256 % 256, i % 256),
+            "total_disk": 31205621760,
+            "free_disk": 11205621760 + i,
+            "offline_for": "%i minutes" % (i % 60),
+            "is_offline": i % 7 == 0,
+        } for i in range(count)],
+        "current_time": now,
+        "query": None,
+        "order": "nickname",
+        "limit": count,
+        "next": "WyJMb2JieSBkaXNwbGF5IDk5OSIsICIwMDAwMDNlNyJd",
+    }
+
+
+def resource_list(count: int) -> dict:
+    timestamp = int(datetime.now().timestamp())
+    return {
+        "type": "device",
+        "target_id": "00f6c1ee",
+        "resources": [{
+            "id": i,
+            "filename": "user_video_%i_vid%i.mp4" % (i, i),
+            "is_digital_frame": False,
+            "is_display_ad": True,
+            "is_alerts": False,
+            "is_jukebox": False,
+            "display_name": "Video %i" % i,
+            "thumbnail_name": "user_video_thumb_%i.png" % i,
+            "timestamp": timestamp,
+            "size": 4.57,
+            "resource_url": "/manage/device/1/file/00f6c1ee/"
+                            "user_video_%i_vid%i.mp4" % (i, i),
+            "thumbnail_url": "/manage/device/1/thumbnail/00f6c1ee/256/"
+                             "user_video_%i_vid%i.mp4" % (i, i),
+        } for i in range(count)],
+    }
+
+
+def dashboard(count: int) -> dict:
+    now = datetime.now()
+    device = {
+        "device_id": "00f6c1ee",
+        "nickname": "Lobby display",
+        "system_version": "60708",
+        "offline_for": "2 hours",
+        "last_ping": (now - timedelta(hours=2)).timestamp(),
+        "storage_percentage": 81.5,
+    }
+    return {
+        "current_time": int(now.timestamp()),
+        "current_version": "60708",
+        "counts": {"total": count, "online": count - 50, "offline": 50,
+                   "out_of_date": 50, "storage_warning": 40,
+                   "storage_critical": 10},
+        "offline": [device] * 50,
+        "out_of_date": [device] * 50,
+        "low_storage": [device] * 50,
+        "ads": [["Spring sale", "2026-03-01", "2026-04-01"]] * 20,
+        "events": [["Meeting", "Ryan", "October 18", "00f6c1ee"]] * 20,
+    }
+
+
+def main(count: int = 1000):
+    app = Flask(__name__)
+    payloads = [("device list", device_list(count)),
+                ("resource list", resource_list(count)),
+                ("dashboard", dashboard(count))]
+    backends = [("flask.jsonify", lambda value: jsonify(value).get_data())]
+    backends += [(name, encoding.get_backend(name).dumps)
+                 for name in sorted(encoding.BACKENDS)]
+
+    with app.app_context():
+        for payload_name, payload in payloads:
+            print("%s (%i rows)" % (payload_name, count))
+            for name, dumps in backends:
+                size = len(dumps(payload))
+                best = min(timeit.repeat(lambda: dumps(payload), number=10,
+                                         repeat=5)) / 10
+                print("  %-14s %8.3f ms %9i bytes" % (name, best * 1000,
+                                                      size))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,85 @@
+"""
+Per-row cost of serializing assets for the resource listings.
+
+Compares building every resource dict with a `url_for` call per row (as the
+views used to) against `AssetSerializer`, on synthetic rows shaped like
+`ASSET_COLUMNS`.
+
+Usage: python benchmarks/bench_serializers.py [rows]
+"""
+
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from types import SimpleNamespace
+
+from flask import url_for
+
+from mediapanel_beta import create_app
+from mediapanel_beta.content_manager import thumbnails
+from mediapanel_beta.content_manager.serializers import AssetSerializer
+
+
+def make_rows(count: int):
+    now = datetime.now()
+    return [SimpleNamespace(
+        id=i, client_id=1, device_id="00f6c1ee", group_id=0,
+        filename="user_video_%i_vid%i.mp4" % (i, i),
+        is_digital_frame=False, is_display_ad=True, is_alerts=False,
+        is_jukebox=False, display_name="Video %i" % i,
+        thumbnail_name="user_video_thumb_%i.png" % i, timestamp=now,
+        size=4.57) for i in range(count)]
+
+
+def url_for_per_row(rows, _type):
+    return [{
+        "id": resource.id,
+        "filename": resource.filename,
+        "is_digital_frame": resource.is_digital_frame,
+        "is_display_ad": resource.is_display_ad,
+        "is_alerts": resource.is_alerts,
+        "is_jukebox": resource.is_jukebox,
+        "display_name": resource.display_name,
+        "thumbnail_name": resource.thumbnail_name,
+        "timestamp": int(resource.timestamp.timestamp()),
+        "size": resource.size,
+        "resource_url": url_for(".resource_file", content_type=_type,
+                                client_id=resource.client_id,
+                                target_id=resource.device_id,
+                                filename=resource.filename),
+        "thumbnail_url": (url_for(".resource_thumbnail", content_type=_type,
+                                  client_id=resource.client_id,
+                                  target_id=resource.device_id,
+                                  size=thumbnails.DEFAULT_SIZE,
+                                  filename=resource.filename)
+                          if thumbnails.cache.can_generate(resource.filename)
+                          else None),
+    } for resource in rows]
+
+
+def serializer(rows, _type):
+    return AssetSerializer(_type).serialize_many(rows)
+
+
+def main(count: int = 10000):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "SECRET_KEY": "benchmark",
+        "RESOURCES_FOLDER": tempfile.mkdtemp(),
+        "THUMBNAIL_CACHE_DIR": tempfile.mkdtemp(),
+    })
+    rows = make_rows(count)
+    with app.test_request_context("/manage/device/00f6c1ee/resources"):
+        assert url_for_per_row(rows[:10], "device") == \
+            serializer(rows[:10], "device")
+        for name, fn in [("url_for per row", url_for_per_row),
+                         ("AssetSerializer", serializer)]:
+            best = min(timeit.repeat(lambda: fn(rows, "device"),
+                                     number=1, repeat=5))
+            print("%-16s %8.2f ms total %8.2f us/row" % (
+                name, best * 1000, best / count * 1e6))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,52 @@
+"""
+Cost of computing the status of listed devices (offline time, storage,
+whether they are out of date) with and without NumPy.
+
+Usage: python benchmarks/bench_statuses.py [rows]
+"""
+
+import collections
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from mediapanel_beta import fleet
+
+Row = collections.namedtuple("Row", [column.key for column
+                                     in fleet.DEVICE_COLUMNS])
+
+
+def device_rows(count: int) -> list:
+    rng = random.Random(60708)
+    now = datetime.now()
+    return [Row(device_id="%08x" % i,
+                nickname="Lobby display %i" % i,
+                system_version=rng.choice(["6.7.8", "6.6.0", "6.5.12"]),
+                device_ip="10.0.%i.%i" % (i // 256 % 256, i % 256),
+                last_ping=now - timedelta(seconds=rng.randrange(10 ** 7)),
+                free_disk=rng.randrange(32 * 1024 ** 3),
+                total_disk=32 * 1024 ** 3) for i in range(count)]
+
+
+def main(count: int = 1000):
+    rows = device_rows(count)
+    now = datetime.now()
+    current = fleet.version_number(fleet.DEFAULT_CURRENT_VERSION)
+    implementations = [("python", sys.maxsize)]
+    if fleet.numpy is not None:
+        implementations.append(("numpy", 0))
+
+    default_min_rows = fleet.NUMPY_MIN_ROWS
+    print("device statuses (%i rows)" % count)
+    for name, min_rows in implementations:
+        fleet.NUMPY_MIN_ROWS = min_rows
+        best = min(timeit.repeat(
+            lambda: fleet.DeviceStatuses(rows, now, current), number=10,
+            repeat=5)) / 10
+        print("  %-8s %8.3f ms" % (name, best * 1000))
+    fleet.NUMPY_MIN_ROWS = default_min_rows
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,275 @@
+"""
+Latency and query counts of the main views, and scan time of the ads and
+events applets, for growing fleets.
+
+For every size, given as CLIENTSxDEVICESxASSETS (assets per device), an app
+is created with a new SQLite database and a temporary RESOURCES_FOLDER, the
+fleet is seeded (see fixtures.py), and every view is requested as the first
+client's user. The dashboard snapshot cache is disabled, so every request to
+the index builds its data.
+
+The events scan runs the events applet's per-device step, as its `main`
+does, over the same resources folder. No events configs are written, their
+v6 format being owned by `mediapanel.config.EventsConfig`, so it measures
+looking up the config of every device.
+
+Results are written as JSON, and can be compared with the results of another
+commit with --compare.
+
+Usage: python benchmarks/bench_views.py [--sizes 1x100x10,1x1000x10]
+           [--requests 50] [--ads 5] [--output results.json]
+           [--compare baseline.json]
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+from mediapanel_beta import create_app
+from mediapanel_beta.models import db
+
+import fixtures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "applets", "ads", "app"))
+
+DEFAULT_SIZES = "1x100x10,1x1000x10,1x1000x100"
+WARMUP = 3
+
+
+def parse_size(size: str) -> dict:
+    clients, devices, assets = (int(part) for part in size.split("x"))
+    return {"clients": clients, "devices": devices, "assets": assets}
+
+
+def percentile(values: list, fraction: float) -> float:
+    # Nearest-rank percentile of sorted values
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT,
+                              capture_output=True, check=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self.before_execute)
+
+    def before_execute(self, *args):
+        self.count += 1
+
+
+def measure(client, url: str, counter: QueryCounter, requests: int) -> dict:
+    headers = {"Content-Type": "application/json"}
+    for _ in range(WARMUP):
+        client.get(url, headers=headers)
+
+    timings = []
+    queries = []
+    status = None
+    for _ in range(requests):
+        counter.count = 0
+        start = time.perf_counter()
+        rv = client.get(url, headers=headers)
+        timings.append(time.perf_counter() - start)
+        queries.append(counter.count)
+        status = rv.status_code
+    timings.sort()
+    return {
+        "url": url,
+        "status": status,
+        "requests": requests,
+        "mean_ms": sum(timings) / len(timings) * 1000,
+        "p50_ms": percentile(timings, 0.5) * 1000,
+        "p90_ms": percentile(timings, 0.9) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+        "queries": max(queries),
+    }
+
+
+def measure_ads_scan(resources_folder: str, seeded: list,
+                     manifest_dir: str) -> dict:
+    """
+    Time the ads applet building reports for every client, first with no
+    manifests (a full scan) and then again with unchanged files.
+    """
+    import service
+    service.BASE = resources_folder
+    service.MANIFEST_DIR = manifest_dir
+    service._manifests.clear()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    result = {}
+    now = datetime.now()
+    for run in ("cold", "warm"):
+        files = parsed = 0
+        start = time.perf_counter()
+        for client_id, _, _ in seeded:
+            filenames = service.find_ad_files(str(client_id))
+            manifest = service.get_manifest(str(client_id))
+            service.build_report(manifest.refresh(filenames), now)
+            files += len(filenames)
+            parsed += manifest.parsed
+        result[run + "_seconds"] = time.perf_counter() - start
+        result[run + "_parsed"] = parsed
+    result["files"] = files
+    return result
+
+
+def measure_events_scan(resources_folder: str, seeded: list) -> dict:
+    """
+    Time the events applet looking for the upcoming events of every device.
+    """
+    # Loaded from its path, as the ads applet's module is also `service`
+    spec = importlib.util.spec_from_file_location(
+        "events_service",
+        os.path.join(ROOT, "applets", "events", "app", "service.py"))
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    now = datetime.now()
+    devices = events = 0
+    start = time.perf_counter()
+    for client_id, _, device_ids in seeded:
+        for device_id in device_ids:
+            events += len(service.upcoming_device_events(
+                client_id, device_id, now, base=resources_folder))
+            devices += 1
+    return {"seconds": time.perf_counter() - start, "devices": devices,
+            "events": events}
+
+
+def run_size(size: dict, requests: int, ads: int) -> dict:
+    directory = tempfile.mkdtemp(prefix="mediapanel_bench_")
+    try:
+        resources_folder = os.path.join(directory, "resources")
+        os.makedirs(resources_folder)
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(
+                directory, "bench.db"),
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "SECRET_KEY": "benchmark",
+            "PROXY_MODE": True,
+            "RESOURCES_FOLDER": resources_folder,
+            "SNAPSHOT_TTL": 0,
+        })
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            seeded = fixtures.seed_fleet(**size)
+            seed_seconds = time.perf_counter() - start
+            counter = QueryCounter(db.engine)
+        fixtures.write_ads_tree(resources_folder, seeded, ads)
+
+        client_id, user_id, device_ids = seeded[0]
+        urls = {
+            "index": "/",
+            "list_devices": "/manage/device",
+            "list_devices_search": "/manage/device?search=Display%201",
+            "list_resources": "/manage/device/%s/resources" % device_ids[0],
+            "list_resources_page":
+                "/manage/device/%s/resources?limit=50" % device_ids[0],
+        }
+        views = {}
+        with app.test_client() as client:
+            with client.session_transaction() as session:
+                session["user_id"] = user_id
+                session["client_id"] = client_id
+            for name, url in urls.items():
+                views[name] = measure(client, url, counter, requests)
+
+        return {
+            "size": size,
+            "seed_seconds": seed_seconds,
+            "views": views,
+            "ads_scan": measure_ads_scan(
+                resources_folder, seeded,
+                os.path.join(directory, "ads_manifest")),
+            "events_scan": measure_events_scan(resources_folder, seeded),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def compare(results: dict, baseline: dict):
+    # Print the p50 latency of every view relative to the baseline, to
+    # standard error so the JSON results can still be piped
+    previous = {json.dumps(result["size"], sort_keys=True): result
+                for result in baseline["results"]}
+    for result in results["results"]:
+        key = json.dumps(result["size"], sort_keys=True)
+        if key not in previous:
+            continue
+        print("%(clients)ix%(devices)ix%(assets)i" % result["size"],
+              file=sys.stderr)
+        for name, view in result["views"].items():
+            old = previous[key]["views"].get(name)
+            if old is None:
+                continue
+            print("  %-22s p50 %8.2f ms -> %8.2f ms (%+.0f%%), "
+                  "queries %i -> %i" % (
+                      name, old["p50_ms"], view["p50_ms"],
+                      (view["p50_ms"] / old["p50_ms"] - 1) * 100,
+                      old["queries"], view["queries"]), file=sys.stderr)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark views and the ads and events applets on "
+        "seeded fleets")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="comma separated CLIENTSxDEVICESxASSETS")
+    parser.add_argument("--requests", type=int, default=50,
+                        help="timed requests per view")
+    parser.add_argument("--ads", type=int, default=5,
+                        help="ads in every device's ad config")
+    parser.add_argument("--output", help="file to write JSON results to, "
+                        "instead of standard output")
+    parser.add_argument("--compare", help="JSON results to compare with")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "date": datetime.now().isoformat(),
+        "results": [run_size(parse_size(size), args.requests, args.ads)
+                    for size in args.sizes.split(",")],
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Seeded fleets for the benchmarks.
+
+`seed_fleet` fills the database of an app with `clients` clients, each with
+one user allowed to see `devices` devices, and `assets` assets per device.
+`write_ads_tree` writes ad configs for every device to a resources folder, in
+the directory layout globbed by the ads applet. Data is generated from a
+fixed seed, so every run and every commit benchmarks the same fleet.
+"""
+
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from mediapanel.db.user import UserType
+
+from mediapanel_beta.models import Asset, Client, Device, User, db
+
+SEED = 60708
+SYSTEM_VERSIONS = ["6.7.8", "6.7.8", "6.7.8", "6.6.0", "6.5.12"]
+GIGABYTE = 1024 * 1024 * 1024
+
+
+def device_id(client_number: int, device_number: int) -> str:
+    return "%08x" % (client_number * 1000000 + device_number)
+
+
+def seed_fleet(clients: int, devices: int, assets: int,
+               now: datetime = None) -> list:
+    """
+    Seed the database; must be called in an app context. Returns the
+    `(client_id, user_id, [device IDs])` of every client.
+    """
+    rng = random.Random(SEED)
+    now = now or datetime.now()
+    seeded = []
+    for client_number in range(1, clients + 1):
+        email = "client%i@example.com" % client_number
+        client = Client(email=email, uuid="%08x-0000-4000-8000-%012x" % (
+            client_number, client_number))
+        db.session.add(client)
+        db.session.flush()
+        user = User(client_id=client.client_id, type=UserType.client,
+                    first_name="Client", last_name=str(client_number),
+                    email=email, password="", salt="",
+                    get_alert_emails=0)
+        db.session.add(user)
+
+        device_objects = []
+        for device_number in range(devices):
+            total_disk = rng.choice([16, 32, 64]) * GIGABYTE
+            if rng.random() < 0.8:  # Online
+                last_ping = now - timedelta(seconds=rng.randrange(60))
+            else:
+                last_ping = now - timedelta(minutes=rng.randrange(10, 10000))
+            device_objects.append(Device(
+                device_id=device_id(client_number, device_number),
+                client_id=client.client_id,
+                nickname="Display %i" % device_number,
+                system_version=rng.choice(SYSTEM_VERSIONS),
+                device_ip="10.%i.%i.%i" % (client_number % 256,
+                                           device_number // 256 % 256,
+                                           device_number % 256),
+                last_ping=last_ping,
+                total_disk=total_disk,
+                free_disk=int(total_disk * rng.random())))
+        db.session.add_all(device_objects)
+        user.allowed_devices = device_objects
+        db.session.flush()
+
+        db.session.bulk_insert_mappings(Asset, [{
+            "client_id": client.client_id,
+            "group_id": 0,
+            "device_id": device.device_id,
+            "filename": "user_video_%i_%s.mp4" % (number, device.device_id),
+            "display_name": "Video %i" % number,
+            "is_digital_frame": rng.random() < 0.3,
+            "is_display_ad": rng.random() < 0.5,
+            "is_alerts": False,
+            "is_jukebox": False,
+            "timestamp": now - timedelta(hours=number),
+            "size": round(rng.random() * 50, 2),
+        } for device in device_objects for number in range(assets)])
+        db.session.commit()
+        seeded.append((client.client_id, user.user_id,
+                       [device.device_id for device in device_objects]))
+    return seeded
+
+
+def write_ads_tree(resources_folder: str, seeded: list, ads: int,
+                   now: datetime = None):
+    """
+    Write an adConfig.json with `ads` ads for every seeded device, starting
+    and ending around `now` so that reports contain upcoming and expiring
+    ads. Returns the number of files written.
+    """
+    rng = random.Random(SEED)
+    today = (now or datetime.now()).date()
+    files = 0
+    for client_id, _, device_ids in seeded:
+        for device in device_ids:
+            directory = os.path.join(resources_folder, str(client_id), "1",
+                                     device, "home", "mediapanel", "themes",
+                                     "displayAD")
+            os.makedirs(directory, exist_ok=True)
+            config = {"ads": []}
+            for number in range(ads):
+                start = today + timedelta(days=rng.randrange(-30, 10))
+                config["ads"].append({
+                    "name": "Ad %i" % number,
+                    "filename": "user_image_%i.png" % number,
+                    "timeframe": {
+                        "start_day": start.isoformat(),
+                        "end_day": (start + timedelta(
+                            days=rng.randrange(1, 40))).isoformat(),
+                    },
+                })
+            with open(os.path.join(directory, "adConfig.json"), "w") as f:
+                json.dump(config, f)
+            files += 1
+    return files
@@ -1,14 +1,11 @@
 import logging
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from flask import Flask, g, request, redirect, render_template, jsonify
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 import gigaspoon as gs
-from mediapanel.applets import StorageManager
-from mediapanel.config import EventsConfig
-from mediapanel.timedelta import human_readable as human_readable_timedelta
 
 
 def create_app(test_config: dict = None) -> Flask:
@@ -27,8 +24,11 @@ def create_app(test_config: dict = None) -> Flask:
            if v[:6] == "FLASK_"])
 
     from .app_view import AppRouteView, response
-    from . import auth, models, content_manager
-    for item in [auth, models, content_manager]:
+    from . import (auth, models, content_manager, encoding, fleet,
+                   heartbeats, live, metrics, reports, snapshots)
+    # metrics first, so requests are timed from the first request hook
+    for item in [metrics, auth, models, content_manager, encoding, fleet,
+                 heartbeats, live, reports, snapshots]:
         if getattr(item, "init_app", None) is not None:
             item.init_app(app)
         if getattr(item, "blueprint", None) is not None:
@@ -75,69 +75,40 @@ def create_app(test_config: dict = None) -> Flask:
 
         decorators = [auth.login_redirect]
         template_name = "index.html"
-
-        def get_device_stats(self, data):
-            now = datetime.now()
-            devices = []
-            online = []
-            offline = []
-            out_of_date = []
-
-            for device in g.user.allowed_devices:
-                last_ping = device.last_ping
-                storage_percentage = 1 - device.free_disk / device.total_disk
-                offline_delta = now - last_ping
-                offline_for = human_readable_timedelta(offline_delta)
-
-                version_numbers = device.system_version.split(".")
-                version = (version_numbers[0] +
-                           version_numbers[1].rjust(2, "0") +
-                           version_numbers[2].rjust(2, "0"))
-
-                device_json = {
-                    "device_id": device.device_id,
-                    "nickname": device.nickname,
-                    "system_version": version,
-                    "offline_for": offline_for,
-                    "last_ping": last_ping.timestamp(),
-                    "storage_percentage": storage_percentage * 100,
-                }
-                devices.append(device_json)
-
-                # Sorting online vs offline
-                if offline_delta.days or offline_delta.seconds > 300:
-                    offline.append(device_json)
-                else:
-                    online.append(device_json)
-
-                # List of out of date devices
-                if version < data["current_version"]:
-                    out_of_date.append(device_json)
-
-            return devices, online, offline, out_of_date
+        etag_ignore = ("current_time",)
 
         def populate(self):
+            # Repeat views are served from the snapshot cache; snapshots are
+            # invalidated when devices, applet reports or resources change
+            client_id = g.client.client_id
+            data = snapshots.cache.get(client_id, g.user.user_id)
+            if data is None:
+                data = self.build_snapshot()
+                snapshots.cache.set(client_id, g.user.user_id, data)
+            data = dict(data)
+            data["current_time"] = int(datetime.now().timestamp())
+            return data
+
+        def build_snapshot(self):
             now = datetime.now()
             data = {
                 "current_time": int(now.timestamp()),
-                "current_version": "60708",  # ::TODO:: get from VERSION.json?
+                "current_version": str(fleet.current_version),
             }
 
             # Get device information {{{
-            devices, online, offline, out_of_date = self.get_device_stats(data)
-
-            data["devices"] = devices
-            data["online"] = online
-            data["offline"] = offline
-            data["out_of_date"] = out_of_date
+            # Counted by the database, with a bounded list of devices which
+            # are offline, out of date or low on storage
+            data.update(fleet.fleet_stats(
+                g.user, fleet.current_version,
+                limit=int(app.config.get("DASHBOARD_OFFENDER_LIMIT",
+                                         fleet.OFFENDER_LIMIT))))
             # }}}
 
             # Get ads information {{{
             try:
-                client_id = g.client.client_id
-                ads_mgr = StorageManager("media_scheduler", "index",
-                                         client_id)
-                ads_report = ads_mgr.load()
+                ads_report = reports.load("media_scheduler", "index",
+                                          g.client.client_id)
                 expiring = ads_report["expiring"]
                 upcoming = ads_report["upcoming"]
                 data["ads"] = {
@@ -147,35 +118,31 @@ def create_app(test_config: dict = None) -> Flask:
             except IOError as e:
                 # Any IO error from StorageManager loading the files
                 logging.error("No ads report found: %r", e)
+            except ValueError as e:
+                # Report is being written by the applet or is corrupt
+                logging.error("Unreadable ads report: %r", e)
             finally:
                 if "ads" not in data:
                     data["ads"] = {"expiring_ads": [], "upcoming_ads": []}
             # }}}
 
             # Get upcoming calendar and events {{{
-            # TODO applet-ify
+            # Precomputed for every device of a client by the events applet,
+            # limited here to the devices the user is allowed to see
             upcoming_events = []
-            upcoming_range = timedelta(days=30)
-            for device in devices:
-                try:
-                    event_config = EventsConfig.from_v6_id(
-                        g.client.client_id, device["device_id"],
-                        base_path=app.config["RESOURCES_FOLDER"])
-                except FileNotFoundError:
-                    # Expected if a device has no events
-                    logging.debug("Could not find events for: %s",
-                                  device["device_id"])
-                    continue
-                except IOError as e:
-                    logging.error("Could not load events for %s: %r",
-                                  device["device_id"], e)
-                    continue
-                for event_name, event in event_config.events.items():
-                    for person, date in event.events:
-                        event_range = date.replace(year=now.year) - now.date()
-                        if timedelta(0) < event_range < upcoming_range:
-                            upcoming_events.append((event_name, person.name,
-                                                    date.strftime("%B %d")))
+            device_ids = fleet.allowed_device_ids(g.user)
+            try:
+                events_report = reports.load("media_scheduler", "events",
+                                             g.client.client_id)
+                upcoming_events = [event for event
+                                   in events_report["upcoming_events"]
+                                   if event[3] in device_ids]
+            except IOError as e:
+                # Any IO error from StorageManager loading the files
+                logging.error("No events report found: %r", e)
+            except ValueError as e:
+                # Report is being written by the applet or is corrupt
+                logging.error("Unreadable events report: %r", e)
             data["events"] = {"upcoming_events": upcoming_events}
             # }}}
 
@@ -1,7 +1,65 @@
-from flask import (flash, jsonify, redirect, render_template, Response,
-                   request, url_for)
+import gzip
+import hashlib
+
+from flask import (current_app, flash, make_response, redirect,
+                   render_template, Response, request, session, url_for)
 from flask.views import MethodView
 
+from . import encoding
+from .models import use_replica
+
+try:
+    import brotli
+except ImportError:  # Only gzip is used
+    brotli = None
+
+# Bodies smaller than this are not compressed, see `COMPRESS_MIN_SIZE`
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def json_response(value, status_code: int = 200) -> Response:
+    # Encoded with the configured backend, see `encoding`
+    return Response(encoding.dumps(value), status=status_code,
+                    mimetype=encoding.MIMETYPE)
+
+
+def etag_of(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def not_modified(etag: str) -> Response:
+    rv = Response(status=304)
+    rv.set_etag(etag, weak=True)
+    return rv
+
+
+def compress(rv: Response) -> Response:
+    """
+    Compress the body of a response with brotli (when installed) or gzip, if
+    the client accepts it and the body is larger than `COMPRESS_MIN_SIZE`.
+    """
+    if (rv.status_code != 200 or rv.direct_passthrough or
+            not rv.is_sequence or "Content-Encoding" in rv.headers):
+        return rv
+    rv.vary.add("Accept-Encoding")
+    min_size = int(current_app.config.get("COMPRESS_MIN_SIZE",
+                                          COMPRESS_MIN_SIZE))
+    body = rv.get_data()
+    if len(body) < min_size:
+        return rv
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        rv.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        rv.headers["Content-Encoding"] = "br"
+    elif accepted["gzip"]:
+        rv.set_data(gzip.compress(body, compresslevel=int(
+            current_app.config.get("COMPRESS_LEVEL", COMPRESS_LEVEL))))
+        rv.headers["Content-Encoding"] = "gzip"
+    return rv
+
 
 def response(message: str, status_code: int = 200,
              category: str = None, payload: dict = None):
@@ -33,6 +91,11 @@ class AppRouteView(MethodView):
     route = None
     redirect_args = {}
 
+    # Keys of populated data which change on every request without the rest
+    # of the data changing (such as the current time), and are ignored for
+    # the ETag of JSON responses
+    etag_ignore = ()
+
     def get_template_name(self):
         # Overrideable
         return self.template_name
@@ -56,14 +119,45 @@ class AppRouteView(MethodView):
         # Override
         return {}
 
+    def finish_get(self, rv: Response, etag: str = None) -> Response:
+        """
+        Answer `If-None-Match` with 304 when the body is unchanged, and
+        compress the body otherwise.
+        """
+        if rv.status_code != 200:
+            return rv
+        if etag is None:
+            etag = etag_of(rv.get_data())
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        # Weak, as the same data can be sent with different encodings
+        rv.set_etag(etag, weak=True)
+        return compress(rv)
+
     def get_json(self, *args, **kwargs):
         values = self.populate(*args, **kwargs)
         if isinstance(values, Response):
             return values
-        return jsonify(values), values.get("status_code", 200)
+        etag = None
+        if self.etag_ignore:
+            # Checked before the response is made, so 304s skip encoding
+            etag = etag_of(encoding.dumps(
+                {key: value for key, value in values.items()
+                 if key not in self.etag_ignore}, sort_keys=True))
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+        rv = json_response(values, values.get("status_code", 200))
+        return self.finish_get(rv, etag)
 
     def get_html(self, *args, **kwargs):
-        return self.render_template(**self.populate(*args, **kwargs))
+        # Pending flashed messages are only removed from the session once
+        # they are rendered, so those pages can not be answered with a 304
+        has_flashes = bool(session.get("_flashes"))
+        rv = make_response(self.render_template(
+            **self.populate(*args, **kwargs)))
+        if has_flashes:
+            return compress(rv)
+        return self.finish_get(rv)
 
     # }}}
 
@@ -92,9 +186,10 @@ class AppRouteView(MethodView):
         if isinstance(result, Response):
             return result
         if "payload" in result:
-            return jsonify(result["payload"]), result.get("status_code", 200)
-        return (jsonify({"message": result.get("message", "no output")}),
-                result.get("status_code", 200))
+            return json_response(result["payload"],
+                                 result.get("status_code", 200))
+        return json_response({"message": result.get("message", "no output")},
+                             result.get("status_code", 200))
 
     def post_html(self, *args, **kwargs):
         values = request.form
@@ -132,9 +227,10 @@ class AppRouteView(MethodView):
         if isinstance(result, Response):
             return result
         if "payload" in result:
-            return jsonify(result["payload"]), result.get("status_code", 200)
-        return (jsonify({"message": result.get("message", "no output")}),
-                result.get("status_code", 200))
+            return json_response(result["payload"],
+                                 result.get("status_code", 200))
+        return json_response({"message": result.get("message", "no output")},
+                             result.get("status_code", 200))
 
     def put_html(self, *args, **kwargs):
         values = request.form
@@ -172,9 +268,10 @@ class AppRouteView(MethodView):
         if isinstance(result, Response):
             return result
         if "payload" in result:
-            return jsonify(result["payload"]), result.get("status_code", 200)
-        return (jsonify({"message": result.get("message", "no output")}),
-                result.get("status_code", 200))
+            return json_response(result["payload"],
+                                 result.get("status_code", 200))
+        return json_response({"message": result.get("message", "no output")},
+                             result.get("status_code", 200))
 
     def patch_html(self, *args, **kwargs):
         values = request.form
@@ -212,9 +309,11 @@ class AppRouteView(MethodView):
         if isinstance(result, Response):
             return result
         if "payload" in result:
-            return jsonify(result["payload"]), result.get("status_code", 200)
-        return (jsonify({"message": result.get("message", "no outdelete")}),
-                result.get("status_code", 200))
+            return json_response(result["payload"],
+                                 result.get("status_code", 200))
+        return json_response(
+            {"message": result.get("message", "no outdelete")},
+            result.get("status_code", 200))
 
     def delete_html(self, *args, **kwargs):
         values = request.form
@@ -230,6 +329,8 @@ class AppRouteView(MethodView):
     # MethodView overrides {{{
 
     def get(self, *args, **kwargs):
+        # GET requests only read, so they can be served by a read replica
+        use_replica(current_app)
         self.before_request(*args, **kwargs)
         if request.is_json:
             result = self.get_json(*args, **kwargs)
@@ -1,7 +1,11 @@
 import hashlib  # password hash generation and verification
 import functools  # decorators
+import secrets  # API token generation
 import string  # password requirements
+import threading  # user cache lock
+import time  # user cache expiry
 import uuid  # UUID4 generation
+from datetime import datetime, timedelta
 
 import gigaspoon as gs  # form validation
 
@@ -9,10 +13,13 @@ from mediapanel.db.user import UserType
 
 from flask import (Blueprint, abort, flash, g, redirect, request, session,
                    url_for)
+from sqlalchemy import event, inspect
+from flask.sessions import SecureCookieSessionInterface
+from sqlalchemy.orm import joinedload
 from werkzeug.security import gen_salt
 
 from .app_view import AppRouteView, response
-from .models import User, Client, db  # proxy for noticast util
+from .models import ApiToken, User, Client, db  # proxy for noticast util
 
 blueprint = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -20,6 +27,10 @@ blueprint = Blueprint("auth", __name__, url_prefix="/auth")
 # delete devices
 ADMIN_CLIENT_ID = 1
 
+# `ApiToken.last_used` is only written when it is older than this, so using
+# a token does not mean a write for every request
+TOKEN_LAST_USED_INTERVAL = timedelta(minutes=1)
+
 
 def check_login(password, email: str = None, user: User = None):
     if email is None and user is None:
@@ -27,7 +38,7 @@ def check_login(password, email: str = None, user: User = None):
     elif email is not None and user is not None:
         raise ValueError("expected `username` or `user`, not both")
     if user is None:
-        user = User.query.filter(User.email.like(email)).first()
+        user = User.query.filter(User.email == email).first()
     if user is not None:  # Can't use `else` because it was just set above
         hash_object = hashlib.sha512(user.salt.encode("utf8"))
         hash_object.update(password.encode("utf8"))
@@ -36,6 +47,120 @@ def check_login(password, email: str = None, user: User = None):
     return None
 
 
+class UserCache:
+    """
+    Short-lived in-process cache of users (with their client) by user ID, so
+    authenticating a request does not always need a query. Disabled when the
+    TTL is 0.
+
+    Entries are dropped when a user or client is updated or deleted through
+    this process; other processes see the change once the TTL expires.
+    """
+
+    def __init__(self, ttl: float = 0, max_size: int = 1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires, user = entry
+        state = inspect(user)
+        if expires < time.time() or state.expired_attributes:
+            # Attributes expired by a commit would need to be loaded again
+            self.invalidate_user(user_id)
+            return None
+        return user
+
+    def set(self, user: User):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                # Drop the entry closest to expiring
+                oldest = min(self._entries, key=lambda k: self._entries[k][0])
+                del self._entries[oldest]
+            self._entries[user.user_id] = (time.time() + self.ttl, user)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def invalidate_client(self, client_id):
+        with self._lock:
+            for user_id, (_, user) in list(self._entries.items()):
+                if user.client_id == client_id:
+                    del self._entries[user_id]
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    user_cache.invalidate_user(target.user_id)
+
+
+@event.listens_for(Client, "after_update")
+@event.listens_for(Client, "after_delete")
+def _client_changed(mapper, connection, target):
+    user_cache.invalidate_client(target.client_id)
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf8")).hexdigest()
+
+
+def check_token(token: str):
+    """
+    Find the user of an API token, with their client, in a single indexed
+    query. Returns None if the token does not exist or was revoked.
+    """
+    api_token = (ApiToken.query
+                 .options(joinedload(ApiToken.user).joinedload(User.client))
+                 .filter(ApiToken.token_hash == hash_token(token),
+                         ApiToken.revoked.is_(None))
+                 .first())
+    if api_token is None:
+        return None
+    now = datetime.now()
+    if (api_token.last_used is None or
+            now - api_token.last_used > TOKEN_LAST_USED_INTERVAL):
+        # On a connection of its own, as the session would count this as a
+        # write of the request and send the client's next reads to the
+        # primary
+        with db.engine.begin() as connection:
+            connection.execute(
+                ApiToken.__table__.update()
+                .where(ApiToken.token_id == api_token.token_id)
+                .values(last_used=now))
+    return api_token.user
+
+
+def get_user(user_id):
+    """
+    Load a user along with their client in a single query, or from the user
+    cache when enabled.
+    """
+    user = user_cache.get(user_id)
+    if user is not None:
+        # Attach the cached user (and client) to this request's session
+        # without querying
+        return db.session.merge(user, load=False)
+    user = (User.query.options(joinedload(User.client))
+            .filter_by(user_id=user_id).first())
+    if user is not None:
+        user_cache.set(user)
+    return user
+
+
 class PassCharRequirement(gs.v.Validator):
     name = "pass_char"
 
@@ -141,15 +266,23 @@ def load_user():
     user = None
     user_id = session.get("user_id")
     if user_id is not None:
-        user = User.query.filter_by(user_id=user_id).first()
+        user = get_user(user_id)
         if user is None:
             flash("Expected user by id: %i; contact support|danger" % user_id,
                   "notifications")
     else:
-        auth_header = request.headers.get("Authorization")
-        if auth_header is not None:
-            username, password = auth_header.split(" ")[-1].split(":")
-            user = check_login(password, username=username)
+        auth_header = request.headers.get("Authorization", "")
+        authorization = request.authorization
+        if auth_header[:7].lower() == "bearer ":
+            # Token requests are stateless, see `SessionInterface`
+            g.stateless = True
+            user = check_token(auth_header[7:].strip())
+        elif (authorization is not None and
+                authorization.type == "basic" and
+                authorization.username and authorization.password):
+            # Basic authorization with email and password
+            user = check_login(authorization.password,
+                               email=authorization.username)
     if user is not None:
         g.user = user
         g.client = user.client
@@ -191,3 +324,82 @@ def admin_required(fn):
             return abort(403)
         return fn(*args, **kwargs)
     return wrapped_view
+
+
+def token_json(api_token: ApiToken) -> dict:
+    return {
+        "token_id": api_token.token_id,
+        "name": api_token.name,
+        "prefix": api_token.prefix,
+        "created": int(api_token.created.timestamp()),
+        "last_used": (int(api_token.last_used.timestamp())
+                      if api_token.last_used is not None else None),
+        "revoked": api_token.revoked is not None,
+    }
+
+
+class ListTokens(AppRouteView):
+    # Allows for GET, POST
+    decorators = [
+        gs.flask.validator({
+            "name": gs.v.Length(min=1, max=64),
+        }, methods=["POST"]),
+        login_required,
+    ]
+
+    def populate(self):
+        tokens = (ApiToken.query.filter_by(user_id=g.user.user_id)
+                  .order_by(ApiToken.created).all())
+        return {"tokens": [token_json(token) for token in tokens]}
+
+    def handle_post(self, values):
+        # The token is only ever returned here, only its hash is stored
+        token = secrets.token_urlsafe(32)
+        api_token = ApiToken(user_id=g.user.user_id, name=values["name"],
+                             token_hash=hash_token(token),
+                             prefix=token[:8], created=datetime.now())
+        db.session.add(api_token)
+        db.session.commit()
+
+        payload = token_json(api_token)
+        payload["token"] = token
+        return response("Created token %s" % values["name"],
+                        payload=payload, status_code=201)
+
+
+class Token(AppRouteView):
+    # Allows for DELETE
+    decorators = [login_required]
+
+    def handle_delete(self, values, token_id):
+        api_token = ApiToken.query.filter_by(user_id=g.user.user_id,
+                                             token_id=token_id).first()
+        if api_token is None:
+            return abort(404)
+        if api_token.revoked is None:
+            api_token.revoked = datetime.now()
+            db.session.commit()
+        return response("Revoked token %s" % api_token.name,
+                        payload=token_json(api_token))
+
+
+blueprint.add_url_rule("/tokens", view_func=ListTokens.as_view("tokens"))
+blueprint.add_url_rule("/tokens/<int:token_id>",
+                       view_func=Token.as_view("token"))
+
+
+class SessionInterface(SecureCookieSessionInterface):
+    """
+    Cookie sessions, except for requests authenticated with an API token,
+    which never get a session cookie.
+    """
+
+    def should_set_cookie(self, app, session):
+        if g.get("stateless"):
+            return False
+        return super().should_set_cookie(app, session)
+
+
+def init_app(app):
+    app.session_interface = SessionInterface()
+    user_cache.ttl = float(app.config.get("USER_CACHE_TTL", 0))
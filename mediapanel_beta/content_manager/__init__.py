@@ -1,7 +1,10 @@
-from flask import Blueprint
+from flask import Blueprint, jsonify
 
-from .resources import ListResources, NewResource, Resource, ResourceFile
-from .device_list import ListDevices
+from . import thumbnails
+from .resources import (ListResources, NewResource, Resource, ResourceFile,
+                        ResourceThumbnail, UploadSession)
+from .uploads import UploadError
+from .device_list import DeviceEvents, Heartbeats, ListDevices
 
 blueprint = Blueprint("content_manager", __name__, url_prefix="/manage")
 
@@ -11,12 +14,32 @@ blueprint.add_url_rule("/<_type>/<target_id>/resources",
                        view_func=ListResources.as_view("list_resources"))
 blueprint.add_url_rule("/<_type>/<target_id>/resources/new",
                        view_func=NewResource.as_view("upload_resource"))
+blueprint.add_url_rule("/<_type>/<target_id>/resources/new/<upload_id>",
+                       view_func=UploadSession.as_view("upload_session"))
 blueprint.add_url_rule("/<_type>/<target_id>/resources/by-id/<resource_id>",
                        view_func=Resource.as_view("manage_resource"))
 blueprint.add_url_rule(
         "/<content_type>/<client_id>/file/<target_id>/<path:filename>",
         view_func=ResourceFile.as_view("resource_file"))
+blueprint.add_url_rule(
+        "/<content_type>/<client_id>/thumbnail/<target_id>/<int:size>/"
+        "<path:filename>",
+        view_func=ResourceThumbnail.as_view("resource_thumbnail"))
 
 # Device-specific Applications
 blueprint.add_url_rule("/device",
                        view_func=ListDevices.as_view("list_devices"))
+blueprint.add_url_rule("/device/events",
+                       view_func=DeviceEvents.as_view("device_events"))
+blueprint.add_url_rule("/device/heartbeat",
+                       view_func=Heartbeats.as_view("device_heartbeat"))
+
+
+@blueprint.errorhandler(UploadError)
+def upload_error(e):
+    return (jsonify({"message": str(e), "status_code": e.status_code}),
+            e.status_code)
+
+
+def init_app(app):
+    thumbnails.init_app(app)
@@ -1,10 +1,13 @@
 from datetime import datetime, timedelta
 
-from flask import abort, g, safe_join, request
+from flask import (abort, current_app, g, safe_join, request,
+                   stream_with_context, Response)
+from flask.views import MethodView
 
+from .. import encoding, fleet, heartbeats, live, metrics, pagination
 from ..app_view import AppRouteView, response
 from ..auth import login_required
-from ..models import Asset, db
+from ..models import Asset, Device, db
 
 
 class ListDevices(AppRouteView):
@@ -12,42 +15,186 @@ class ListDevices(AppRouteView):
     # Identifiers: device
     decorators = [login_required]
     template_name = "content_manager/list_devices.html"
+    etag_ignore = ("current_time",)
+
+    # Orderings usable with `?order=`, always ending with a unique column
+    orderings = {
+        "nickname": (Device.nickname, Device.device_id),
+        "last_ping": (Device.last_ping, Device.device_id),
+    }
 
     def populate(self):
         device_list = []
         query = request.args.get("search")
+        order = request.args.get("order", "nickname")
+        if order not in self.orderings:
+            return abort(400, "unknown order: %s" % order)
+        cursor, limit = pagination.page_args()
 
-        for device in g.user.allowed_devices:
-            if query is not None:
-                if query.lower() not in device.nickname.lower():
-                    continue
-            # Calculate human-readable offline time for device
-            now = datetime.now()
-            offline_delta = now - device.last_ping
-            if offline_delta.days > 30:  # x months
-                offline_for = str(int(offline_delta.days / 30)) + " months"
-            elif offline_delta.days > 0:  # x days
-                offline_for = str(int(offline_delta.days)) + " days"
-            elif offline_delta.seconds > (60 * 60):  # x hours
-                offline_for = str(int(offline_delta.seconds / (60 * 60))) + " hours"
-            else:  # x minutes
-                offline_for = str(int(offline_delta.seconds / 60)) + " minutes"
-
-            # Add device to list
+        # Only the columns shown are loaded, not full Device objects
+        devices = fleet.device_rows(g.user)
+        if query:
+            # Prefix match, so an index on nickname can be used
+            pattern = (query.replace("\\", "\\\\").replace("%", "\\%")
+                       .replace("_", "\\_"))
+            devices = devices.filter(
+                Device.nickname.like(pattern + "%", escape="\\"))
+        devices, next_cursor = pagination.paginate(
+            devices, self.orderings[order], cursor, limit)
+
+        # Offline times and storage are computed for the whole page at once
+        statuses = fleet.DeviceStatuses(devices, datetime.now(),
+                                        fleet.current_version)
+        for device, offline_for, is_offline, out_of_date in zip(
+                statuses.rows, statuses.offline_for, statuses.is_offline,
+                statuses.out_of_date):
             device_list.append({
                 "device_id": device.device_id,
-                "last_ping": device.last_ping.timestamp(),
+                "last_ping": (device.last_ping.timestamp()
+                              if device.last_ping is not None else None),
                 "nickname": device.nickname,
                 "system_version": device.system_version,
                 "device_ip": device.device_ip,
                 "total_disk": device.total_disk,
                 "free_disk": device.free_disk,
                 "offline_for": offline_for,
-                "is_offline": offline_delta.days > 0 or offline_delta.seconds > 300,
+                "is_offline": is_offline,
+                "is_out_of_date": out_of_date,
             })
 
         return {
             "devices": device_list,
             "current_time": datetime.now(),
             "query": query,
+            "order": order,
+            "limit": limit,
+            "next": next_cursor,
         }
+
+
+class DeviceEvents(MethodView):
+    """
+    Server-sent events with the status of the user's devices: a `snapshot`
+    event with the status of every device when connecting, followed by a
+    `device` event whenever a device goes online or offline or changes
+    storage level, see `live`.
+    """
+    decorators = [login_required]
+
+    @staticmethod
+    def event(name: str, data) -> bytes:
+        return b"event: %s\ndata: %s\n\n" % (name.encode("ascii"),
+                                             encoding.dumps(data))
+
+    def get(self):
+        # Streams hold a worker thread until they are closed, see
+        # `live.streams`
+        streams = live.streams
+        if not streams.acquire(blocking=False):
+            rv = Response("Too many open event streams", status=503)
+            rv.headers["Retry-After"] = "60"
+            return rv
+        try:
+            now = datetime.now()
+            statuses = [live.device_status(row, now)
+                        for row in fleet.device_rows(
+                            g.user, Device.device_id, Device.last_ping,
+                            Device.free_disk, Device.total_disk)]
+        except BaseException:
+            streams.release()
+            raise
+        client_id = g.user.client_id
+        # Streams can stay open for hours, without holding a connection
+        db.session.close()
+        metrics.exclude_latency()
+
+        subscription = live.broker.subscribe(
+            client_id, [status["device_id"] for status in statuses])
+        live.watcher.seed(client_id, statuses)
+        live.watcher.start(current_app._get_current_object())
+        keepalive = float(current_app.config.get("LIVE_KEEPALIVE",
+                                                 live.DEFAULT_KEEPALIVE))
+
+        def generate():
+            yield self.event("snapshot", {"devices": statuses})
+            while not subscription.overflowed:
+                status = subscription.get(keepalive)
+                if status is None:
+                    # Comment, so proxies do not close idle streams
+                    yield b": keepalive\n\n"
+                else:
+                    yield self.event("device", status)
+            # Fell behind, the client should reconnect for a snapshot
+            yield self.event("reload", {})
+
+        def close():
+            # Also called when the stream is closed before it started
+            live.broker.unsubscribe(subscription)
+            streams.release()
+
+        rv = Response(stream_with_context(generate()),
+                      mimetype="text/event-stream")
+        rv.call_on_close(close)
+        rv.headers["Cache-Control"] = "no-cache"
+        # Sent as soon as possible instead of buffered by nginx
+        rv.headers["X-Accel-Buffering"] = "no"
+        return rv
+
+
+class Heartbeats(AppRouteView):
+    """
+    Ingests heartbeats of devices, either a single heartbeat or a list of
+    them as `heartbeats`. Heartbeats are written in the background, see
+    `heartbeats`.
+    """
+    # Allows for POST
+    # Identifiers: device_heartbeat
+    decorators = [login_required]
+
+    @staticmethod
+    def parse(heartbeat) -> tuple:
+        # Returns the device ID and the columns to set, or aborts with 400
+        if not isinstance(heartbeat, dict) or not heartbeats.valid_string(
+                "device_id", heartbeat.get("device_id")):
+            return abort(400, "expected a heartbeat with a device_id")
+        values = {field: heartbeat[field] for field in heartbeats.FIELDS
+                  if heartbeat.get(field) is not None}
+        if ("free_disk" in values) != ("total_disk" in values):
+            return abort(400, "expected both free_disk and total_disk")
+        for field in ("free_disk", "total_disk"):
+            if field in values and not heartbeats.valid_size(values[field]):
+                return abort(400, "expected %s as a positive integer" %
+                             field)
+        if "system_version" in values and (
+                not heartbeats.valid_string("system_version",
+                                            values["system_version"]) or
+                fleet.version_number(values["system_version"]) is None):
+            return abort(400, "expected system_version as x.y.z")
+        values.setdefault("device_ip", request.remote_addr)
+        if not heartbeats.valid_ip(values["device_ip"]):
+            return abort(400, "expected device_ip as an IP address")
+        return heartbeat["device_id"], values
+
+    def handle_post(self, values):
+        if isinstance(values, dict) and "heartbeats" in values:
+            items = values["heartbeats"]
+            if not isinstance(items, list):
+                return abort(400, "expected heartbeats as a list")
+        else:
+            items = [values]
+        parsed = [self.parse(heartbeat) for heartbeat in items]
+
+        client_id = g.user.client_id
+        accepted = dropped = 0
+        unknown = []
+        for device_id, device_values in parsed:
+            if not heartbeats.client_devices.contains(client_id, device_id):
+                unknown.append(device_id)
+            elif heartbeats.buffer.add(client_id, device_id, device_values):
+                accepted += 1
+            else:
+                dropped += 1
+        return response("Accepted %i heartbeats" % accepted,
+                        payload={"accepted": accepted, "dropped": dropped,
+                                 "unknown": unknown},
+                        status_code=202)
@@ -1,22 +1,91 @@
-from flask import (abort, current_app, g, safe_join,
-                   send_from_directory, url_for)
+import mimetypes
+import os
+from datetime import datetime
+from urllib.parse import quote
+
+from flask import (abort, current_app, g, request, safe_join,
+                   send_file, stream_with_context, url_for, Response)
 from flask.views import MethodView
+from werkzeug.http import parse_content_range_header
 
-from ..app_view import AppRouteView, response
+from .. import encoding, pagination, snapshots
+from ..app_view import AppRouteView, json_response, response
 from ..auth import login_required
 from ..models import Asset, db
+from . import thumbnails, uploads
+from .serializers import AssetSerializer, asset_rows
 
 
 class ResourceFile(MethodView):
-    def get(self, content_type, client_id, target_id, filename):
-        resources_folder = current_app.config["RESOURCES_FOLDER"]
+    """
+    Serves uploaded resource files.
+
+    When `RESOURCES_ACCEL_REDIRECT` is set to the prefix of an internal nginx
+    location aliased to `RESOURCES_FOLDER`, only the path is resolved here and
+    nginx sends the file. Otherwise the file is sent by the worker, with a
+    strong ETag, conditional requests (`If-None-Match`, `If-Modified-Since`)
+    and byte ranges, so interrupted downloads can be resumed.
+    """
+
+    def resolve(self, content_type, client_id, target_id, filename):
+        # Returns the path of the file relative to RESOURCES_FOLDER
         if content_type == "group":  # Group file
-            resource_path = safe_join(resources_folder, client_id, target_id,
-                                      "uploaded")
+            resource_path = safe_join(client_id, target_id, "uploaded")
         else:  # Device file
-            resource_path = safe_join(resources_folder, client_id, "1",
-                                      target_id, "uploaded")
-        return send_from_directory(resource_path, filename)
+            resource_path = safe_join(client_id, "1", target_id, "uploaded")
+        return safe_join(resource_path, filename)
+
+    def accel_redirect(self, prefix, relative_path):
+        response = Response()
+        response.headers["X-Accel-Redirect"] = (
+            prefix.rstrip("/") + "/" + quote(relative_path))
+        mimetype, _ = mimetypes.guess_type(relative_path)
+        response.mimetype = mimetype or "application/octet-stream"
+        return response
+
+    def send(self, path):
+        stat = os.stat(path)
+        rv = send_file(path, conditional=False, add_etags=False)
+        # Changes whenever the file is replaced or modified
+        rv.set_etag("%x-%x-%x" % (stat.st_ino, stat.st_mtime_ns,
+                                  stat.st_size))
+        return rv.make_conditional(request, accept_ranges=True,
+                                   complete_length=stat.st_size)
+
+    def get(self, content_type, client_id, target_id, filename):
+        resources_folder = current_app.config["RESOURCES_FOLDER"]
+        relative_path = self.resolve(content_type, client_id, target_id,
+                                     filename)
+        path = safe_join(resources_folder, relative_path)
+        if not os.path.isfile(path):
+            return abort(404)
+
+        prefix = current_app.config.get("RESOURCES_ACCEL_REDIRECT")
+        if prefix:
+            return self.accel_redirect(prefix, relative_path)
+        return self.send(path)
+
+
+class ResourceThumbnail(ResourceFile):
+    """
+    Serves thumbnails of resource files, see `thumbnails`. Thumbnails which
+    are still being generated are answered with 202 and a Retry-After.
+    """
+
+    def get(self, content_type, client_id, target_id, size, filename):
+        resources_folder = current_app.config["RESOURCES_FOLDER"]
+        path = safe_join(resources_folder,
+                         self.resolve(content_type, client_id, target_id,
+                                      filename))
+        if not os.path.isfile(path) or not thumbnails.cache.can_generate(path):
+            return abort(404)
+
+        thumbnail = thumbnails.cache.get(path, size)
+        if thumbnail is None:
+            response = Response(status=202)
+            response.headers["Retry-After"] = "5"
+            return response
+        return self.send(thumbnail)
 
 
 class Resource(AppRouteView):
@@ -35,26 +104,7 @@ class Resource(AppRouteView):
 
     def populate(self, _type, target_id, resource_id):
         # Returns link to actual resource file
-        resource = g.resource
-        resource_url = url_for(".resource_file", content_type=_type,
-                               client_id=resource.client_id,
-                               target_id=target_id,
-                               filename=resource.filename)
-        return {
-            "type": _type,
-            "target_id": target_id,
-            "id": resource.id,
-            "filename": resource.filename,
-            "is_digital_frame": resource.is_digital_frame,
-            "is_display_ad": resource.is_display_ad,
-            "is_alerts": resource.is_alerts,
-            "is_jukebox": resource.is_jukebox,
-            "display_name": resource.display_name,
-            "thumbnail_name": resource.thumbnail_name,
-            "timestamp": int(resource.timestamp.timestamp()),
-            "size": resource.size,
-            "resource_url": resource_url,
-        }
+        return AssetSerializer(_type).serialize_detail(g.resource, target_id)
 
     def handle_put(self, data, _type, target_id, resource_id):
         resource = g.resource
@@ -63,26 +113,11 @@ class Resource(AppRouteView):
         resource.is_alerts = data["is_alerts"]
         resource.is_jukebox = data["is_jukebox"]
         db.session.commit()
+        snapshots.invalidate(resource.client_id)
 
-        resource_url = url_for(".resource_file", content_type=_type,
-                               client_id=resource.client_id,
-                               target_id=target_id,
-                               filename=resource.filename)
-        return response(message="Resource successfully updated", payload={
-            "type": _type,
-            "target_id": target_id,
-            "id": resource.id,
-            "filename": resource.filename,
-            "is_digital_frame": resource.is_digital_frame,
-            "is_display_ad": resource.is_display_ad,
-            "is_alerts": resource.is_alerts,
-            "is_jukebox": resource.is_jukebox,
-            "display_name": resource.display_name,
-            "thumbnail_name": resource.thumbnail_name,
-            "timestamp": int(resource.timestamp.timestamp()),
-            "size": resource.size,
-            "resource_url": resource_url,
-        })
+        return response(message="Resource successfully updated",
+                        payload=AssetSerializer(_type).serialize_detail(
+                            resource, target_id))
 
     def handle_patch(self, data, _type, target_id, resource_id):
         resource = g.resource
@@ -95,26 +130,11 @@ class Resource(AppRouteView):
         if data.get("is_jukebox") is not None:
             resource.is_jukebox = data["is_jukebox"]
         db.session.commit()
+        snapshots.invalidate(resource.client_id)
 
-        resource_url = url_for(".resource_file", content_type=_type,
-                               client_id=resource.client_id,
-                               target_id=target_id,
-                               filename=resource.filename)
-        return response(message="Resource successfully updated", payload={
-            "type": _type,
-            "target_id": target_id,
-            "id": resource.id,
-            "filename": resource.filename,
-            "is_digital_frame": resource.is_digital_frame,
-            "is_display_ad": resource.is_display_ad,
-            "is_alerts": resource.is_alerts,
-            "is_jukebox": resource.is_jukebox,
-            "display_name": resource.display_name,
-            "thumbnail_name": resource.thumbnail_name,
-            "timestamp": int(resource.timestamp.timestamp()),
-            "size": resource.size,
-            "resource_url": resource_url,
-        })
+        return response(message="Resource successfully updated",
+                        payload=AssetSerializer(_type).serialize_detail(
+                            resource, target_id))
 
     def handle_delete(self, _type, target_id, resource_id):
         # Delete record, file, and commit deletion to db
@@ -122,52 +142,270 @@ class Resource(AppRouteView):
 
 
 class NewResource(AppRouteView):
+    """
+    Starts a resumable upload of a resource file, see `uploads`.
+    """
+    # Identifiers: upload_resource
     decorators = [login_required]
-    pass
+
+    def handle_post(self, values, _type, target_id):
+        resources_folder = current_app.config["RESOURCES_FOLDER"]
+        uploads.remove_expired(resources_folder, float(current_app.config.get(
+            "UPLOAD_EXPIRY", uploads.DEFAULT_EXPIRY)))
+        max_size = current_app.config.get("UPLOAD_MAX_SIZE")
+        try:
+            size = int(values.get("size"))
+        except (TypeError, ValueError):
+            raise uploads.UploadError("missing or invalid size")
+
+        session = uploads.UploadSession.start(
+            resources_folder, g.user.client_id, g.user.user_id, _type,
+            target_id, values.get("filename"), size,
+            display_name=values.get("display_name"),
+            max_size=int(max_size) if max_size is not None else None)
+        payload = session.status()
+        payload["upload_url"] = url_for(".upload_session", _type=_type,
+                                        target_id=target_id,
+                                        upload_id=session.upload_id)
+        # Not `response`, which flashes instead for requests without JSON
+        return json_response(payload, 201)
+
+
+class UploadSession(AppRouteView):
+    """
+    GET returns how much of an upload has been received, PUT writes a chunk
+    (with a `Content-Range` header or `offset` argument), POST finalizes the
+    upload into a resource and DELETE cancels it.
+
+    Uploads are made by scripts rather than forms, so every method answers
+    with JSON, whatever the content type of the request.
+    """
+    # Identifiers: upload_session
+    decorators = [login_required]
+
+    def before_request(self, _type, target_id, upload_id):
+        g.upload = uploads.UploadSession.load(
+            current_app.config["RESOURCES_FOLDER"], upload_id,
+            g.user.client_id)
+
+    @staticmethod
+    def result_response(result: dict) -> Response:
+        if "payload" in result:
+            return json_response(result["payload"],
+                                 result.get("status_code", 200))
+        return json_response({"message": result["message"]},
+                             result.get("status_code", 200))
+
+    def get(self, _type, target_id, upload_id):
+        self.before_request(_type, target_id, upload_id)
+        return json_response(g.upload.status())
+
+    def put(self, _type, target_id, upload_id):
+        # Chunks are raw bytes rather than JSON or a form, and are streamed
+        # from the request into the part file
+        self.before_request(_type, target_id, upload_id)
+        header = request.headers.get("Content-Range")
+        if header is not None:
+            content_range = parse_content_range_header(header)
+            if (content_range is None or
+                    content_range.length != g.upload.data["size"] or
+                    (request.content_length is not None and
+                     content_range.stop - content_range.start !=
+                     request.content_length)):
+                raise uploads.UploadError(
+                    "Content-Range does not match the chunk or the size of "
+                    "the file", 416)
+            offset = content_range.start
+        else:
+            offset = request.args.get("offset", 0, type=int)
+        g.upload.write_chunk(request.stream, offset, request.content_length)
+        return json_response(g.upload.status())
+
+    def post(self, _type, target_id, upload_id):
+        # The body is optional, finalizing usually sends none
+        self.before_request(_type, target_id, upload_id)
+        values = request.get_json(silent=True) or {}
+        return self.result_response(
+            self.handle_post(values, _type, target_id, upload_id))
+
+    def delete(self, _type, target_id, upload_id):
+        self.before_request(_type, target_id, upload_id)
+        return self.result_response(
+            self.handle_delete({}, _type, target_id, upload_id))
+
+    def handle_post(self, values, _type, target_id, upload_id):
+        session = g.upload
+        path, sha256 = session.finalize(values.get("sha256"))
+        asset = Asset(client_id=g.user.client_id,
+                      group_id=target_id if _type == "group" else 0,
+                      device_id=target_id if _type != "group" else None,
+                      filename=os.path.basename(path),
+                      display_name=session.data["display_name"],
+                      is_digital_frame=False,
+                      is_display_ad=False,
+                      is_alerts=False,
+                      is_jukebox=False,
+                      timestamp=datetime.now(),
+                      # Approximate size in MB
+                      size=round(session.data["size"] / (1024 * 1024), 2))
+        try:
+            db.session.add(asset)
+            db.session.commit()
+        except Exception:
+            # Keep the upload, so finalizing can be retried
+            db.session.rollback()
+            os.replace(path, session.part_path)
+            raise
+        session.remove()
+        snapshots.invalidate(asset.client_id)
+        thumbnails.cache.schedule(path)
+
+        payload = AssetSerializer(_type).serialize_detail(asset, target_id)
+        payload["sha256"] = sha256
+        # Not `response`, which flashes instead for requests without JSON
+        return {"payload": payload, "status_code": 201}
+
+    def handle_delete(self, values, _type, target_id, upload_id):
+        g.upload.remove()
+        return {"message": "Upload cancelled", "status_code": 200}
+
+
+# Flags of an asset which can be changed for many assets at once
+ASSET_FLAGS = ("is_digital_frame", "is_display_ad", "is_alerts", "is_jukebox")
+
+# Most IDs bound to a single `IN` clause, below the SQLite variable limit
+BULK_CHUNK_SIZE = 500
 
 
 class ListResources(AppRouteView):
+    """
+    GET lists the resources of a target, PATCH changes the flags of many
+    resources at once with `{"ids": [...], "flags": {"is_alerts": true}}`.
+    """
     # Identifiers: list_resources
     decorators = [login_required]
 
+    # Most resources changed by a single PATCH
+    max_bulk_ids = 5000
+
+    # Orderings usable with `?order=`, always ending with a unique column
+    orderings = {
+        "id": (Asset.id,),
+        "timestamp": (Asset.timestamp, Asset.id),
+    }
+
+    # Rows fetched from the database at a time when streaming
+    stream_chunk_size = 1000
+
+    def stream(self, resources, serializer, target_id, mode):
+        """
+        Stream resources to the client while they are loaded from the
+        database, `stream_chunk_size` rows at a time; either as one JSON
+        document ("json") or as one JSON object per line ("ndjson").
+        """
+        rows = resources.order_by(Asset.id).yield_per(self.stream_chunk_size)
+
+        def generate_ndjson():
+            for resource in rows:
+                yield encoding.dumps(serializer.serialize(resource)) + b"\n"
+
+        def generate_json():
+            yield b'{"type":%s,"target_id":%s,"resources":[' % (
+                encoding.dumps(serializer.type), encoding.dumps(target_id))
+            separator = b""
+            dumps, serialize = encoding.dumps, serializer.serialize
+            for resource in rows:
+                yield separator + dumps(serialize(resource))
+                separator = b","
+            yield b"]}"
+
+        if mode == "ndjson":
+            return Response(stream_with_context(generate_ndjson()),
+                            mimetype="application/x-ndjson")
+        return Response(stream_with_context(generate_json()),
+                        mimetype="application/json")
+
     def populate(self, _type, target_id):
         if _type == "device":
-            resources = Asset.query.filter_by(client_id=g.user.client_id,
-                                              group_id=0,
-                                              device_id=target_id)
-            return {"type": _type, "target_id": target_id, "resources": [{
-                "id": resource.id,
-                "filename": resource.filename,
-                "is_digital_frame": resource.is_digital_frame,
-                "is_display_ad": resource.is_display_ad,
-                "is_alerts": resource.is_alerts,
-                "is_jukebox": resource.is_jukebox,
-                "display_name": resource.display_name,
-                "thumbnail_name": resource.thumbnail_name,
-                "timestamp": int(resource.timestamp.timestamp()),
-                "size": resource.size,
-                "resource_url": url_for(".resource_file", content_type=_type,
-                                        client_id=resource.client_id,
-                                        target_id=resource.device_id,
-                                        filename=resource.filename),
-            } for resource in resources.all()]}
+            resources = asset_rows(Asset.client_id == g.user.client_id,
+                                   Asset.group_id == 0,
+                                   Asset.device_id == target_id)
         else:
-            resources = Asset.query.filter_by(client_id=g.user.client_id,
-                                              group_id=target_id)
-            return {"type": _type, "target_id": target_id, "resources": [{
-                "id": resource.id,
-                "filename": resource.filename,
-                "is_digital_frame": resource.is_digital_frame,
-                "is_display_ad": resource.is_display_ad,
-                "is_alerts": resource.is_alerts,
-                "is_jukebox": resource.is_jukebox,
-                "display_name": resource.display_name,
-                "thumbnail_name": resource.thumbnail_name,
-                "timestamp": int(resource.timestamp.timestamp()),
-                "size": resource.size,
-                "resource_url": url_for(".resource_file", content_type=_type,
-                                        client_id=resource.client_id,
-                                        target_id=resource.device_id,
-                                        filename=resource.filename),
-            } for resource in resources.all()]}
-        pass
+            resources = asset_rows(Asset.client_id == g.user.client_id,
+                                   Asset.group_id == target_id)
+        serializer = AssetSerializer(_type)
+
+        stream = request.args.get("stream")
+        if stream is not None:
+            if stream not in ("json", "ndjson"):
+                return abort(400, "unknown stream mode: %s" % stream)
+            return self.stream(resources, serializer, target_id, stream)
+
+        if "limit" in request.args or "after" in request.args:
+            # Single page of resources, continued with the `next` cursor
+            order = request.args.get("order", "id")
+            if order not in self.orderings:
+                return abort(400, "unknown order: %s" % order)
+            cursor, limit = pagination.page_args()
+            resources, next_cursor = pagination.paginate(
+                resources, self.orderings[order], cursor, limit)
+            return {"type": _type, "target_id": target_id,
+                    "resources": serializer.serialize_many(resources),
+                    "order": order, "limit": limit, "next": next_cursor}
+
+        return {"type": _type, "target_id": target_id,
+                "resources": serializer.serialize_many(resources.all())}
+
+    def handle_patch(self, values, _type, target_id):
+        """
+        Apply a flag patch to every given resource of the client, in one
+        transaction with one UPDATE per `BULK_CHUNK_SIZE` IDs, and return
+        whether each resource was updated.
+        """
+        if not isinstance(values, dict):
+            return abort(400, "expected a JSON object")
+        ids = values.get("ids")
+        flags = values.get("flags")
+        if (not isinstance(ids, list) or
+                not all(isinstance(i, int) and not isinstance(i, bool)
+                        for i in ids)):
+            return abort(400, "expected `ids` as a list of integers")
+        if len(ids) > self.max_bulk_ids:
+            return abort(400, "at most %i ids can be updated at once" %
+                         self.max_bulk_ids)
+        if (not isinstance(flags, dict) or not flags or
+                not all(key in ASSET_FLAGS and isinstance(value, bool)
+                        for key, value in flags.items())):
+            return abort(400, "expected `flags` as booleans of: %s" %
+                         ", ".join(ASSET_FLAGS))
+
+        ids = list(dict.fromkeys(ids))  # Unique, in the order given
+        client_id = g.user.client_id
+        found = set()
+        try:
+            for start in range(0, len(ids), BULK_CHUNK_SIZE):
+                chunk = ids[start:start + BULK_CHUNK_SIZE]
+                criteria = (Asset.client_id == client_id, Asset.id.in_(chunk))
+                found.update(resource_id for resource_id, in
+                             db.session.query(Asset.id).filter(*criteria))
+                (Asset.query.filter(*criteria)
+                 .update(flags, synchronize_session=False))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if found:
+            snapshots.invalidate(client_id)
+
+        return response("Updated %i of %i resources" % (len(found), len(ids)),
+                        payload={
+                            "type": _type,
+                            "target_id": target_id,
+                            "flags": flags,
+                            "updated": len(found),
+                            "results": [{
+                                "id": resource_id,
+                                "status_code": 200 if resource_id in found
+                                else 404,
+                            } for resource_id in ids],
+                        })
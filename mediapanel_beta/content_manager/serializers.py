@@ -0,0 +1,101 @@
+"""
+Serializers shared by the resource views.
+
+Listings select only `ASSET_COLUMNS` instead of full `Asset` objects, and
+resource URLs are built from a prefix generated once per client and target
+with `url_for`, so the cost per row is a dict and a quoted filename.
+"""
+
+from urllib.parse import quote
+
+from flask import url_for
+
+from ..models import Asset, db
+from . import thumbnails
+
+ASSET_COLUMNS = (Asset.id, Asset.client_id, Asset.device_id, Asset.filename,
+                 Asset.is_digital_frame, Asset.is_display_ad,
+                 Asset.is_alerts, Asset.is_jukebox, Asset.display_name,
+                 Asset.thumbnail_name, Asset.timestamp, Asset.size)
+
+# Filename used to find the prefix of resource URLs, see `url_prefix`
+_PLACEHOLDER = "_"
+
+
+def asset_rows(*criteria):
+    """
+    Query for `ASSET_COLUMNS` of the assets matching `criteria`.
+    """
+    return db.session.query(*ASSET_COLUMNS).filter(*criteria)
+
+
+class AssetSerializer:
+    """
+    Serializes `Asset` objects or rows of `ASSET_COLUMNS` for a content type,
+    must be used within a request.
+    """
+
+    def __init__(self, _type: str):
+        self.type = _type
+        self._prefixes = {}
+
+    def url_prefix(self, endpoint, client_id, target_id, **values) -> str:
+        key = (endpoint, client_id, target_id)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            # The filename is the last part of the URL, so everything before
+            # it is the same for every file of the target
+            url = url_for(endpoint, content_type=self.type,
+                          client_id=client_id, target_id=target_id,
+                          filename=_PLACEHOLDER, **values)
+            prefix = self._prefixes[key] = url[:-len(_PLACEHOLDER)]
+        return prefix
+
+    def resource_url(self, resource, target_id=None) -> str:
+        if target_id is None:
+            target_id = resource.device_id
+        # Quoted the same way as the `path` converter of `url_for`
+        return (self.url_prefix(".resource_file", resource.client_id,
+                                target_id) +
+                quote(resource.filename, safe="/:"))
+
+    def thumbnail_url(self, resource, target_id=None):
+        # None for files which can not be thumbnailed
+        if not thumbnails.cache.can_generate(resource.filename):
+            return None
+        if target_id is None:
+            target_id = resource.device_id
+        return (self.url_prefix(".resource_thumbnail", resource.client_id,
+                                target_id, size=thumbnails.DEFAULT_SIZE) +
+                quote(resource.filename, safe="/:"))
+
+    def serialize(self, resource, target_id=None) -> dict:
+        """
+        Serialize a single resource; URLs point to `target_id`, or to the
+        device of the resource if not given.
+        """
+        return {
+            "id": resource.id,
+            "filename": resource.filename,
+            "is_digital_frame": resource.is_digital_frame,
+            "is_display_ad": resource.is_display_ad,
+            "is_alerts": resource.is_alerts,
+            "is_jukebox": resource.is_jukebox,
+            "display_name": resource.display_name,
+            "thumbnail_name": resource.thumbnail_name,
+            "timestamp": int(resource.timestamp.timestamp()),
+            "size": resource.size,
+            "resource_url": self.resource_url(resource, target_id),
+            "thumbnail_url": self.thumbnail_url(resource, target_id),
+        }
+
+    def serialize_many(self, resources, target_id=None) -> list:
+        serialize = self.serialize
+        return [serialize(resource, target_id) for resource in resources]
+
+    def serialize_detail(self, resource, target_id) -> dict:
+        # Single resource views also mirror the URL arguments
+        value = self.serialize(resource, target_id)
+        value["type"] = self.type
+        value["target_id"] = target_id
+        return value
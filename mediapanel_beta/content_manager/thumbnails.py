@@ -0,0 +1,224 @@
+"""
+Thumbnails for uploaded resources.
+
+Thumbnails are generated in a background thread pool, never while a request
+is waiting, and stored in `THUMBNAIL_CACHE_DIR` by size bucket. The cache is
+bounded to `THUMBNAIL_CACHE_SIZE` bytes; when it grows past that, the least
+recently used thumbnails are removed until it is back to `EVICT_TO` of that.
+Every worker keeps a running total of the cache size instead of scanning the
+cache for every thumbnail; it is corrected by a scan on eviction, or every
+`RESCAN_INTERVAL` seconds for thumbnails added by other workers.
+
+Images are thumbnailed with Pillow, and videos get a poster frame through
+`ffmpeg`; both are optional, and resources which can not be thumbnailed are
+reported as missing.
+"""
+
+import concurrent.futures
+import hashlib
+import logging
+import mimetypes
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    from PIL import Image
+except ImportError:  # Images can not be thumbnailed
+    Image = None
+
+# Widths of generated thumbnails; requested sizes are rounded up to these
+SIZE_BUCKETS = (128, 256, 512)
+DEFAULT_SIZE = 256
+
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+
+# Fraction of the maximum size the cache is reduced to when evicting, so
+# eviction does not happen again for the next thumbnail
+EVICT_TO = 0.9
+
+RESCAN_INTERVAL = 5 * 60
+
+
+def size_bucket(size: int) -> int:
+    for bucket in SIZE_BUCKETS:
+        if size <= bucket:
+            return bucket
+    return SIZE_BUCKETS[-1]
+
+
+def _make_image_thumbnail(source, target, size):
+    with Image.open(source) as image:
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(target, "JPEG", quality=80)
+
+
+def _make_video_thumbnail(source, target, size):
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-y", "-ss", "1", "-i", source,
+         "-frames:v", "1", "-vf", "scale=%i:-2" % size, "-f", "image2",
+         target],
+        check=True, timeout=60, stdin=subprocess.DEVNULL)
+
+
+class ThumbnailCache:
+    def __init__(self, path: str = None, max_size: int = DEFAULT_CACHE_SIZE,
+                 workers: int = 2):
+        self.path = path
+        self.max_size = max_size
+        self.workers = workers
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        # Running total of the cache size and when it was last scanned
+        self._size = None
+        self._scanned = 0
+        self._ffmpeg = None
+
+    def configure(self, path: str, max_size: int = DEFAULT_CACHE_SIZE,
+                  workers: int = 2):
+        self.path = path
+        self.max_size = max_size
+        self.workers = workers
+
+    def generator(self, source: str):
+        # Returns the function making thumbnails for `source`, or None
+        mimetype, _ = mimetypes.guess_type(source)
+        if mimetype is None:
+            return None
+        if mimetype.startswith("image/") and Image is not None:
+            return _make_image_thumbnail
+        if mimetype.startswith("video/"):
+            if self._ffmpeg is None:
+                # Looked up once, as listings check every resource
+                self._ffmpeg = shutil.which("ffmpeg") is not None
+            if self._ffmpeg:
+                return _make_video_thumbnail
+        return None
+
+    def cache_path(self, source: str, size: int) -> str:
+        # Keyed by mtime and size as well, so changed sources are redone
+        stat = os.stat(source)
+        key = "%s:%i:%i" % (source, stat.st_mtime_ns, stat.st_size)
+        name = hashlib.sha1(key.encode("utf8")).hexdigest() + ".jpg"
+        return os.path.join(self.path, str(size), name)
+
+    def get(self, source: str, size: int):
+        """
+        Return the path to the thumbnail of `source`, or None if it is not
+        generated yet; in which case it is scheduled to be generated if
+        possible. Raises FileNotFoundError if `source` does not exist.
+        """
+        if not self.can_generate(source):
+            return None
+        size = size_bucket(size)
+        path = self.cache_path(source, size)
+        if os.path.exists(path):
+            try:
+                # Mark as recently used for eviction
+                os.utime(path)
+            except FileNotFoundError:  # Evicted in the meantime
+                return None
+            return path
+        self.schedule(source, size)
+        return None
+
+    def can_generate(self, source: str) -> bool:
+        return self.path is not None and self.generator(source) is not None
+
+    def schedule(self, source: str, size: int = DEFAULT_SIZE):
+        """
+        Generate a thumbnail of `source` in the background, if it is not
+        already being generated.
+        """
+        if not self.can_generate(source):
+            return
+        size = size_bucket(size)
+        with self._lock:
+            if (source, size) in self._pending:
+                return
+            self._pending.add((source, size))
+            if self._executor is None:
+                # Created lazily, so every uWSGI worker has its own threads
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers)
+        self._executor.submit(self._generate, source, size)
+
+    def _generate(self, source: str, size: int):
+        try:
+            path = self.cache_path(source, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                            suffix=".tmp")
+            os.close(fd)
+            try:
+                self.generator(source)(source, tmp_path, size)
+                file_size = os.path.getsize(tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+            self.added(file_size)
+        except Exception as e:
+            logging.error("Could not make thumbnail for %r: %r", source, e)
+        finally:
+            with self._lock:
+                self._pending.discard((source, size))
+
+    def added(self, file_size: int):
+        # Scans the cache only when it may have grown past `max_size`
+        with self._lock:
+            if self._size is not None:
+                self._size += file_size
+            scan = (self._size is None or self._size > self.max_size or
+                    time.time() - self._scanned > RESCAN_INTERVAL)
+        if scan:
+            self.evict()
+
+    def evict(self):
+        """
+        Scan the cache, and if it is larger than `max_size`, remove the least
+        recently used thumbnails until it is no larger than `EVICT_TO` of
+        that.
+        """
+        entries = []
+        total = 0
+        for size in SIZE_BUCKETS:
+            directory = os.path.join(self.path, str(size))
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if not entry.name.endswith(".jpg"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total > self.max_size:
+            entries.sort()
+            for _, file_size, path in entries:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    continue
+                total -= file_size
+                if total <= self.max_size * EVICT_TO:
+                    break
+        with self._lock:
+            self._size = total
+            self._scanned = time.time()
+
+
+cache = ThumbnailCache()
+
+
+def init_app(app):
+    cache.configure(
+        path=app.config.get("THUMBNAIL_CACHE_DIR"),
+        max_size=int(app.config.get("THUMBNAIL_CACHE_SIZE",
+                                    DEFAULT_CACHE_SIZE)),
+        workers=int(app.config.get("THUMBNAIL_WORKERS", 2)))
@@ -0,0 +1,274 @@
+"""
+Resumable, chunked uploads of resource files.
+
+An upload session is started with the name and size of a file, after which
+chunks are written straight from the request stream into a part file under
+`RESOURCES_FOLDER/.uploads`, at the offset given by the client. The size and
+SHA-256 of the received data are tracked while writing, and when every byte
+has been received the session is finalized by moving the part file into the
+`uploaded` directory of the target.
+
+Session metadata is stored next to the part file, so sessions survive worker
+restarts and can be continued by any worker; the running hash is kept in the
+worker which received the previous chunk, and rebuilt from the part file if
+another worker continues the upload.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+UPLOADS_DIRECTORY = ".uploads"
+BLOCK_SIZE = 64 * 1024
+
+# Sessions which have not received a chunk for this long are removed
+DEFAULT_EXPIRY = 24 * 60 * 60
+
+# Running hashes of sessions, by upload ID, as (offset, hash object)
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    # Raised with the HTTP status to respond with
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def uploads_path(resources_folder: str) -> str:
+    return os.path.join(resources_folder, UPLOADS_DIRECTORY)
+
+
+def target_path(resources_folder: str, _type: str, client_id,
+                target_id) -> str:
+    # Same layout as served by ResourceFile
+    if _type == "group":
+        return os.path.join(resources_folder, str(client_id), str(target_id),
+                            "uploaded")
+    return os.path.join(resources_folder, str(client_id), "1", str(target_id),
+                        "uploaded")
+
+
+class UploadSession:
+    def __init__(self, resources_folder: str, data: dict):
+        self.resources_folder = resources_folder
+        self.data = data
+
+    @property
+    def upload_id(self) -> str:
+        return self.data["upload_id"]
+
+    @property
+    def path(self) -> str:
+        return os.path.join(uploads_path(self.resources_folder),
+                            self.upload_id)
+
+    @property
+    def part_path(self) -> str:
+        return self.path + ".part"
+
+    @property
+    def offset(self) -> int:
+        return os.path.getsize(self.part_path)
+
+    @property
+    def complete(self) -> bool:
+        return self.offset == self.data["size"]
+
+    # Creating and loading {{{
+
+    @classmethod
+    def start(cls, resources_folder: str, client_id, user_id, _type: str,
+              target_id, filename: str, size: int, display_name: str = None,
+              max_size: int = None):
+        filename = secure_filename(filename or "")
+        if not filename:
+            raise UploadError("missing or invalid filename")
+        if not isinstance(size, int) or size < 0:
+            raise UploadError("missing or invalid size")
+        if max_size is not None and size > max_size:
+            raise UploadError("file is larger than %i bytes" % max_size, 413)
+
+        session = cls(resources_folder, {
+            "upload_id": uuid.uuid4().hex,
+            "client_id": client_id,
+            "user_id": user_id,
+            "type": _type,
+            "target_id": target_id,
+            "filename": filename,
+            "display_name": display_name or os.path.splitext(filename)[0],
+            "size": size,
+            "created": time.time(),
+        })
+        os.makedirs(uploads_path(resources_folder), exist_ok=True)
+        open(session.part_path, "xb").close()
+        session.save()
+        return session
+
+    @classmethod
+    def load(cls, resources_folder: str, upload_id: str, client_id):
+        """
+        Load a session, raising UploadError(404) if it does not exist or
+        belongs to a different client.
+        """
+        # Upload IDs are always hex, never a path
+        if not upload_id.isalnum():
+            raise UploadError("unknown upload", 404)
+        path = os.path.join(uploads_path(resources_folder), upload_id)
+        try:
+            with open(path + ".json") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            raise UploadError("unknown upload", 404)
+        if data["client_id"] != client_id:
+            raise UploadError("unknown upload", 404)
+        return cls(resources_folder, data)
+
+    def save(self):
+        directory = uploads_path(self.resources_folder)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path + ".json")
+
+    def remove(self):
+        with _hashes_lock:
+            _hashes.pop(self.upload_id, None)
+        for path in (self.part_path, self.path + ".json"):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    # }}}
+
+    def status(self) -> dict:
+        try:
+            offset = self.offset
+        except FileNotFoundError:
+            # Finalized or removed by another request meanwhile
+            raise UploadError("unknown upload", 404)
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.data["filename"],
+            "size": self.data["size"],
+            "offset": offset,
+        }
+
+    def _hash_until(self, offset: int):
+        # Running hash of the first `offset` bytes of the part file
+        with _hashes_lock:
+            hashed_offset, hash_object = _hashes.pop(self.upload_id,
+                                                     (0, None))
+        if hash_object is None or hashed_offset != offset:
+            # Continued by a different worker, hash what was received so far
+            hash_object = hashlib.sha256()
+            with open(self.part_path, "rb") as f:
+                remaining = offset
+                while remaining:
+                    block = f.read(min(BLOCK_SIZE, remaining))
+                    if not block:
+                        break
+                    hash_object.update(block)
+                    remaining -= len(block)
+        return hash_object
+
+    def write_chunk(self, stream, offset: int, length: int) -> int:
+        """
+        Write `length` bytes from `stream` to the part file at `offset`, which
+        must be where the previous chunk ended. Returns the new offset.
+        """
+        size = self.data["size"]
+        if length is None:
+            raise UploadError("missing Content-Length", 411)
+        if offset + length > size:
+            raise UploadError("chunk extends past the size of the file", 416)
+
+        with open(self.part_path, "r+b") as f:
+            # Only one chunk of a session is written at a time
+            fcntl.flock(f, fcntl.LOCK_EX)
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise UploadError("expected offset %i" % current, 409)
+            hash_object = self._hash_until(offset)
+            f.seek(offset)
+            remaining = length
+            try:
+                while remaining:
+                    block = stream.read(min(BLOCK_SIZE, remaining))
+                    if not block:
+                        break
+                    f.write(block)
+                    hash_object.update(block)
+                    remaining -= len(block)
+            finally:
+                # Keep whatever was received, so an interrupted chunk can be
+                # continued from where it stopped
+                f.flush()
+                offset = f.tell()
+                with _hashes_lock:
+                    _hashes[self.upload_id] = (offset, hash_object)
+
+        self.data["updated"] = time.time()
+        self.save()
+        if remaining:
+            raise UploadError("chunk ended after %i of %i bytes" % (
+                length - remaining, length))
+        return offset
+
+    def finalize(self, expected_sha256: str = None):
+        """
+        Check that the upload is complete, and move the part file into the
+        uploaded directory of the target. Returns the path the file was moved
+        to and the SHA-256 of its content.
+        """
+        offset = self.offset
+        if offset != self.data["size"]:
+            raise UploadError("received %i of %i bytes" % (
+                offset, self.data["size"]), 409)
+        sha256 = self._hash_until(offset).hexdigest()
+        if expected_sha256 is not None and expected_sha256.lower() != sha256:
+            raise UploadError("expected SHA-256 %s, received %s" % (
+                expected_sha256, sha256), 422)
+
+        directory = target_path(self.resources_folder, self.data["type"],
+                                self.data["client_id"],
+                                self.data["target_id"])
+        os.makedirs(directory, exist_ok=True)
+        name, extension = os.path.splitext(self.data["filename"])
+        filename = self.data["filename"]
+        counter = 1
+        while True:
+            path = os.path.join(directory, filename)
+            try:
+                # Fails rather than replacing a file of the same name, which
+                # may have been created by a concurrent upload
+                os.link(self.part_path, path)
+                break
+            except FileExistsError:
+                filename = "%s_%i%s" % (name, counter, extension)
+                counter += 1
+        os.unlink(self.part_path)
+        return path, sha256
+
+
+def remove_expired(resources_folder: str, expiry: float = DEFAULT_EXPIRY):
+    """
+    Remove sessions which have not been updated for `expiry` seconds.
+    """
+    directory = uploads_path(resources_folder)
+    if not os.path.isdir(directory):
+        return
+    cutoff = time.time() - expiry
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+            upload_id = entry.name[:-len(".json")]
+            UploadSession(resources_folder, {"upload_id": upload_id}).remove()
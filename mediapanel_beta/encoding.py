@@ -0,0 +1,82 @@
+"""
+JSON encoding backends for responses.
+
+`orjson` is used when installed, which is several times faster than the
+standard library for large device and resource lists; otherwise `json` is
+used. The backend can be chosen with `JSON_BACKEND` ("orjson", "json", or
+the default "auto").
+
+Both backends encode `datetime`, `date` and `time` as ISO 8601, `Decimal` as
+a number, `UUID` as a string and text as UTF-8, so output does not depend on
+the backend.
+"""
+
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+
+try:
+    import orjson
+except ImportError:  # Only the standard library is available
+    orjson = None
+
+MIMETYPE = "application/json"
+
+
+def _default(value):
+    # Types which are not JSON types, for both backends
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError("Object of type %s is not JSON serializable" %
+                    type(value).__name__)
+
+
+class JSONBackend:
+    name = "json"
+
+    def dumps(self, value, sort_keys: bool = False) -> bytes:
+        # UTF-8 rather than escaped, like orjson
+        return json.dumps(value, default=_default, sort_keys=sort_keys,
+                          separators=(",", ":"),
+                          ensure_ascii=False).encode("utf8")
+
+
+class OrjsonBackend(JSONBackend):
+    name = "orjson"
+
+    def dumps(self, value, sort_keys: bool = False) -> bytes:
+        # Non-string keys are converted like the standard library does
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(value, default=_default, option=option)
+
+
+BACKENDS = {"json": JSONBackend}
+if orjson is not None:
+    BACKENDS["orjson"] = OrjsonBackend
+
+
+def get_backend(name: str = "auto") -> JSONBackend:
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+    if name not in BACKENDS:
+        raise ValueError("unknown or unavailable JSON backend: %s" % name)
+    return BACKENDS[name]()
+
+
+backend = get_backend()
+
+
+def dumps(value, sort_keys: bool = False) -> bytes:
+    return backend.dumps(value, sort_keys=sort_keys)
+
+
+def init_app(app):
+    global backend
+    backend = get_backend(app.config.get("JSON_BACKEND", "auto"))
@@ -0,0 +1,285 @@
+"""
+Device fleet statistics computed in the database.
+
+Only the columns required for the dashboard and device list are selected, and
+counts are aggregated by the database instead of loading every `Device` of a
+user and iterating over them in Python.
+
+The status of the devices which are listed (offline time, storage percentage,
+whether they are out of date) is computed for all of them at once by
+`DeviceStatuses`, with NumPy when it is installed.
+"""
+
+import functools
+import math
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func, or_
+from sqlalchemy.orm import with_parent
+
+from .models import Device, User, db
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Devices which have not pinged for longer than this are offline
+OFFLINE_AFTER = timedelta(seconds=300)
+
+# Fraction of used storage after which a device is low on storage
+STORAGE_WARNING = 0.75
+STORAGE_CRITICAL = 0.9
+
+# Maximum amount of offending devices returned for every category
+OFFENDER_LIMIT = 50
+
+DEVICE_COLUMNS = (Device.device_id, Device.nickname, Device.system_version,
+                  Device.device_ip, Device.last_ping, Device.free_disk,
+                  Device.total_disk)
+
+# Version devices are compared with to find out of date devices, as x.y.z
+DEFAULT_CURRENT_VERSION = "6.7.8"
+
+# Batches smaller than this are computed without NumPy, which is slower than
+# plain Python for a few rows
+NUMPY_MIN_ROWS = 64
+
+# Units of offline durations and their length in seconds, from the shortest
+DURATION_UNITS = (("minute", 60), ("hour", 60 * 60), ("day", 24 * 60 * 60),
+                  ("month", 30 * 24 * 60 * 60))
+
+# Normalized current version, see `init_app`
+current_version = None
+
+
+@functools.lru_cache(maxsize=256)
+def version_number(system_version: str):
+    """
+    Normalize a version as an integer, "6.7.8" -> 60708, so versions can be
+    compared as numbers. Returns None for a missing or malformed version.
+    There are only ever a few distinct versions, so these are cached.
+    """
+    try:
+        major, minor, patch = (int(part)
+                               for part in system_version.split("."))
+    except (AttributeError, ValueError):
+        return None
+    if not (0 <= minor < 100 and 0 <= patch < 100 and major >= 0):
+        return None
+    return major * 10000 + minor * 100 + patch
+
+
+def format_duration(count: int, unit: int) -> str:
+    name = DURATION_UNITS[unit][0]
+    return "%i %s%s" % (count, name, "" if count == 1 else "s")
+
+
+def duration_bucket(seconds: float) -> tuple:
+    # Largest unit the duration is at least one of, and how many of it
+    unit = 0
+    for index, (_, length) in enumerate(DURATION_UNITS):
+        if seconds >= length:
+            unit = index
+    return int(seconds // DURATION_UNITS[unit][1]), unit
+
+
+class DeviceStatuses:
+    """
+    Status of a batch of device rows (with the columns of `DEVICE_COLUMNS`)
+    computed column-wise: every attribute is a list with a value per row.
+
+    - offline_seconds: Seconds since the last ping, None if never pinged
+    - offline_for: Human-readable offline time, None if never pinged
+    - is_offline: Whether the device did not ping for `OFFLINE_AFTER`
+    - storage_percentage: Percentage of used storage, None if unknown
+    - versions: Normalized versions, see `version_number`
+    - out_of_date: Whether the version is older than `current`
+    """
+
+    def __init__(self, rows, now: datetime, current: int = None):
+        self.rows = list(rows)
+        now = now.timestamp()
+        offline = [math.nan if row.last_ping is None
+                   else now - row.last_ping.timestamp() for row in self.rows]
+        free = [row.free_disk or 0 for row in self.rows]
+        total = [row.total_disk or 0 for row in self.rows]
+        self.versions = [version_number(row.system_version)
+                         for row in self.rows]
+        if numpy is not None and len(self.rows) >= NUMPY_MIN_ROWS:
+            self._compute_numpy(offline, free, total, current)
+        else:
+            self._compute_python(offline, free, total, current)
+
+    def _compute_python(self, offline, free, total, current):
+        self.storage_percentage = [
+            (1 - free_disk / total_disk) * 100 if total_disk else None
+            for free_disk, total_disk in zip(free, total)]
+        self.out_of_date = [
+            current is not None and version is not None and
+            version < current for version in self.versions]
+        self._set_offline(offline, [
+            duration_bucket(max(seconds, 0)) if not math.isnan(seconds)
+            else None for seconds in offline])
+
+    def _compute_numpy(self, offline, free, total, current):
+        free = numpy.array(free, dtype=float)
+        total = numpy.array(total, dtype=float)
+        known = total > 0
+        free_fraction = numpy.zeros(len(total))
+        numpy.divide(free, total, out=free_fraction, where=known)
+        self.storage_percentage = [
+            percentage if is_known else None for percentage, is_known
+            in zip(((1 - free_fraction) * 100).tolist(), known.tolist())]
+
+        versions = numpy.array([-1 if version is None else version
+                                for version in self.versions])
+        if current is None:
+            self.out_of_date = [False] * len(self.rows)
+        else:
+            self.out_of_date = ((versions >= 0) &
+                                (versions < current)).tolist()
+
+        seconds = numpy.array(offline, dtype=float)
+        pinged = ~numpy.isnan(seconds)
+        seconds = numpy.maximum(numpy.where(pinged, seconds, 0), 0)
+        lengths = numpy.array([length for _, length in DURATION_UNITS])
+        units = numpy.maximum(
+            numpy.searchsorted(lengths, seconds, side="right") - 1, 0)
+        counts = seconds // lengths[units]
+        self._set_offline(offline, [
+            (count, unit) if is_pinged else None for count, unit, is_pinged
+            in zip(counts.astype(int).tolist(), units.tolist(),
+                   pinged.tolist())])
+
+    def _set_offline(self, offline, buckets):
+        limit = OFFLINE_AFTER.total_seconds()
+        self.offline_seconds = [None if math.isnan(seconds) else seconds
+                                for seconds in offline]
+        self.is_offline = [seconds is None or seconds > limit
+                           for seconds in self.offline_seconds]
+        # Formatted once per distinct duration, there are only a few
+        formatted = {bucket: format_duration(*bucket)
+                     for bucket in set(buckets) if bucket is not None}
+        self.offline_for = [formatted.get(bucket) for bucket in buckets]
+
+
+def allowed_devices_filter(user: User):
+    # Same devices as `user.allowed_devices`, as a filter for queries
+    return with_parent(user, User.allowed_devices)
+
+
+def device_rows(user: User, *columns):
+    """
+    Query for the given columns (by default `DEVICE_COLUMNS`) of all devices
+    the user is allowed to see.
+    """
+    return (db.session.query(*(columns or DEVICE_COLUMNS))
+            .filter(allowed_devices_filter(user)))
+
+
+def allowed_device_ids(user: User) -> set:
+    return {device_id for device_id, in device_rows(user, Device.device_id)}
+
+
+def storage_used():
+    # Fraction of used storage, NULL when the total is unknown
+    return 1 - (Device.free_disk * 1.0 /
+                func.nullif(Device.total_disk, 0))
+
+
+def outdated_versions(user: User, current_version: int) -> list:
+    """
+    Find the distinct system versions of a user's devices which are older
+    than `current_version`; there are only ever a few distinct versions, so
+    these are compared in Python.
+    """
+    versions = [system_version for system_version, in
+                device_rows(user, Device.system_version).distinct()]
+    return [system_version for system_version, version
+            in zip(versions, map(version_number, versions))
+            if version is not None and version < current_version]
+
+
+def devices_json(rows, now: datetime) -> list:
+    statuses = DeviceStatuses(rows, now)
+    return [{
+        "device_id": row.device_id,
+        "nickname": row.nickname,
+        "system_version": (row.system_version if version is None
+                           else str(version)),
+        "offline_for": offline_for,
+        "last_ping": (row.last_ping.timestamp()
+                      if row.last_ping is not None else None),
+        "storage_percentage": storage_percentage,
+    } for row, version, offline_for, storage_percentage in zip(
+        statuses.rows, statuses.versions, statuses.offline_for,
+        statuses.storage_percentage)]
+
+
+def fleet_stats(user: User, current_version: int,
+                limit: int = OFFENDER_LIMIT) -> dict:
+    """
+    Count online, offline, out of date and low storage devices of a user, and
+    list at most `limit` devices for every offending category.
+    """
+    now = datetime.now()
+    cutoff = now - OFFLINE_AFTER
+    used = storage_used()
+    outdated = outdated_versions(user, current_version)
+
+    total, online, warning, critical = device_rows(
+        user,
+        func.count(Device.device_id),
+        func.sum(case([(Device.last_ping >= cutoff, 1)], else_=0)),
+        func.sum(case([(used >= STORAGE_WARNING, 1)], else_=0)),
+        func.sum(case([(used >= STORAGE_CRITICAL, 1)], else_=0))).one()
+    total = total or 0
+    online = int(online or 0)
+
+    # Devices which never pinged are offline too, and listed first
+    offline_rows = (device_rows(user)
+                    .filter(or_(Device.last_ping.is_(None),
+                                Device.last_ping < cutoff))
+                    .order_by(Device.last_ping.is_(None).desc(),
+                              Device.last_ping)
+                    .limit(limit))
+    storage_rows = (device_rows(user)
+                    .filter(used >= STORAGE_WARNING)
+                    .order_by(used.desc())
+                    .limit(limit))
+    if outdated:
+        out_of_date_count = (device_rows(user, func.count(Device.device_id))
+                             .filter(Device.system_version.in_(outdated))
+                             .scalar())
+        out_of_date_rows = (device_rows(user)
+                            .filter(Device.system_version.in_(outdated))
+                            .order_by(Device.nickname)
+                            .limit(limit))
+    else:
+        out_of_date_count = 0
+        out_of_date_rows = []
+
+    return {
+        "counts": {
+            "total": total,
+            "online": online,
+            "offline": total - online,
+            "out_of_date": out_of_date_count,
+            "storage_warning": int(warning or 0) - int(critical or 0),
+            "storage_critical": int(critical or 0),
+        },
+        "offline": devices_json(offline_rows, now),
+        "out_of_date": devices_json(out_of_date_rows, now),
+        "low_storage": devices_json(storage_rows, now),
+    }
+
+
+def init_app(app):
+    global current_version
+    configured = app.config.get("CURRENT_SYSTEM_VERSION",
+                                DEFAULT_CURRENT_VERSION)
+    current_version = version_number(configured)
+    if current_version is None:
+        raise ValueError("CURRENT_SYSTEM_VERSION is not x.y.z: %r" %
+                         configured)
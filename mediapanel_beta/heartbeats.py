@@ -0,0 +1,299 @@
+"""
+Write-behind ingestion of device heartbeats.
+
+Heartbeats are kept in memory per device, only the latest one of a device is
+kept, and a background thread writes them to the database every
+`HEARTBEAT_FLUSH_INTERVAL` seconds with a single bulk UPDATE; so the write
+load depends on the number of devices and the flush interval, not on how
+often devices ping.
+
+Durability is bounded by the flush interval (heartbeats of at most that many
+seconds are lost if a worker dies; they are written when it exits or is
+reloaded) and by `HEARTBEAT_MAX_PENDING`: when that
+many devices are waiting, the request flushes immediately, and heartbeats of
+new devices are dropped if that fails. Heartbeats which cannot be written are
+retried by the next flushes, and dropped after `MAX_ATTEMPTS`. With a flush
+interval of 0, every request is written before it is answered.
+"""
+
+import atexit
+import ipaddress
+import logging
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from . import fleet, live, metrics, snapshots
+from .models import Device, db
+
+DEFAULT_FLUSH_INTERVAL = 10
+DEFAULT_MAX_PENDING = 50000
+
+# Device columns which can be set by a heartbeat, besides `last_ping`
+FIELDS = ("free_disk", "total_disk", "system_version", "device_ip")
+
+# Seconds the device IDs of a client are cached, to check that heartbeats
+# are for devices of the client without a query per heartbeat
+DEVICE_IDS_TTL = 60
+
+# Flushes a heartbeat which could not be written is retried in, before it
+# is dropped
+MAX_ATTEMPTS = 3
+
+# Largest disk size accepted, the maximum of a signed BIGINT
+MAX_DISK_SIZE = 2 ** 63 - 1
+
+
+def storage_level(values: dict) -> str:
+    return live.storage_level(values.get("free_disk"),
+                              values.get("total_disk"))
+
+
+def valid_string(field: str, value) -> bool:
+    # Whether the value fits the string column of the device
+    length = getattr(Device.__table__.c[field].type, "length", None)
+    return (isinstance(value, str) and value != "" and
+            (length is None or len(value) <= length))
+
+
+def valid_ip(value) -> bool:
+    if not valid_string("device_ip", value):
+        return False
+    try:
+        ipaddress.ip_address(value)
+    except ValueError:
+        return False
+    return True
+
+
+def valid_size(value) -> bool:
+    return (isinstance(value, int) and not isinstance(value, bool) and
+            0 <= value <= MAX_DISK_SIZE)
+
+
+class ClientDevices:
+    def __init__(self, ttl: float = DEVICE_IDS_TTL):
+        self.ttl = ttl
+        # Client ID -> (loaded at, device IDs)
+        self._device_ids = {}
+        self._lock = threading.Lock()
+
+    def load(self, client_id) -> set:
+        device_ids = {device_id for device_id, in db.session.query(
+            Device.device_id).filter(Device.client_id == client_id)}
+        with self._lock:
+            self._device_ids[client_id] = (time.time(), device_ids)
+        return device_ids
+
+    def contains(self, client_id, device_id: str) -> bool:
+        with self._lock:
+            loaded_at, device_ids = self._device_ids.get(client_id,
+                                                         (0, set()))
+        age = time.time() - loaded_at
+        if device_id in device_ids and age < self.ttl:
+            return True
+        if age < 1:
+            # Loaded just now, so the device is not new
+            return False
+        # Possibly a device added after the IDs were loaded
+        return device_id in self.load(client_id)
+
+
+class HeartbeatBuffer:
+    def __init__(self, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 max_pending: int = DEFAULT_MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.app = None
+        # Device ID -> (client ID, values of the latest heartbeat, failed
+        # attempts to write it)
+        self._pending = {}
+        # Device ID -> (last ping, storage level, version) as last written
+        # by this worker, to find devices whose status changed
+        self._written = {}
+        self.counters = {"received": 0, "merged": 0, "dropped": 0,
+                         "written": 0, "flushes": 0, "failed_flushes": 0}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def configure(self, app, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                  max_pending: int = DEFAULT_MAX_PENDING):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+    def _count(self, counter: str, amount: int = 1):
+        # Must be called with `_lock` held
+        self.counters[counter] += amount
+        metrics.count_heartbeats(counter, amount)
+
+    def add(self, client_id, device_id: str, values: dict) -> bool:
+        """
+        Buffer a heartbeat, replacing a pending heartbeat of the same device.
+        Returns False if the heartbeat was dropped.
+        """
+        values = dict(values, last_ping=datetime.now())
+        with self._lock:
+            self._count("received")
+            if device_id in self._pending:
+                self._count("merged")
+            elif len(self._pending) >= self.max_pending:
+                self._count("dropped")
+                return False
+            self._pending[device_id] = (client_id, values, 0)
+            full = len(self._pending) >= self.max_pending
+        if self.flush_interval <= 0 or full:
+            self.flush()
+        else:
+            self.start()
+        return True
+
+    def start(self):
+        # Started lazily, so every uWSGI worker has its own thread
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run,
+                                            name="heartbeats", daemon=True)
+            self._thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                with self.app.app_context():
+                    self.flush()
+                    db.session.remove()
+            except Exception as e:
+                logging.error("Could not flush heartbeats: %r", e)
+
+    def changed(self, device_id: str, values: dict) -> bool:
+        # Whether the dashboard shows the device differently after writing
+        previous = self._written.get(device_id)
+        if previous is None:
+            return True
+        last_ping, level, version = previous
+        return (values["last_ping"] - last_ping > fleet.OFFLINE_AFTER or
+                level != storage_level(values) or
+                version != values.get("system_version", version))
+
+    def write(self, pending: dict) -> dict:
+        """
+        Write heartbeats with one bulk UPDATE; if that fails, every
+        heartbeat is written on its own, so one heartbeat which cannot be
+        written does not hold back the others. Returns the heartbeats which
+        could not be written.
+        """
+        mappings = [dict(values, device_id=device_id)
+                    for device_id, (_, values, _) in pending.items()]
+        try:
+            db.session.bulk_update_mappings(Device, mappings)
+            db.session.commit()
+            return {}
+        except Exception as e:
+            db.session.rollback()
+            logging.error("Could not write %i heartbeats: %r",
+                          len(pending), e)
+            if len(pending) == 1:
+                return pending
+
+        failed = {}
+        for index, mapping in enumerate(mappings):
+            try:
+                db.session.bulk_update_mappings(Device, [mapping])
+                db.session.commit()
+            except OperationalError as e:
+                # The database is unreachable, not this heartbeat invalid
+                db.session.rollback()
+                logging.error("Could not write heartbeats: %r", e)
+                for remaining in mappings[index:]:
+                    failed[remaining["device_id"]] = pending[
+                        remaining["device_id"]]
+                break
+            except Exception as e:
+                db.session.rollback()
+                logging.error("Could not write heartbeat of %s: %r",
+                              mapping["device_id"], e)
+                failed[mapping["device_id"]] = pending[mapping["device_id"]]
+        return failed
+
+    def flush(self):
+        """
+        Write every pending heartbeat. Heartbeats which could not be written
+        are kept pending, unless newer ones arrived meanwhile, and dropped
+        after `MAX_ATTEMPTS` flushes.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            failed = self.write(pending)
+
+            with self._lock:
+                self._count("flushes")
+                self._count("written", len(pending) - len(failed))
+                if failed:
+                    self._count("failed_flushes")
+                for device_id, item in failed.items():
+                    client_id, values, attempts = item
+                    if attempts + 1 >= MAX_ATTEMPTS:
+                        self._count("dropped")
+                    else:
+                        self._pending.setdefault(
+                            device_id, (client_id, values, attempts + 1))
+
+            changed_clients = set()
+            for device_id, (client_id, values, _) in pending.items():
+                if device_id in failed:
+                    continue
+                if self.changed(device_id, values):
+                    changed_clients.add(client_id)
+                previous = self._written.get(device_id, (None, None, None))
+                self._written[device_id] = (
+                    values["last_ping"], storage_level(values),
+                    values.get("system_version", previous[2]))
+            for client_id in changed_clients:
+                snapshots.invalidate(client_id)
+
+    def flush_on_exit(self):
+        if self.app is None:
+            return
+        with self.app.app_context():
+            self.flush()
+
+
+buffer = HeartbeatBuffer()
+client_devices = ClientDevices()
+
+
+def on_exit(function):
+    """
+    Call `function` when the process exits. uWSGI workers do not run `atexit`
+    handlers when they are reloaded, only `uwsgi.atexit`.
+    """
+    atexit.register(function)
+    try:
+        import uwsgi
+    except ImportError:  # Not running under uWSGI
+        return
+    previous = getattr(uwsgi, "atexit", None)
+
+    def run():
+        function()
+        if previous is not None:
+            previous()
+    uwsgi.atexit = run
+
+
+def init_app(app):
+    buffer.configure(
+        app,
+        flush_interval=float(app.config.get("HEARTBEAT_FLUSH_INTERVAL",
+                                            DEFAULT_FLUSH_INTERVAL)),
+        max_pending=int(app.config.get("HEARTBEAT_MAX_PENDING",
+                                       DEFAULT_MAX_PENDING)))
+    on_exit(buffer.flush_on_exit)
@@ -0,0 +1,198 @@
+"""
+Live device status for server-sent event streams.
+
+Every open stream subscribes to the broker for its client, with the devices
+its user is allowed to see. A single watcher thread per worker polls the
+status of the devices of all subscribed clients every `LIVE_POLL_INTERVAL`
+seconds, with one query, and publishes the devices which went online or
+offline or changed storage level; so the database load depends on the poll
+interval, not on the number of open streams.
+
+`broker` is an in-process pub/sub; it can be replaced (for example by a fake
+in tests, or a broker shared between workers) by anything with the same
+`subscribe`, `unsubscribe`, `publish` and `clients` methods.
+
+Streams hold a uWSGI worker thread while they are open, so every worker
+serves at most `LIVE_MAX_STREAMS` of them at once, see `streams`.
+"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from . import fleet
+from .models import Device, db
+
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_KEEPALIVE = 15
+
+# Every open stream holds a worker thread for as long as it is open, so
+# there are at most this many per worker, leaving threads for other requests
+DEFAULT_MAX_STREAMS = 4
+
+# Events queued for a stream before it is considered too slow, and told to
+# reload instead
+QUEUE_SIZE = 256
+
+
+def storage_level(free_disk, total_disk) -> str:
+    if not total_disk:
+        return "unknown"
+    used = 1 - free_disk / total_disk
+    if used >= fleet.STORAGE_CRITICAL:
+        return "critical"
+    if used >= fleet.STORAGE_WARNING:
+        return "warning"
+    return "ok"
+
+
+def device_status(row, now: datetime) -> dict:
+    online = (row.last_ping is not None and
+              now - row.last_ping <= fleet.OFFLINE_AFTER)
+    return {
+        "device_id": row.device_id,
+        "online": online,
+        "storage": storage_level(row.free_disk, row.total_disk),
+    }
+
+
+class Subscription:
+    def __init__(self, client_id, device_ids):
+        self.client_id = client_id
+        self.device_ids = set(device_ids)
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, event: dict):
+        if event["device_id"] not in self.device_ids:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout: float):
+        # Returns the next event, or None if there was none for `timeout`
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broker:
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, client_id, device_ids) -> Subscription:
+        subscription = Subscription(client_id, device_ids)
+        with self._lock:
+            self._subscriptions.setdefault(client_id, set()).add(
+                subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.client_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.client_id]
+
+    def publish(self, client_id, event: dict):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(client_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def clients(self) -> set:
+        with self._lock:
+            return set(self._subscriptions)
+
+
+class StatusWatcher:
+    def __init__(self, interval: float = DEFAULT_POLL_INTERVAL):
+        self.interval = interval
+        self.app = None
+        # Client ID -> device ID -> last published status
+        self.statuses = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        # Started lazily by the first stream, so every uWSGI worker has its
+        # own thread
+        with self._lock:
+            self.app = app
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run,
+                                                name="live-status",
+                                                daemon=True)
+                self._thread.start()
+
+    def seed(self, client_id, statuses):
+        """
+        Use the statuses sent to a new stream as the previous statuses of
+        its devices, so changes before the next poll are not missed.
+        """
+        with self._lock:
+            previous = self.statuses.setdefault(client_id, {})
+            for status in statuses:
+                previous.setdefault(status["device_id"], status)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.poll()
+                    db.session.remove()
+            except Exception as e:
+                logging.error("Could not poll device status: %r", e)
+
+    def poll(self):
+        """
+        Publish the status of every device of a subscribed client which
+        changed since the previous poll.
+        """
+        clients = broker.clients()
+        with self._lock:
+            for client_id in set(self.statuses) - clients:
+                del self.statuses[client_id]
+        if not clients:
+            return
+        now = datetime.now()
+        rows = (db.session.query(Device.client_id, Device.device_id,
+                                 Device.last_ping, Device.free_disk,
+                                 Device.total_disk)
+                .filter(Device.client_id.in_(clients)))
+        for client_id, client_rows in itertools.groupby(
+                rows.order_by(Device.client_id),
+                key=lambda row: row.client_id):
+            with self._lock:
+                previous = self.statuses.get(client_id)
+            current = {}
+            for row in client_rows:
+                status = device_status(row, now)
+                current[row.device_id] = status
+                if previous is not None and previous.get(
+                        row.device_id) != status:
+                    broker.publish(client_id, status)
+            with self._lock:
+                self.statuses[client_id] = current
+
+
+broker = Broker()
+watcher = StatusWatcher()
+streams = threading.BoundedSemaphore(DEFAULT_MAX_STREAMS)
+
+
+def init_app(app):
+    global streams
+    watcher.interval = float(app.config.get("LIVE_POLL_INTERVAL",
+                                            DEFAULT_POLL_INTERVAL))
+    streams = threading.BoundedSemaphore(int(app.config.get(
+        "LIVE_MAX_STREAMS", DEFAULT_MAX_STREAMS)))
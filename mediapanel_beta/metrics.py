@@ -0,0 +1,224 @@
+"""
+Request, SQL and report read metrics, exposed for Prometheus on `/metrics`.
+
+Recorded for every request, by endpoint:
+
+- mediapanel_request_seconds: latency histogram
+- mediapanel_responses_total: responses by status code
+- mediapanel_request_queries: histogram of SQL queries per request
+- mediapanel_sql_queries_total, mediapanel_sql_seconds_total: SQL queries
+  and time spent in them, from SQLAlchemy engine events
+
+And mediapanel_report_read_seconds, the time spent reading applet reports
+from the filesystem, and mediapanel_report_cache_total, hits and misses of
+the report cache, by applet and report; and mediapanel_heartbeats_total,
+device heartbeats received, merged, dropped and written.
+
+Requests are recorded when they are torn down, so requests failing with an
+unhandled exception are counted as 500s. Streamed responses which stay open
+as long as the client is connected are left out of the latency histogram,
+see `exclude_latency`. Under uWSGI, every worker has its
+own metrics, so `PROMETHEUS_MULTIPROC_DIR` must be set to an empty directory
+shared by the workers; `/metrics` then aggregates the metrics of all
+workers.
+
+`/metrics` only answers clients from `METRICS_ALLOW` (comma separated
+networks, private networks by default) or with `METRICS_TOKEN` as a bearer
+token.
+"""
+
+import contextlib
+import hmac
+import ipaddress
+import os
+import time
+
+import prometheus_client
+from flask import (Blueprint, Response, abort, current_app, g,
+                   has_request_context, request)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+blueprint = Blueprint("metrics", __name__)
+
+DEFAULT_ALLOW = ("127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,"
+                 "192.168.0.0/16")
+
+# Networks allowed to read the metrics, see `init_app`
+allowed_networks = []
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+REQUEST_SECONDS = prometheus_client.Histogram(
+    "mediapanel_request_seconds", "Time spent handling requests",
+    ["endpoint", "method"], buckets=LATENCY_BUCKETS)
+RESPONSES = prometheus_client.Counter(
+    "mediapanel_responses", "Responses by status code",
+    ["endpoint", "method", "status"])
+REQUEST_QUERIES = prometheus_client.Histogram(
+    "mediapanel_request_queries", "SQL queries per request",
+    ["endpoint"], buckets=QUERY_BUCKETS)
+SQL_QUERIES = prometheus_client.Counter(
+    "mediapanel_sql_queries", "SQL queries executed", ["endpoint"])
+SQL_SECONDS = prometheus_client.Counter(
+    "mediapanel_sql_seconds", "Time spent executing SQL queries",
+    ["endpoint"])
+REPORT_READ_SECONDS = prometheus_client.Histogram(
+    "mediapanel_report_read_seconds",
+    "Time spent reading applet reports", ["applet", "report"],
+    buckets=LATENCY_BUCKETS)
+HEARTBEATS = prometheus_client.Counter(
+    "mediapanel_heartbeats", "Device heartbeats by what happened to them "
+    "(received, merged, dropped, written) and heartbeat flushes",
+    ["event"])
+REPORT_CACHE = prometheus_client.Counter(
+    "mediapanel_report_cache", "Applet report loads by cache result",
+    ["applet", "report", "result"])
+
+
+def endpoint_label() -> str:
+    # Unmatched URLs share a label, so labels are bounded by the routes
+    return request.endpoint or "<unmatched>"
+
+
+@contextlib.contextmanager
+def time_report_read(applet: str, report: str):
+    """
+    Record the time spent in the block as reading a report of an applet,
+    through `StorageManager` or `EventsConfig`.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REPORT_READ_SECONDS.labels(applet, report).observe(
+            time.perf_counter() - start)
+
+
+def count_report_cache(applet: str, report: str, hit: bool):
+    REPORT_CACHE.labels(applet, report, "hit" if hit else "miss").inc()
+
+
+def count_heartbeats(kind: str, amount: int = 1):
+    HEARTBEATS.labels(kind).inc(amount)
+
+
+# SQL queries {{{
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    if has_request_context():
+        # Counted per request, and recorded when the request ends
+        g.metrics_sql_queries = g.get("metrics_sql_queries", 0) + 1
+        g.metrics_sql_seconds = g.get("metrics_sql_seconds", 0) + elapsed
+
+
+# }}}
+
+# Requests {{{
+
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_sql_queries = 0
+    g.metrics_sql_seconds = 0
+
+
+def exclude_latency():
+    """
+    Leave the current request out of the latency histogram, for responses
+    streamed for as long as the client stays connected.
+    """
+    g.metrics_exclude_latency = True
+
+
+def finish_request(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def teardown_request(exception=None):
+    # Also run for unhandled exceptions, which skip `after_request` when
+    # they are propagated
+    start = g.get("metrics_start")
+    if start is None:  # Failed before `start_request`
+        return
+    status = g.get("metrics_status")
+    if status is None or exception is not None:
+        status = 500
+    endpoint = endpoint_label()
+    if not g.get("metrics_exclude_latency"):
+        REQUEST_SECONDS.labels(endpoint, request.method).observe(
+            time.perf_counter() - start)
+    RESPONSES.labels(endpoint, request.method, str(status)).inc()
+    queries = g.get("metrics_sql_queries", 0)
+    REQUEST_QUERIES.labels(endpoint).observe(queries)
+    if queries:
+        SQL_QUERIES.labels(endpoint).inc(queries)
+        SQL_SECONDS.labels(endpoint).inc(g.metrics_sql_seconds)
+
+
+# }}}
+
+
+def multiprocess_dir():
+    return (os.environ.get("PROMETHEUS_MULTIPROC_DIR") or
+            os.environ.get("prometheus_multiproc_dir"))
+
+
+def parse_networks(value: str) -> list:
+    return [ipaddress.ip_network(network.strip())
+            for network in value.split(",") if network.strip()]
+
+
+def allowed() -> bool:
+    token = current_app.config.get("METRICS_TOKEN")
+    auth_header = request.headers.get("Authorization", "")
+    if token and auth_header[:7].lower() == "bearer ":
+        return hmac.compare_digest(auth_header[7:].strip().encode("utf8"),
+                                   token.encode("utf8"))
+    # The address nginx received the request from, not the one `ProxyFix`
+    # took from X-Forwarded-For, which clients can set
+    environ = request.environ.get("werkzeug.proxy_fix.orig", request.environ)
+    try:
+        address = ipaddress.ip_address(environ.get("REMOTE_ADDR"))
+    except ValueError:  # Unix socket or no address
+        return False
+    return any(address in network for network in allowed_networks)
+
+
+@blueprint.route("/metrics")
+def metrics():
+    if not allowed():
+        return abort(403)
+    if multiprocess_dir():
+        # Aggregated from the files written by every worker
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registry),
+                    mimetype=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    global allowed_networks
+    allowed_networks = parse_networks(app.config.get("METRICS_ALLOW",
+                                                     DEFAULT_ALLOW))
+    if not event.contains(Engine, "before_cursor_execute",
+                          _before_cursor_execute):
+        # Every engine, including ones created after the app
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(teardown_request)
@@ -1,12 +1,132 @@
+import random
+import time
+
 import click
+from flask import current_app, g, has_request_context, session
 from flask.cli import with_appcontext
 
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, event
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.sql.expression import CompoundSelect, Select
 
 from mediapanel.db import Base, Asset, Client, Device, User
 
-db = SQLAlchemy(model_class=Base)
+# Binds of read replicas are named REPLICA_BIND_PREFIX + index
+REPLICA_BIND_PREFIX = "__replica_"
+
+# Seconds after a write during which a client only reads from the primary
+DEFAULT_REPLICA_STICKY = 5
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending SELECTs to the read replica chosen for the request (see
+    `use_replica`), and everything else to the primary. Once anything was
+    written during a request, the rest of the request uses the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if (isinstance(clause, (Select, CompoundSelect)) and
+                not self._flushing and has_request_context() and
+                g.get("db_replica") is not None and
+                not g.get("db_wrote")):
+            return db.get_engine(self.app, bind=g.db_replica)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy(model_class=Base)
+
+
+def replica_binds(app) -> list:
+    return [bind for bind in app.config.get("SQLALCHEMY_BINDS") or {}
+            if bind.startswith(REPLICA_BIND_PREFIX)]
+
+
+def use_replica(app):
+    """
+    Send the reads of the current request to a random read replica, unless
+    the client wrote something within the last `DATABASE_REPLICA_STICKY`
+    seconds, so clients always read their own writes.
+    """
+    binds = replica_binds(app)
+    if not binds or session.get("db_primary_until", 0) > time.time():
+        return
+    g.db_replica = random.choice(binds)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+@event.listens_for(RoutingSession, "after_bulk_update")
+@event.listens_for(RoutingSession, "after_bulk_delete")
+def _wrote(*args):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def _stick_to_primary(response):
+    if (g.get("db_wrote") and not g.get("stateless") and
+            replica_binds(current_app)):
+        session["db_primary_until"] = time.time() + float(
+            current_app.config.get("DATABASE_REPLICA_STICKY",
+                                   DEFAULT_REPLICA_STICKY))
+    return response
+
+
+def configure_engines(app):
+    """
+    Set engine options from the DATABASE_* configuration, and add a bind for
+    every URI of `DATABASE_REPLICA_URIS` (comma separated, or a list).
+    """
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    for key, option, convert in [
+            ("DATABASE_POOL_SIZE", "pool_size", int),
+            ("DATABASE_MAX_OVERFLOW", "max_overflow", int),
+            ("DATABASE_POOL_RECYCLE", "pool_recycle", int),
+            ("DATABASE_POOL_TIMEOUT", "pool_timeout", float),
+            ("DATABASE_POOL_PRE_PING", "pool_pre_ping",
+             lambda value: str(value).lower() in ("1", "true", "yes"))]:
+        if app.config.get(key) is not None:
+            options[option] = convert(app.config[key])
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+    replica_uris = app.config.get("DATABASE_REPLICA_URIS") or []
+    if isinstance(replica_uris, str):
+        replica_uris = [uri.strip() for uri in replica_uris.split(",")
+                        if uri.strip()]
+    binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+    for index, uri in enumerate(replica_uris):
+        binds[REPLICA_BIND_PREFIX + str(index)] = uri
+    app.config["SQLALCHEMY_BINDS"] = binds
+
+
+class ApiToken(db.Model):
+    """
+    Token for authenticating API requests with `Authorization: Bearer`.
+
+    Only the SHA-256 of a token is stored; tokens are random, so looking one
+    up by its hash is a single indexed query with no per-request key
+    stretching.
+    """
+    __tablename__ = "api_token"
+
+    token_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey(User.user_id), nullable=False,
+                     index=True)
+    name = Column(String(64), nullable=False)
+    token_hash = Column(String(64), nullable=False, unique=True, index=True)
+    # First characters of the token, so users can tell tokens apart
+    prefix = Column(String(8), nullable=False)
+    created = Column(DateTime, nullable=False)
+    last_used = Column(DateTime)
+    revoked = Column(DateTime)
+
+    user = relationship(User)
 
 
 @click.command("init-db")
@@ -18,5 +138,7 @@ def init_db_command():
 
 
 def init_app(app):
+    configure_engines(app)
     db.init_app(app)
+    app.after_request(_stick_to_primary)
     app.cli.add_command(init_db_command)
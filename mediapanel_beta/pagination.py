@@ -0,0 +1,120 @@
+"""
+Keyset pagination helpers.
+
+Pages are ordered by one or more sort columns followed by a unique column, and
+the next page starts after the last row of the previous page. The position is
+sent to clients as an opaque cursor, which is the URL-safe base64 encoding of
+the JSON sort values of the last row.
+
+NULLs of nullable columns are ordered first on every database, as MySQL and
+SQLite do by default, so cursors can point at rows with NULL sort values.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from flask import abort, request
+from sqlalchemy import and_, or_
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(values) -> str:
+    payload = json.dumps([_encode_value(value) for value in values])
+    return base64.urlsafe_b64encode(payload.encode("utf8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    """
+    Decode a cursor made by `encode_cursor`, aborting with a 400 if the
+    cursor is invalid.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(values, list) or len(values) != length:
+            raise ValueError("expected %i values" % length)
+        return [_decode_value(value) for value in values]
+    except (TypeError, ValueError, KeyError, UnicodeError) as e:
+        return abort(400, "invalid cursor: %s" % e)
+
+
+def nullable(column) -> bool:
+    return getattr(getattr(column, "expression", column), "nullable", True)
+
+
+def order_by(columns) -> list:
+    """
+    Ordering of `columns` ascending with NULLs first; `NULLS FIRST` is not
+    supported by MySQL, so NULLs are sorted by `IS NULL` instead.
+    """
+    ordering = []
+    for column in columns:
+        if nullable(column):
+            ordering.append(column.is_(None).desc())
+        ordering.append(column)
+    return ordering
+
+
+def after(columns, values):
+    """
+    Filter for rows after `values` when ordered by `order_by(columns)`.
+    """
+    def greater(column, value):
+        # NULLs are first, so nothing is before a NULL, and every value is
+        # after one; comparisons with NULL are never true
+        if value is None:
+            return column.isnot(None)
+        return column > value
+
+    def equal(column, value):
+        if value is None:
+            return column.is_(None)
+        return column == value
+
+    # (a, b, c) > (x, y, z) as a > x or (a = x and (b > y or (b = y and ...
+    column, value = columns[-1], values[-1]
+    criterion = greater(column, value)
+    for column, value in zip(reversed(columns[:-1]), reversed(values[:-1])):
+        criterion = or_(greater(column, value),
+                        and_(equal(column, value), criterion))
+    return criterion
+
+
+def page_args(default: int = DEFAULT_LIMIT, maximum: int = MAX_LIMIT):
+    """
+    Get the `after` cursor and `limit` from the request arguments.
+    """
+    limit = request.args.get("limit", default, type=int)
+    return request.args.get("after"), max(1, min(limit, maximum))
+
+
+def paginate(query, columns, cursor: str = None, limit: int = DEFAULT_LIMIT):
+    """
+    Order `query` by `columns` and return one page of rows, along with the
+    cursor of the next page or None if this is the last page. Every row must
+    have an attribute with the name of each column.
+    """
+    if cursor is not None:
+        query = query.filter(after(columns, decode_cursor(cursor,
+                                                          len(columns))))
+    rows = query.order_by(*order_by(columns)).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key)
+                                     for column in columns])
+    return rows, next_cursor
@@ -0,0 +1,148 @@
+"""
+Read-through cache of applet reports loaded with `StorageManager`.
+
+Reports only change when an applet runs, but are read from the shared
+applets volume and parsed on every dashboard view. Loaded reports are kept
+per worker by applet, report and client, with at most `REPORT_CACHE_SIZE`
+reports, evicting the least recently used.
+
+Applets publish a copy of every new report at
+`REPORT_VERSION_DIR/<applet>/<report>/<client_id>.json`, replacing it
+atomically (see applets/common/reporting.py). Published reports are read
+instead of loading them with `StorageManager`, so a report being written is
+never read half-way, and a cached report is used as long as the published
+file is unchanged, which only costs a `stat`. When there is no published
+report (or no `REPORT_VERSION_DIR`), reports are loaded with `StorageManager`
+and cached for `REPORT_CACHE_TTL` seconds.
+
+Cached reports are shared between requests, and must not be modified.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+from mediapanel.applets import StorageManager
+
+from . import metrics
+
+DEFAULT_SIZE = 1024
+DEFAULT_TTL = 30
+
+
+class ReportCache:
+    def __init__(self, max_size: int = DEFAULT_SIZE, ttl: float = DEFAULT_TTL,
+                 version_dir: str = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version_dir = version_dir
+        self.hits = 0
+        self.misses = 0
+        # (applet, report, client ID) -> (version, loaded at, report)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, max_size: int = DEFAULT_SIZE,
+                  ttl: float = DEFAULT_TTL, version_dir: str = None):
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self.version_dir = version_dir
+            self._entries.clear()
+
+    def published_path(self, applet: str, report: str, client_id):
+        if self.version_dir is None:
+            return None
+        return os.path.join(self.version_dir, applet, report,
+                            "%s.json" % client_id)
+
+    @staticmethod
+    def stat_version(stat):
+        # Changes whenever the applet replaces the published report
+        return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+    def version(self, applet: str, report: str, client_id):
+        path = self.published_path(applet, report, client_id)
+        if path is None:
+            return None
+        try:
+            return self.stat_version(os.stat(path))
+        except OSError:
+            return None
+
+    def read_published(self, applet: str, report: str, client_id):
+        """
+        Read the published report, returning its version and data, or
+        `(None, None)` if there is none.
+        """
+        path = self.published_path(applet, report, client_id)
+        try:
+            with open(path) as f:
+                # The version of the file read, which may have been replaced
+                # since `version`
+                version = self.stat_version(os.fstat(f.fileno()))
+                return version, json.load(f)
+        except FileNotFoundError:
+            return None, None
+
+    def _get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            cached_version, loaded_at, data = entry
+            if version is not None:
+                valid = cached_version == version
+            else:
+                valid = (cached_version is None and
+                         time.time() - loaded_at < self.ttl)
+            if not valid:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def load(self, applet: str, report: str, client_id):
+        """
+        Load a report, from the cache if it has not changed. Raises the same
+        errors as `StorageManager.load` (IOError, or ValueError for invalid
+        JSON); failed loads are not cached.
+        """
+        key = (applet, report, client_id)
+        version = self.version(applet, report, client_id)
+        data = self._get(key, version)
+        metrics.count_report_cache(applet, report, data is not None)
+        if data is not None:
+            return data
+
+        with metrics.time_report_read(applet, report):
+            if version is not None:
+                version, data = self.read_published(applet, report,
+                                                    client_id)
+            if version is None:
+                data = StorageManager(applet, report, client_id).load()
+        with self._lock:
+            self._entries[key] = (version, time.time(), data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return data
+
+
+cache = ReportCache()
+
+
+def load(applet: str, report: str, client_id):
+    return cache.load(applet, report, client_id)
+
+
+def init_app(app):
+    cache.configure(
+        max_size=int(app.config.get("REPORT_CACHE_SIZE", DEFAULT_SIZE)),
+        ttl=float(app.config.get("REPORT_CACHE_TTL", DEFAULT_TTL)),
+        version_dir=app.config.get("REPORT_VERSION_DIR"))
@@ -0,0 +1,190 @@
+"""
+Per-client snapshot cache for dashboard views.
+
+Views like the index page build their data from the database, applet reports
+and device configs on the resources volume. The snapshot cache keeps the
+populated data for a short TTL so repeated views can be served from a shared
+local directory, `SNAPSHOT_CACHE_DIR`, so that every uWSGI worker and applet
+sees (and invalidates) the same snapshots.
+
+Without `SNAPSHOT_CACHE_DIR`, snapshots are kept in memory, which is only
+correct with a single process: invalidations from other workers and from
+applets never reach it. With several uWSGI workers, a directory in the
+temporary directory is used instead, shared by the workers but not by
+applets, whose changes then show up after at most `SNAPSHOT_TTL` seconds.
+
+Snapshots are stored per client and per user, because a user only sees their
+`allowed_devices`, but they are always invalidated per client.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+DEFAULT_TTL = 30
+
+# Used with several workers and no SNAPSHOT_CACHE_DIR
+WORKERS_CACHE_DIR = os.path.join(tempfile.gettempdir(),
+                                 "mediapanel_snapshots")
+
+
+def worker_count() -> int:
+    try:
+        import uwsgi
+    except ImportError:  # Not running under uWSGI
+        return 1
+    return uwsgi.numproc
+
+
+class SnapshotCache:
+    def __init__(self, ttl: float = DEFAULT_TTL, path: str = None):
+        self.ttl = ttl
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def configure(self, ttl: float = DEFAULT_TTL, path: str = None):
+        with self._lock:
+            self.ttl = ttl
+            self.path = path
+            self._entries.clear()
+
+    # Memory store {{{
+
+    def _memory_get(self, client_id, user_id):
+        with self._lock:
+            entry = self._entries.get(client_id, {}).get(user_id)
+        if entry is None:
+            return None
+        expires, data = entry
+        if expires < time.time():
+            return None
+        return data
+
+    def _memory_set(self, client_id, user_id, data, expires):
+        with self._lock:
+            self._entries.setdefault(client_id, {})[user_id] = (expires, data)
+
+    def _memory_invalidate(self, client_id):
+        with self._lock:
+            if client_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(client_id, None)
+
+    # }}}
+
+    # File store {{{
+
+    def _file_path(self, client_id, user_id=None):
+        if user_id is None:
+            return os.path.join(self.path, str(client_id))
+        return os.path.join(self.path, str(client_id), "%s.json" % user_id)
+
+    def _file_get(self, client_id, user_id):
+        try:
+            with open(self._file_path(client_id, user_id)) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (IOError, ValueError) as e:
+            logging.warning("Unreadable snapshot for client %s: %r",
+                            client_id, e)
+            return None
+        try:
+            if entry["expires"] < time.time():
+                return None
+            return entry["data"]
+        except (KeyError, TypeError) as e:
+            # Not written by `_file_set`, rebuilt like a missing snapshot
+            logging.warning("Malformed snapshot for client %s: %r",
+                            client_id, e)
+            return None
+
+    def _file_set(self, client_id, user_id, data, expires):
+        directory = self._file_path(client_id)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file and rename, readers in other workers
+        # should never see a partially written snapshot
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"expires": expires, "data": data}, f)
+            os.replace(tmp_path, self._file_path(client_id, user_id))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _file_invalidate(self, client_id):
+        if client_id is None:
+            if not os.path.isdir(self.path):
+                return
+            targets = [os.path.join(self.path, name)
+                       for name in os.listdir(self.path)]
+        else:
+            targets = [self._file_path(client_id)]
+        for target in targets:
+            shutil.rmtree(target, ignore_errors=True)
+
+    # }}}
+
+    def get(self, client_id, user_id):
+        """
+        Return the snapshot for a user of a client, or None if there is no
+        snapshot or the snapshot has expired.
+        """
+        if self.ttl <= 0:
+            return None
+        if self.path is not None:
+            return self._file_get(client_id, user_id)
+        return self._memory_get(client_id, user_id)
+
+    def set(self, client_id, user_id, data: dict):
+        if self.ttl <= 0:
+            return
+        expires = time.time() + self.ttl
+        if self.path is not None:
+            try:
+                self._file_set(client_id, user_id, data, expires)
+            except IOError as e:
+                logging.error("Could not store snapshot for client %s: %r",
+                              client_id, e)
+        else:
+            self._memory_set(client_id, user_id, data, expires)
+
+    def invalidate(self, client_id=None):
+        """
+        Drop every snapshot of a client; if `client_id` is None, drop every
+        snapshot of every client.
+        """
+        logging.debug("Invalidating snapshots for client: %r", client_id)
+        if self.path is not None:
+            try:
+                self._file_invalidate(client_id)
+            except IOError as e:
+                logging.error("Could not invalidate snapshots for %s: %r",
+                              client_id, e)
+        else:
+            self._memory_invalidate(client_id)
+
+
+cache = SnapshotCache()
+
+
+def invalidate(client_id=None):
+    cache.invalidate(client_id)
+
+
+def init_app(app):
+    path = app.config.get("SNAPSHOT_CACHE_DIR")
+    if path is None and worker_count() > 1:
+        logging.warning("SNAPSHOT_CACHE_DIR is not set, snapshots are only "
+                        "shared by the workers in %s and are not "
+                        "invalidated by applets", WORKERS_CACHE_DIR)
+        path = WORKERS_CACHE_DIR
+    cache.configure(ttl=float(app.config.get("SNAPSHOT_TTL", DEFAULT_TTL)),
+                    path=path)
@@ -20,5 +20,11 @@ setup(
     extras_require={
         "postgres": "psycopg2-binary",
         "mysql": "pymysql",
+        "thumbnails": "Pillow",
+        "brotli": "Brotli",
+        "orjson": "orjson",
+        "numpy": "numpy",
+        "test": "pytest",
     },
-    install_requires=['flask', 'flask_sqlalchemy', 'gigaspoon', 'mediapanel'])
+    install_requires=['flask', 'flask_sqlalchemy', 'gigaspoon', 'mediapanel',
+                      'prometheus_client'])
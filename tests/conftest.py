@@ -0,0 +1,55 @@
+"""
+An app with the content manager, and a client logged in with Basic
+authorization as a user of client 1.
+"""
+
+import base64
+import hashlib
+
+import pytest
+from flask import Flask
+
+from mediapanel.db.user import UserType
+from mediapanel_beta import auth, content_manager, models
+from mediapanel_beta.models import Client, User, db
+
+EMAIL = "user@example.com"
+PASSWORD = "Password"
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY="test",
+        SQLALCHEMY_DATABASE_URI="sqlite:///%s" % (tmp_path / "test.db"),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        RESOURCES_FOLDER=str(tmp_path / "resources"))
+    models.init_app(app)
+    auth.init_app(app)
+    app.register_blueprint(auth.blueprint)
+    app.register_blueprint(content_manager.blueprint)
+
+    with app.app_context():
+        db.create_all()
+        client = Client(email=EMAIL, uuid="uuid")
+        db.session.add(client)
+        db.session.flush()
+        salt = "salt"
+        db.session.add(User(
+            client_id=client.client_id, type=UserType.client,
+            first_name="First", last_name="Last", email=EMAIL,
+            password=hashlib.sha512((salt + PASSWORD).encode("utf8"))
+            .hexdigest(),
+            salt=salt, get_alert_emails=0))
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    credentials = base64.b64encode(
+        ("%s:%s" % (EMAIL, PASSWORD)).encode("utf8")).decode()
+    client.environ_base["HTTP_AUTHORIZATION"] = "Basic " + credentials
+    return client
@@ -0,0 +1,165 @@
+import importlib.util
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from mediapanel_beta.reports import ReportCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded from its path, as every applet's module is named `service`
+spec = importlib.util.spec_from_file_location(
+    "ads_service", os.path.join(ROOT, "applets", "ads", "app", "service.py"))
+service = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(service)
+
+
+@pytest.fixture
+def parsed(tmp_path, monkeypatch):
+    # Files parsed by `load_ads`, which reads ad summaries as plain JSON
+    parsed = []
+
+    def load_ads(filename):
+        parsed.append(filename)
+        with open(filename) as f:
+            return json.load(f)
+    monkeypatch.setattr(service, "load_ads", load_ads)
+    monkeypatch.setattr(service, "BASE", str(tmp_path / "resources"))
+    monkeypatch.setattr(service, "MANIFEST_DIR", str(tmp_path / "manifests"))
+    monkeypatch.setattr(service, "_manifests", {})
+    return parsed
+
+
+def write_ads(device_id: str, ads: list, client_id: int = 1) -> str:
+    directory = os.path.join(service.BASE, str(client_id), "1", device_id,
+                             service.HOMEDIR)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "adConfig.json")
+    with open(path, "w") as f:
+        json.dump(ads, f)
+    return path
+
+
+def ad(name: str) -> dict:
+    return {"name": name, "start": "2026-01-01T00:00:00",
+            "end": "2026-12-31T00:00:00"}
+
+
+def refresh(client_id_str: str = "1") -> list:
+    manifest = service.get_manifest(client_id_str)
+    return manifest.refresh(service.find_ad_files(client_id_str))
+
+
+def test_only_changed_files_parsed(parsed):
+    first = write_ads("aaaa0001", [ad("First")])
+    second = write_ads("aaaa0002", [ad("Second")])
+    assert sorted(a["name"] for a in refresh()) == ["First", "Second"]
+    assert sorted(parsed) == sorted([first, second])
+
+    parsed.clear()
+    assert len(refresh()) == 2
+    assert parsed == []
+
+    write_ads("aaaa0002", [ad("Second"), ad("Third")])
+    assert len(refresh()) == 3
+    assert parsed == [second]
+
+
+def test_removed_files_dropped(parsed):
+    write_ads("aaaa0001", [ad("First")])
+    second = write_ads("aaaa0002", [ad("Second")])
+    refresh()
+    os.unlink(second)
+    assert service.client_changed("1")
+    assert [a["name"] for a in refresh()] == ["First"]
+    assert not service.client_changed("1")
+
+
+def test_manifest_saved(parsed):
+    write_ads("aaaa0001", [ad("First")])
+    refresh()
+    service.get_manifest("1").save()
+    parsed.clear()
+    # A new process starts from the saved manifest
+    service._manifests.clear()
+    assert len(refresh()) == 1
+    assert parsed == []
+
+
+def test_unreadable_manifest(parsed):
+    write_ads("aaaa0001", [ad("First")])
+    os.makedirs(service.MANIFEST_DIR)
+    with open(os.path.join(service.MANIFEST_DIR, "1.json"), "w") as f:
+        f.write("{\"files\": ")
+    # Rebuilt with a full scan
+    assert len(refresh()) == 1
+    assert len(parsed) == 1
+
+
+def test_invalid_file_skipped(parsed):
+    write_ads("aaaa0001", [ad("First")])
+    path = write_ads("aaaa0002", [])
+    with open(path, "w") as f:
+        f.write("not json")
+    assert [a["name"] for a in refresh()] == ["First"]
+
+
+class FakeStorageManager:
+    saved = []
+
+    def __init__(self, applet, report):
+        self.applet, self.report = applet, report
+
+    def save(self, data, client_id):
+        self.saved.append((client_id, data))
+
+
+@pytest.fixture
+def published(tmp_path, monkeypatch):
+    # Directories shared with the dashboard
+    monkeypatch.setattr(FakeStorageManager, "saved", [])
+    monkeypatch.setattr(service, "StorageManager", FakeStorageManager)
+    monkeypatch.setattr(service.reporting, "REPORT_VERSION_DIR",
+                        str(tmp_path / "reports"))
+    monkeypatch.setattr(service.reporting, "SNAPSHOT_CACHE_DIR",
+                        str(tmp_path / "snapshots"))
+    return tmp_path
+
+
+def test_report_saved_when_changed(parsed, published):
+    now = datetime(2026, 6, 1)
+    write_ads("aaaa0001", [{"name": "Expiring",
+                            "start": "2026-01-01T00:00:00",
+                            "end": "2026-06-03T00:00:00"}])
+    assert service.process_client("1", now)["saved"]
+    assert service.process_client("1", now)["saved"] is False
+    assert len(FakeStorageManager.saved) == 1
+    client_id, report = FakeStorageManager.saved[0]
+    assert client_id == 1
+    assert [ad["name"] for ad in report["expiring"]] == ["Expiring"]
+
+    write_ads("aaaa0002", [{"name": "Upcoming",
+                            "start": "2026-06-03T00:00:00",
+                            "end": "2026-07-01T00:00:00"}])
+    assert service.process_client("1", now)["saved"]
+    assert [ad["name"] for ad in FakeStorageManager.saved[-1][1][
+        "upcoming"]] == ["Upcoming"]
+
+
+def test_report_published(parsed, published):
+    # The dashboard's snapshots of the client are dropped
+    snapshot = published / "snapshots" / "1" / "1.json"
+    snapshot.parent.mkdir(parents=True)
+    snapshot.write_text("{}")
+    write_ads("aaaa0001", [ad("First")])
+    service.process_client("1", datetime(2026, 6, 1))
+    assert not snapshot.exists()
+
+    # And read by the dashboard without StorageManager
+    cache = ReportCache(version_dir=str(published / "reports"))
+    assert cache.load("media_scheduler", "index", 1) == \
+        FakeStorageManager.saved[0][1]
+    assert os.listdir(published / "reports" / "media_scheduler" /
+                      "index") == ["1.json"]
@@ -0,0 +1,100 @@
+import gzip
+from datetime import datetime
+
+import pytest
+from flask import Flask, flash
+
+from mediapanel_beta.app_view import AppRouteView, etag_of
+
+ITEMS = ["item %i" % i for i in range(200)]
+
+
+class Items(AppRouteView):
+    etag_ignore = ("current_time",)
+
+    def populate(self):
+        return {"items": ITEMS, "current_time": datetime.now()}
+
+    def render_template(self, **context):
+        return "<ul>%s</ul>" % "".join("<li>%s</li>" % item
+                                       for item in context["items"])
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "test"
+    app.add_url_rule("/items", view_func=Items.as_view("items"))
+
+    @app.route("/flash")
+    def add_flash():
+        flash("Saved|success", "notification")
+        return ""
+
+    return app
+
+
+def etag(response) -> str:
+    value, weak = response.get_etag()
+    assert weak
+    return value
+
+
+def test_etag_of():
+    assert etag_of(b"data") == etag_of(b"data")
+    assert etag_of(b"data") != etag_of(b"other data")
+
+
+def test_json_not_modified(app):
+    client = app.test_client()
+    response = client.get("/items", content_type="application/json")
+    assert response.status_code == 200
+    # The current time is ignored, so the ETag only changes with the items
+    response = client.get("/items", content_type="application/json",
+                          headers={"If-None-Match": 'W/"%s"' %
+                                   etag(response)})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_html_not_modified(app):
+    client = app.test_client()
+    response = client.get("/items")
+    assert response.status_code == 200
+    headers = {"If-None-Match": 'W/"%s"' % etag(response)}
+    assert client.get("/items", headers=headers).status_code == 304
+    assert client.get("/items", headers={
+        "If-None-Match": 'W/"other"'}).status_code == 200
+
+
+def test_html_pending_flashes(app):
+    # Pages showing flashed messages are always sent
+    client = app.test_client()
+    headers = {"If-None-Match": 'W/"%s"' % etag(client.get("/items"))}
+    client.get("/flash")
+    response = client.get("/items", headers=headers)
+    assert response.status_code == 200
+    assert response.get_etag() == (None, None)
+
+
+def test_compress(app):
+    client = app.test_client()
+    response = client.get("/items", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    body = gzip.decompress(response.data).decode()
+    assert body.startswith("<ul><li>item 0</li>")
+
+
+def test_compress_small_body(app):
+    app.config["COMPRESS_MIN_SIZE"] = 1024 * 1024
+    response = app.test_client().get("/items",
+                                     headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_compress_not_accepted(app):
+    response = app.test_client().get("/items",
+                                     headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.data.startswith(b"<ul>")
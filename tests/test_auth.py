@@ -0,0 +1,94 @@
+import base64
+import hashlib
+from datetime import datetime
+
+import pytest
+from flask import Flask, g, session
+
+from mediapanel.db.user import UserType
+from mediapanel_beta import auth, models
+from mediapanel_beta.models import ApiToken, Client, User, db
+
+EMAIL = "user@example.com"
+PASSWORD = "Password"
+TOKEN = "test-token"
+
+
+def basic(username: str, password: str) -> str:
+    credentials = "%s:%s" % (username, password)
+    return "Basic " + base64.b64encode(credentials.encode("utf8")).decode()
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY="test",
+        SQLALCHEMY_DATABASE_URI="sqlite:///%s" % (tmp_path / "primary.db"),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # With a replica, writes of a request set a session cookie sending
+        # the client's next reads to the primary
+        DATABASE_REPLICA_URIS="sqlite:///%s" % (tmp_path / "replica.db"))
+    models.init_app(app)
+    auth.init_app(app)
+    app.register_blueprint(auth.blueprint)
+
+    @app.route("/whoami")
+    @auth.login_required
+    def whoami():
+        session["visited"] = True
+        return g.user.email
+
+    with app.app_context():
+        db.create_all()
+        client = Client(email=EMAIL, uuid="uuid")
+        db.session.add(client)
+        db.session.flush()
+        salt = "salt"
+        user = User(client_id=client.client_id, type=UserType.client,
+                    first_name="First", last_name="Last", email=EMAIL,
+                    password=hashlib.sha512(
+                        (salt + PASSWORD).encode("utf8")).hexdigest(),
+                    salt=salt, get_alert_emails=0)
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(ApiToken(user_id=user.user_id, name="test",
+                                token_hash=auth.hash_token(TOKEN),
+                                prefix=TOKEN[:8], created=datetime.now()))
+        db.session.commit()
+    return app
+
+
+def test_basic_login(app):
+    response = app.test_client().get(
+        "/whoami", headers={"Authorization": basic(EMAIL, PASSWORD)})
+    assert response.status_code == 200
+    assert response.data.decode() == EMAIL
+
+
+@pytest.mark.parametrize("header", [
+    basic(EMAIL, ""),
+    basic("", PASSWORD),
+    'Digest username="%s", realm="mediapanel", nonce="0", uri="/whoami", '
+    'response="0"' % EMAIL,
+])
+def test_invalid_authorization(app, header):
+    response = app.test_client().get("/whoami",
+                                     headers={"Authorization": header})
+    assert response.status_code == 403
+
+
+def test_token_stateless(app):
+    response = app.test_client().get(
+        "/whoami", headers={"Authorization": "Bearer " + TOKEN})
+    assert response.status_code == 200
+    # Neither the session nor the `last_used` update set a cookie
+    assert "Set-Cookie" not in response.headers
+    with app.app_context():
+        assert ApiToken.query.one().last_used is not None
+
+
+def test_unknown_token(app):
+    response = app.test_client().get(
+        "/whoami", headers={"Authorization": "Bearer unknown"})
+    assert response.status_code == 403
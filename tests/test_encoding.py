@@ -0,0 +1,55 @@
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from uuid import UUID
+
+import pytest
+
+from mediapanel_beta import encoding
+
+VALUES = [
+    {"now": datetime(2026, 10, 18, 12, 30, 5)},
+    {"now": datetime(2026, 10, 18, 12, 30, 5, 123456)},
+    {"now": datetime(2026, 10, 18, 12, 30, tzinfo=timezone.utc)},
+    {"now": datetime(2026, 10, 18, 12, 30,
+                     tzinfo=timezone(timedelta(hours=-5)))},
+    {"day": date(2024, 2, 29), "at": time(8, 15, 0, 500)},
+    {"size": Decimal("4.57"), "uuid": UUID(int=1)},
+    {"devices": [{"device_id": "aaaa0001", "name": "Lobby ☃"}]},
+    {"counts": {1: "integer key"}, "nested": {"empty": [], "none": None}},
+]
+
+
+@pytest.fixture
+def backends():
+    pytest.importorskip("orjson")
+    return encoding.get_backend("json"), encoding.get_backend("orjson")
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_parity(backends, value):
+    json_backend, orjson_backend = backends
+    assert json_backend.dumps(value) == orjson_backend.dumps(value)
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_sort_keys(backends, value):
+    # Used for ETags
+    json_backend, orjson_backend = backends
+    assert json_backend.dumps(value, sort_keys=True) == \
+        orjson_backend.dumps(value, sort_keys=True)
+
+
+def test_datetime_format():
+    backend = encoding.get_backend("json")
+    assert backend.dumps({"now": datetime(2026, 10, 18, 12, 30)}) == \
+        b'{"now":"2026-10-18T12:30:00"}'
+
+
+def test_unknown_type():
+    with pytest.raises(TypeError):
+        encoding.get_backend("json").dumps({"value": object()})
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        encoding.get_backend("yaml")
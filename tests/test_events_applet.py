@@ -0,0 +1,72 @@
+import importlib.util
+import os
+from datetime import date, datetime
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded from its path, as every applet's module is named `service`
+spec = importlib.util.spec_from_file_location(
+    "events_service",
+    os.path.join(ROOT, "applets", "events", "app", "service.py"))
+service = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(service)
+
+
+@pytest.mark.parametrize("event_date, today, expected", [
+    # Later this year, and today
+    (date(1990, 6, 15), date(2026, 6, 1), date(2026, 6, 15)),
+    (date(1990, 6, 1), date(2026, 6, 1), date(2026, 6, 1)),
+    # Already happened this year
+    (date(1990, 5, 31), date(2026, 6, 1), date(2027, 5, 31)),
+    (date(1990, 1, 1), date(2026, 12, 31), date(2027, 1, 1)),
+    (date(1990, 12, 31), date(2026, 12, 31), date(2026, 12, 31)),
+    # February 29
+    (date(2000, 2, 29), date(2027, 2, 1), date(2027, 2, 28)),
+    (date(2000, 2, 29), date(2028, 2, 1), date(2028, 2, 29)),
+    (date(2000, 2, 29), date(2026, 3, 1), date(2027, 2, 28)),
+    (date(2000, 2, 29), date(2027, 3, 1), date(2028, 2, 29)),
+    (date(2000, 2, 29), date(2027, 2, 28), date(2027, 2, 28)),
+])
+def test_next_occurrence(event_date, today, expected):
+    assert service.next_occurrence(event_date, today) == expected
+
+
+class FakeEventsConfig:
+    events = {}
+
+    @classmethod
+    def from_v6_id(cls, client_id, device_id, base_path):
+        return cls()
+
+
+def person(name: str):
+    return SimpleNamespace(name=name)
+
+
+def test_upcoming_device_events(monkeypatch):
+    monkeypatch.setattr(FakeEventsConfig, "events", {
+        "Birthday": SimpleNamespace(events=[
+            (person("Today"), date(1990, 6, 1)),
+            (person("Soon"), date(1990, 6, 3)),
+            (person("Later"), date(1990, 9, 1)),
+            (person("Invalid"), "June 5"),
+        ]),
+        "Anniversary": SimpleNamespace(events=[
+            (person("Leap"), date(2000, 2, 29)),
+        ]),
+    })
+    monkeypatch.setattr(service, "EventsConfig", FakeEventsConfig)
+    upcoming = service.upcoming_device_events(1, "aaaa0001",
+                                              datetime(2027, 2, 20, 12))
+    assert upcoming == [
+        (8, ["Anniversary", "Leap", "February 29", "aaaa0001"]),
+    ]
+    upcoming = service.upcoming_device_events(1, "aaaa0001",
+                                              datetime(2026, 5, 31, 12))
+    assert upcoming == [
+        (1, ["Birthday", "Today", "June 01", "aaaa0001"]),
+        (3, ["Birthday", "Soon", "June 03", "aaaa0001"]),
+    ]
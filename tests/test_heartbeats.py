@@ -0,0 +1,110 @@
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from mediapanel_beta import heartbeats
+from mediapanel_beta.heartbeats import HeartbeatBuffer
+from mediapanel_beta.models import Device, db
+
+URL = "/manage/device/heartbeat"
+DEVICE_IDS = ("aaaa0001", "aaaa0002", "aaaa0003")
+
+
+@pytest.fixture
+def devices(app):
+    with app.app_context():
+        for device_id in DEVICE_IDS:
+            db.session.add(Device(device_id=device_id, client_id=1,
+                                  nickname=device_id))
+        db.session.commit()
+
+
+@pytest.fixture
+def buffer(app, devices):
+    # Flushed by the tests only
+    buffer = HeartbeatBuffer()
+    buffer.configure(app, flush_interval=3600)
+    buffer.start = lambda: None
+    return buffer
+
+
+def device(app, device_id: str) -> Device:
+    with app.app_context():
+        return db.session.query(Device).get(device_id)
+
+
+def fail_bulk_update(monkeypatch, error, device_ids=None):
+    # Writes of `device_ids`, or every write, fail with `error`
+    bulk_update_mappings = db.session.bulk_update_mappings
+
+    def failing(mapper, mappings):
+        if device_ids is None or any(mapping["device_id"] in device_ids
+                                     for mapping in mappings):
+            raise error
+        return bulk_update_mappings(mapper, mappings)
+    monkeypatch.setattr(db.session, "bulk_update_mappings", failing)
+
+
+def test_merge(app, buffer):
+    with app.app_context():
+        buffer.add(1, "aaaa0001", {"free_disk": 1, "total_disk": 10})
+        buffer.add(1, "aaaa0001", {"free_disk": 2, "total_disk": 10})
+        assert buffer.counters["merged"] == 1
+        buffer.flush()
+    assert buffer.counters["written"] == 1
+    assert device(app, "aaaa0001").free_disk == 2
+
+
+def test_drop_after_max_attempts(app, buffer, monkeypatch):
+    fail_bulk_update(monkeypatch, OperationalError("UPDATE", {}, None))
+    with app.app_context():
+        buffer.add(1, "aaaa0001", {"device_ip": "10.0.0.1"})
+        for attempt in range(heartbeats.MAX_ATTEMPTS):
+            assert "aaaa0001" in buffer._pending
+            buffer.flush()
+    assert buffer._pending == {}
+    assert buffer.counters["dropped"] == 1
+    assert buffer.counters["written"] == 0
+
+
+def test_row_fallback(app, buffer, monkeypatch):
+    # One heartbeat which cannot be written does not hold back the others
+    fail_bulk_update(monkeypatch, IntegrityError("UPDATE", {}, None),
+                     device_ids={"aaaa0002"})
+    with app.app_context():
+        for device_id in DEVICE_IDS:
+            buffer.add(1, device_id, {"device_ip": "10.0.0.1"})
+        buffer.flush()
+    assert list(buffer._pending) == ["aaaa0002"]
+    assert buffer.counters["written"] == 2
+    assert device(app, "aaaa0001").device_ip == "10.0.0.1"
+    assert device(app, "aaaa0002").device_ip is None
+    assert device(app, "aaaa0003").device_ip == "10.0.0.1"
+
+
+def test_unknown_device(app, client, devices, monkeypatch):
+    # Written when received
+    buffer = HeartbeatBuffer()
+    buffer.configure(app, flush_interval=0)
+    monkeypatch.setattr(heartbeats, "buffer", buffer)
+    monkeypatch.setattr(heartbeats, "client_devices",
+                        heartbeats.ClientDevices())
+    response = client.post(URL, json={"heartbeats": [
+        {"device_id": "aaaa0001", "system_version": "6.7.8"},
+        {"device_id": "bbbb0001", "system_version": "6.7.8"},
+    ]})
+    assert response.status_code == 202
+    assert response.json["accepted"] == 1
+    assert response.json["unknown"] == ["bbbb0001"]
+    assert device(app, "aaaa0001").system_version == "6.7.8"
+
+
+@pytest.mark.parametrize("heartbeat", [
+    {"device_ip": "not an address"},
+    {"device_ip": "10.0.0.256"},
+    {"free_disk": 1},
+    {"free_disk": -1, "total_disk": 10},
+    {"system_version": "latest"},
+])
+def test_invalid_heartbeat(client, devices, heartbeat):
+    response = client.post(URL, json=dict(heartbeat, device_id="aaaa0001"))
+    assert response.status_code == 400
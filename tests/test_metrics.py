@@ -0,0 +1,43 @@
+import pytest
+from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from mediapanel_beta import metrics
+
+PUBLIC = {"REMOTE_ADDR": "203.0.113.1"}
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.wsgi_app = ProxyFix(app.wsgi_app)
+    app.config["METRICS_TOKEN"] = "secret"
+    metrics.init_app(app)
+    app.register_blueprint(metrics.blueprint)
+    return app
+
+
+def test_private_network(app):
+    response = app.test_client().get(
+        "/metrics", environ_base={"REMOTE_ADDR": "10.1.2.3"})
+    assert response.status_code == 200
+    assert b"mediapanel_request_seconds" in response.data
+
+
+def test_public_network(app):
+    client = app.test_client()
+    assert client.get("/metrics", environ_base=PUBLIC).status_code == 403
+    # Not trusted from clients
+    assert client.get("/metrics", environ_base=PUBLIC, headers={
+        "X-Forwarded-For": "127.0.0.1"}).status_code == 403
+
+
+@pytest.mark.parametrize("token, status_code", [
+    ("secret", 200),
+    ("wrong", 403),
+])
+def test_token(app, token, status_code):
+    response = app.test_client().get(
+        "/metrics", environ_base=PUBLIC,
+        headers={"Authorization": "Bearer " + token})
+    assert response.status_code == status_code
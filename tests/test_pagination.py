@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, DateTime, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from mediapanel_beta import pagination
+
+Base = declarative_base()
+
+
+class Row(Base):
+    __tablename__ = "row"
+    row_id = Column(String(8), primary_key=True)
+    nickname = Column(String(64))
+    last_ping = Column(DateTime)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    now = datetime(2026, 10, 18, 12)
+    session.add_all([
+        Row(row_id="%02i" % i, nickname="Display %i" % (i % 3),
+            last_ping=None if i % 3 == 0 else now - timedelta(minutes=i))
+        for i in range(10)])
+    session.commit()
+    yield session
+    session.close()
+
+
+def all_pages(query, columns, limit: int) -> list:
+    rows, cursor = pagination.paginate(query, columns, limit=limit)
+    pages = [rows]
+    while cursor is not None:
+        rows, cursor = pagination.paginate(query, columns, cursor, limit)
+        pages.append(rows)
+    return pages
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 10])
+def test_pages_through_null_sort_values(session, limit):
+    columns = (Row.last_ping, Row.row_id)
+    pages = all_pages(session.query(Row), columns, limit)
+    rows = [row.row_id for page in pages for row in page]
+
+    never_pinged = ["00", "03", "06", "09"]
+    pinged = sorted(set("%02i" % i for i in range(10)) - set(never_pinged),
+                    key=lambda row_id: -int(row_id))
+    assert rows == never_pinged + pinged
+    assert all(len(page) <= limit for page in pages)
+
+
+def test_cursor_of_null_row(session):
+    columns = (Row.last_ping, Row.row_id)
+    cursor = pagination.encode_cursor([None, "03"])
+    rows, _ = pagination.paginate(session.query(Row), columns, cursor, 3)
+    assert [row.row_id for row in rows] == ["06", "09", "08"]
+
+
+def test_pages_through_unique_column(session):
+    pages = all_pages(session.query(Row), (Row.row_id,), 4)
+    assert [[row.row_id for row in page] for page in pages] == [
+        ["00", "01", "02", "03"], ["04", "05", "06", "07"], ["08", "09"]]
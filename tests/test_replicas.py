@@ -0,0 +1,89 @@
+import sqlite3
+
+import pytest
+from flask import Flask, request
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+
+from mediapanel_beta import models
+from mediapanel_beta.models import db
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = "item"
+    item_id = Column(Integer, primary_key=True)
+    value = Column(String(16))
+
+
+@pytest.fixture
+def app(tmp_path):
+    # The same row, with a different value in the primary and the replica,
+    # shows which database a read went to
+    primary, replica = tmp_path / "primary.db", tmp_path / "replica.db"
+    for path, value in ((primary, "primary"), (replica, "replica")):
+        connection = sqlite3.connect(str(path))
+        connection.execute("CREATE TABLE item (item_id INTEGER PRIMARY KEY, "
+                           "value VARCHAR(16))")
+        connection.execute("INSERT INTO item VALUES (1, ?)", (value,))
+        connection.commit()
+        connection.close()
+
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY="test",
+        SQLALCHEMY_DATABASE_URI="sqlite:///%s" % primary,
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        DATABASE_REPLICA_URIS="sqlite:///%s" % replica)
+    models.init_app(app)
+
+    @app.route("/item", methods=["GET", "POST"])
+    def item():
+        if request.method == "GET":
+            models.use_replica(app)
+        else:
+            db.session.query(Item).get(1).value = request.form["value"]
+            db.session.commit()
+        return db.session.query(Item).get(1).value
+
+    return app
+
+
+def read_primary(app) -> str:
+    connection = sqlite3.connect(
+        app.config["SQLALCHEMY_DATABASE_URI"][len("sqlite:///"):])
+    try:
+        return connection.execute("SELECT value FROM item").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_reads_go_to_replica(app):
+    with app.test_client() as client:
+        assert client.get("/item").data == b"replica"
+
+
+def test_writes_go_to_primary(app):
+    with app.test_client() as client:
+        rv = client.post("/item", data={"value": "written"})
+        # Read back from the primary in the same request
+        assert rv.data == b"written"
+    assert read_primary(app) == "written"
+
+
+def test_reads_stick_to_primary_after_write(app):
+    with app.test_client() as client:
+        client.post("/item", data={"value": "written"})
+        assert client.get("/item").data == b"written"
+
+        with client.session_transaction() as session:
+            # As if `DATABASE_REPLICA_STICKY` seconds passed
+            session["db_primary_until"] = 0
+        assert client.get("/item").data == b"replica"
+
+
+def test_reads_without_replicas_go_to_primary(app):
+    app.config["SQLALCHEMY_BINDS"] = {}
+    with app.test_client() as client:
+        assert client.get("/item").data == b"primary"
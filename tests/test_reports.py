@@ -0,0 +1,109 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from mediapanel_beta import reports
+from mediapanel_beta.reports import ReportCache
+
+
+class FakeStorageManager:
+    # Reports by (applet, report, client ID), and how often each was loaded
+    reports = {}
+    loads = []
+
+    def __init__(self, applet, report, client_id):
+        self.key = (applet, report, client_id)
+
+    def load(self):
+        self.loads.append(self.key)
+        report = self.reports[self.key]
+        if isinstance(report, Exception):
+            raise report
+        return report
+
+
+@pytest.fixture(autouse=True)
+def storage_manager(monkeypatch):
+    monkeypatch.setattr(FakeStorageManager, "reports", {})
+    monkeypatch.setattr(FakeStorageManager, "loads", [])
+    monkeypatch.setattr(reports, "StorageManager", FakeStorageManager)
+    return FakeStorageManager
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ReportCache(version_dir=str(tmp_path))
+
+
+def publish(cache, client_id, text: str):
+    # Like applets/common/reporting.py, replaced atomically
+    path = cache.published_path("media_scheduler", "index", client_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+def load(cache, client_id=1):
+    return cache.load("media_scheduler", "index", client_id)
+
+
+def test_published(cache, storage_manager):
+    publish(cache, 1, json.dumps({"expiring": [1]}))
+    assert load(cache) == {"expiring": [1]}
+    assert load(cache) == {"expiring": [1]}
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Replacing the report is seen on the next load
+    publish(cache, 1, json.dumps({"expiring": [2]}))
+    assert load(cache) == {"expiring": [2]}
+    assert storage_manager.loads == []
+
+
+def test_malformed_published(cache):
+    publish(cache, 1, "{\"expiring\": ")
+    with pytest.raises(ValueError):
+        load(cache)
+    # Failed loads are not cached
+    publish(cache, 1, json.dumps({"expiring": []}))
+    assert load(cache) == {"expiring": []}
+
+
+def test_unpublished(cache, storage_manager, monkeypatch):
+    # Loaded with StorageManager and cached for the TTL
+    storage_manager.reports[("media_scheduler", "index", 1)] = {"ads": 1}
+    assert load(cache) == {"ads": 1}
+    assert load(cache) == {"ads": 1}
+    assert len(storage_manager.loads) == 1
+    monkeypatch.setattr(reports, "time", SimpleNamespace(
+        time=lambda: float("inf")))
+    assert load(cache) == {"ads": 1}
+    assert len(storage_manager.loads) == 2
+
+
+def test_unpublished_after_published(cache, storage_manager):
+    storage_manager.reports[("media_scheduler", "index", 1)] = {"ads": 1}
+    publish(cache, 1, json.dumps({"ads": 2}))
+    assert load(cache) == {"ads": 2}
+    os.unlink(cache.published_path("media_scheduler", "index", 1))
+    assert load(cache) == {"ads": 1}
+
+
+def test_failed_load(cache, storage_manager):
+    key = ("media_scheduler", "index", 1)
+    storage_manager.reports[key] = IOError("no report")
+    with pytest.raises(IOError):
+        load(cache)
+    storage_manager.reports[key] = {"ads": 1}
+    assert load(cache) == {"ads": 1}
+
+
+def test_max_size(tmp_path):
+    cache = ReportCache(max_size=2, version_dir=str(tmp_path))
+    for client_id in (1, 2, 3):
+        publish(cache, client_id, json.dumps({"client": client_id}))
+        load(cache, client_id)
+    load(cache, 3)
+    load(cache, 1)
+    assert (cache.hits, cache.misses) == (1, 4)
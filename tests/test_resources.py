@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import Query
+
+from mediapanel_beta.content_manager import resources
+from mediapanel_beta.models import Asset, db
+
+URL = "/manage/device/aaaa0001/resources"
+FLAGS = ("is_digital_frame", "is_display_ad", "is_alerts", "is_jukebox")
+
+
+@pytest.fixture
+def assets(app):
+    # Assets 1 to 5 of client 1, and 6 of another client
+    with app.app_context():
+        for asset_id in range(1, 7):
+            db.session.add(Asset(
+                id=asset_id, client_id=1 if asset_id <= 5 else 2,
+                group_id=0, device_id="aaaa0001",
+                filename="file_%i.png" % asset_id,
+                display_name="File %i" % asset_id,
+                timestamp=datetime(2026, 1, 1), size=1.0,
+                **{flag: False for flag in FLAGS}))
+        db.session.commit()
+
+
+def flags(app) -> dict:
+    # Asset ID -> whether it is a display ad
+    with app.app_context():
+        return dict(db.session.query(Asset.id, Asset.is_display_ad))
+
+
+def test_bulk_update(app, client, assets, monkeypatch):
+    # Several UPDATEs, in a single transaction
+    monkeypatch.setattr(resources, "BULK_CHUNK_SIZE", 2)
+    response = client.patch(URL, json={
+        "ids": [1, 2, 2, 3, 6, 99], "flags": {"is_display_ad": True}})
+    assert response.status_code == 200
+    assert response.json["updated"] == 3
+    assert response.json["results"] == [
+        {"id": 1, "status_code": 200},
+        {"id": 2, "status_code": 200},
+        {"id": 3, "status_code": 200},
+        {"id": 6, "status_code": 404},
+        {"id": 99, "status_code": 404},
+    ]
+    assert flags(app) == {1: True, 2: True, 3: True, 4: False, 5: False,
+                          6: False}
+
+
+@pytest.mark.parametrize("body", [
+    [],
+    {"ids": [1], "flags": {}},
+    {"ids": "1", "flags": {"is_display_ad": True}},
+    {"ids": [True], "flags": {"is_display_ad": True}},
+    {"ids": [1], "flags": {"filename": True}},
+    {"ids": [1], "flags": {"is_display_ad": 1}},
+])
+def test_invalid(app, client, assets, body):
+    response = client.patch(URL, json=body)
+    assert response.status_code == 400
+    assert not any(flags(app).values())
+
+
+def test_too_many_ids(client, assets, monkeypatch):
+    monkeypatch.setattr(resources.ListResources, "max_bulk_ids", 2)
+    response = client.patch(URL, json={
+        "ids": [1, 2, 3], "flags": {"is_display_ad": True}})
+    assert response.status_code == 400
+
+
+def test_rolled_back(app, client, assets, monkeypatch):
+    # A failing chunk leaves every resource as it was
+    monkeypatch.setattr(resources, "BULK_CHUNK_SIZE", 2)
+    update = Query.update
+    calls = []
+
+    def failing_update(query, *args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError("connection lost")
+        return update(query, *args, **kwargs)
+    monkeypatch.setattr(Query, "update", failing_update)
+    response = client.patch(URL, json={"ids": [1, 2, 3, 4],
+                                       "flags": {"is_display_ad": True}})
+    assert response.status_code == 500
+    assert len(calls) == 2
+    assert not any(flags(app).values())
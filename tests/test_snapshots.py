@@ -0,0 +1,83 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from mediapanel_beta import snapshots
+from mediapanel_beta.snapshots import SnapshotCache
+
+DATA = {"devices": 3, "ads": {"expiring": [], "upcoming": []}}
+
+
+@pytest.fixture(params=["memory", "file"])
+def cache(request, tmp_path):
+    return SnapshotCache(ttl=60, path=(str(tmp_path / "snapshots")
+                                       if request.param == "file" else None))
+
+
+def test_get_set(cache):
+    assert cache.get(1, 1) is None
+    cache.set(1, 1, DATA)
+    assert cache.get(1, 1) == DATA
+    # Snapshots are per user
+    assert cache.get(1, 2) is None
+
+
+def test_disabled(cache):
+    cache.ttl = 0
+    cache.set(1, 1, DATA)
+    assert cache.get(1, 1) is None
+
+
+def test_invalidate(cache):
+    for client_id in (1, 2):
+        for user_id in (1, 2):
+            cache.set(client_id, user_id, DATA)
+    cache.invalidate(1)
+    assert cache.get(1, 1) is None and cache.get(1, 2) is None
+    assert cache.get(2, 1) == DATA
+    cache.invalidate()
+    assert cache.get(2, 1) is None
+
+
+def test_expired(cache, monkeypatch):
+    cache.set(1, 1, DATA)
+    monkeypatch.setattr(snapshots, "time", SimpleNamespace(
+        time=lambda: float("inf")))
+    assert cache.get(1, 1) is None
+
+
+@pytest.mark.parametrize("content", [
+    "",
+    "{\"expires\": ",
+    "[]",
+    "{\"data\": {}}",
+    "{\"expires\": \"never\", \"data\": {}}",
+])
+def test_malformed_file(tmp_path, content):
+    cache = SnapshotCache(ttl=60, path=str(tmp_path))
+    (tmp_path / "1").mkdir()
+    (tmp_path / "1" / "1.json").write_text(content)
+    assert cache.get(1, 1) is None
+    # Replaced by the next snapshot
+    cache.set(1, 1, DATA)
+    assert cache.get(1, 1) == DATA
+
+
+def test_stale_file(tmp_path):
+    # Written by another worker or applet, which expired meanwhile
+    cache = SnapshotCache(ttl=60, path=str(tmp_path))
+    (tmp_path / "1").mkdir()
+    (tmp_path / "1" / "1.json").write_text(json.dumps({
+        "expires": 0, "data": DATA}))
+    assert cache.get(1, 1) is None
+
+
+def test_shared_file(tmp_path):
+    # Workers with the same directory share snapshots and invalidations
+    worker, other_worker = (SnapshotCache(ttl=60, path=str(tmp_path))
+                            for _ in range(2))
+    worker.set(1, 1, DATA)
+    assert other_worker.get(1, 1) == DATA
+    other_worker.invalidate(1)
+    assert worker.get(1, 1) is None
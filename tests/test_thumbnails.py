@@ -0,0 +1,53 @@
+import os
+
+from flask import Flask
+
+from mediapanel_beta import content_manager
+from mediapanel_beta.content_manager import thumbnails
+from mediapanel_beta.content_manager.serializers import AssetSerializer
+
+
+def make_thumbnail(source, target, size):
+    with open(target, "wb") as f:
+        f.write(b"\0" * 100)
+
+
+def cached_files(cache) -> list:
+    return [name for size in thumbnails.SIZE_BUCKETS
+            if os.path.isdir(os.path.join(cache.path, str(size)))
+            for name in os.listdir(os.path.join(cache.path, str(size)))]
+
+
+def test_evict(tmp_path, monkeypatch):
+    cache = thumbnails.ThumbnailCache(str(tmp_path / "cache"), max_size=450)
+    monkeypatch.setattr(cache, "generator", lambda source: make_thumbnail)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: scans.append(1) or evict())
+
+    for index in range(6):
+        source = tmp_path / ("%i.png" % index)
+        source.write_bytes(b"image")
+        cache._generate(str(source), 256)
+        assert len(cached_files(cache)) <= 4
+    # Scanned for the first thumbnail, then only when over the size
+    assert len(scans) == 3
+    assert cache._size == 400
+
+
+def test_thumbnail_url(tmp_path, monkeypatch):
+    app = Flask(__name__)
+    app.register_blueprint(content_manager.blueprint)
+    monkeypatch.setattr(thumbnails, "cache", thumbnails.ThumbnailCache(
+        str(tmp_path / "cache")))
+    monkeypatch.setattr(thumbnails.cache, "generator", lambda source: (
+        make_thumbnail if source.endswith(".png") else None))
+
+    serializer = AssetSerializer("device")
+    with app.test_request_context("/manage/device/aaaa0001/resources"):
+        row = type("Row", (), {"client_id": 1, "device_id": "aaaa0001",
+                               "filename": "image.png"})
+        assert serializer.thumbnail_url(row) == (
+            "/manage/device/1/thumbnail/aaaa0001/256/image.png")
+        row.filename = "document.pdf"
+        assert serializer.thumbnail_url(row) is None
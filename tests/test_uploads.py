@@ -0,0 +1,101 @@
+import hashlib
+import os
+
+import pytest
+
+from mediapanel_beta.models import Asset
+
+DATA = bytes(range(256)) * 4
+URL = "/manage/group/1/resources/new"
+
+
+def start(client, filename="file.bin", size=len(DATA)) -> str:
+    response = client.post(URL, json={"filename": filename, "size": size})
+    assert response.status_code == 201
+    assert response.json["offset"] == 0
+    return response.json["upload_url"]
+
+
+def put(client, upload_url, start, end, data=None):
+    # `end` is exclusive, the header is inclusive
+    if data is None:
+        data = DATA[start:end]
+    return client.put(upload_url, data=data, headers={
+        "Content-Range": "bytes %i-%i/%i" % (start, end - 1, len(DATA))})
+
+
+def test_start_form(client):
+    # Form posts get JSON too, rather than a redirect
+    response = client.post(URL, data={"filename": "file.bin",
+                                      "size": str(len(DATA))})
+    assert response.status_code == 201
+    assert response.json["size"] == len(DATA)
+
+
+def test_upload(app, client):
+    upload_url = start(client)
+    assert put(client, upload_url, 0, 100).json["offset"] == 100
+    # Resuming continues from the offset the server has
+    assert client.get(upload_url).json["offset"] == 100
+    assert put(client, upload_url, 100, len(DATA)).json["offset"] == len(DATA)
+
+    response = client.post(upload_url, json={
+        "sha256": hashlib.sha256(DATA).hexdigest()})
+    assert response.status_code == 201
+    with app.app_context():
+        asset = Asset.query.one()
+        assert asset.filename == "file.bin"
+    path = os.path.join(app.config["RESOURCES_FOLDER"], "1", "1", "uploaded",
+                        "file.bin")
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert client.get(upload_url).status_code == 404
+
+
+def test_finalize_unique_name(app, client):
+    for filename in ("file.bin", "file_1.bin"):
+        upload_url = start(client)
+        put(client, upload_url, 0, len(DATA))
+        response = client.post(upload_url)
+        assert response.status_code == 201
+        assert response.json["filename"] == filename
+
+
+def test_wrong_offset(client):
+    upload_url = start(client)
+    put(client, upload_url, 0, 100)
+    response = put(client, upload_url, 200, 300)
+    assert response.status_code == 409
+    assert client.get(upload_url).json["offset"] == 100
+
+
+@pytest.mark.parametrize("headers", [
+    # Past the end of the file
+    {"Content-Range": "bytes 1000-1099/%i" % len(DATA)},
+    # Size of a different file
+    {"Content-Range": "bytes 0-99/%i" % (len(DATA) + 1)},
+    # More bytes than the range
+    {"Content-Range": "bytes 0-49/%i" % len(DATA)},
+    {"Content-Range": "invalid"},
+])
+def test_invalid_range(client, headers):
+    upload_url = start(client)
+    response = client.put(upload_url, data=DATA[:100], headers=headers)
+    assert response.status_code == 416
+    assert client.get(upload_url).json["offset"] == 0
+
+
+def test_sha256_mismatch(client):
+    upload_url = start(client)
+    put(client, upload_url, 0, len(DATA))
+    response = client.post(upload_url, json={
+        "sha256": hashlib.sha256(b"other").hexdigest()})
+    assert response.status_code == 422
+    # The upload is kept, so finalizing can be retried
+    assert client.get(upload_url).json["offset"] == len(DATA)
+
+
+def test_incomplete(client):
+    upload_url = start(client)
+    put(client, upload_url, 0, 100)
+    assert client.post(upload_url).status_code == 409
@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import pytest
+
+from mediapanel_beta import auth
+from mediapanel_beta.models import Client, User, db
+
+
+@pytest.fixture
+def user_cache(monkeypatch):
+    user_cache = auth.UserCache(ttl=60)
+    monkeypatch.setattr(auth, "user_cache", user_cache)
+    return user_cache
+
+
+def cached(app, user_cache) -> bool:
+    # Whether the user is served from the cache, without a query
+    with app.app_context():
+        return user_cache.get(1) is not None
+
+
+def test_cached(app, user_cache):
+    with app.app_context():
+        assert auth.get_user(1).user_id == 1
+    assert cached(app, user_cache)
+    with app.app_context():
+        # Attached to the session of the new request
+        user = auth.get_user(1)
+        assert user in db.session
+        assert user.client.client_id == 1
+
+
+def test_disabled(app, user_cache):
+    user_cache.ttl = 0
+    with app.app_context():
+        auth.get_user(1)
+    assert not cached(app, user_cache)
+
+
+def test_expired(app, user_cache, monkeypatch):
+    with app.app_context():
+        auth.get_user(1)
+    # Only the clock of `auth`
+    monkeypatch.setattr(auth, "time", SimpleNamespace(
+        time=lambda: float("inf")))
+    assert not cached(app, user_cache)
+
+
+def test_user_updated(app, user_cache):
+    with app.app_context():
+        auth.get_user(1)
+        User.query.get(1).first_name = "Changed"
+        db.session.commit()
+    assert not cached(app, user_cache)
+    with app.app_context():
+        assert auth.get_user(1).first_name == "Changed"
+
+
+def test_user_deleted(app, user_cache):
+    with app.app_context():
+        auth.get_user(1)
+        db.session.delete(User.query.get(1))
+        db.session.commit()
+    assert not cached(app, user_cache)
+    with app.app_context():
+        assert auth.get_user(1) is None
+
+
+def test_client_updated(app, user_cache):
+    with app.app_context():
+        auth.get_user(1)
+        Client.query.get(1).email = "changed@example.com"
+        db.session.commit()
+    assert not cached(app, user_cache)
+    with app.app_context():
+        assert auth.get_user(1).client.email == "changed@example.com"
+
+
+def test_max_size(app):
+    user_cache = auth.UserCache(ttl=60, max_size=1)
+    with app.app_context():
+        user = User.query.get(1)
+        user_cache.set(user)
+        other = User(user_id=2, client_id=1)
+        user_cache.set(other)
+        assert user_cache.get(1) is None
+        assert user_cache.get(2) is other